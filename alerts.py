@@ -0,0 +1,200 @@
+"""
+盤中價格警示 - 依使用者設定的價格 / 漲跌幅門檻，在價格穿越門檻時發出通知
+每個 (欄位, 方向) 建一個排序過的門檻索引，每次檢查只比較各標的目前位置兩側的門檻，
+不必逐條比對所有規則；同一條規則在冷卻時間內不會重複觸發
+"""
+
+import json
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+ALERT_RULES_PATH = os.getenv('ALERT_RULES_PATH', 'alerts.json')
+# 同一條規則觸發後的冷卻秒數，避免價格在門檻附近來回時連續通知
+ALERT_COOLDOWN_SECONDS = float(os.getenv('ALERT_COOLDOWN_MINUTES', '30')) * 60
+
+FIELDS = ('price', 'change_pct')
+OPS = ('above', 'below')
+FIELD_LABELS = {'price': '價格', 'change_pct': '漲跌幅'}
+OP_LABELS = {'above': '突破', 'below': '跌破'}
+
+
+@dataclass(frozen=True)
+class AlertRule:
+    """單一警示規則：ticker 的 field 往 op 方向穿越 threshold 時觸發"""
+    ticker: str
+    field: str
+    op: str
+    threshold: float
+    note: str = ''
+
+    def __post_init__(self):
+        if self.field not in FIELDS:
+            raise ValueError(f"不支援的警示欄位: {self.field}")
+        if self.op not in OPS:
+            raise ValueError(f"不支援的警示方向: {self.op}")
+
+    def describe(self):
+        unit = '%' if self.field == 'change_pct' else ''
+        return f"{self.ticker} {FIELD_LABELS[self.field]}{OP_LABELS[self.op]} {self.threshold:g}{unit}"
+
+
+def load_rules(path=ALERT_RULES_PATH):
+    """讀取警示規則 JSON (物件陣列)，檔案不存在時回傳空清單"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            items = json.load(f)
+    except FileNotFoundError:
+        return []
+    return [AlertRule(item['ticker'], item['field'], item['op'], float(item['threshold']),
+                      item.get('note', '')) for item in items]
+
+
+class ThresholdIndex:
+    """同一 (欄位, 方向) 的所有門檻，依 (標的, 門檻) 排序後每支標的佔一段連續區間
+
+    每支標的記住目前數值落在自己區間中的位置 (游標)，每次檢查只需和游標兩側的
+    門檻比較；只有穿越了門檻的標的才需要二分搜尋新位置，被跨過的那一段就是觸發的規則
+    """
+
+    def __init__(self, ticker_rows, thresholds, positions, op, n_tickers):
+        self.op = op
+        # above 的游標 = 門檻 <= 數值的個數；below 的游標 = 門檻 < 數值的個數
+        self.side = 'right' if op == 'above' else 'left'
+        # 門檻換成名次後與標的序號組成整數鍵，(標的, 門檻) 的排序就是鍵的排序
+        self.levels = np.unique(thresholds)
+        self.stride = len(self.levels) + 1
+        keys = ticker_rows * self.stride + np.searchsorted(self.levels, thresholds)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.positions = positions[order]
+        # 前後各補一個無限大，游標兩側的門檻可直接以 padded[c] / padded[c + 1] 取得
+        self.padded = np.concatenate([[-np.inf], thresholds[order], [np.inf]])
+        boundaries = np.searchsorted(self.keys, np.arange(n_tickers + 1) * self.stride)
+        self.start, self.end = boundaries[:-1], boundaries[1:]
+        self.cursor = np.full(n_tickers, -1, dtype='int64')  # -1 表示尚未建立基準
+        # 游標兩側的門檻；尚未建立基準時設成任何數值都會「移動」
+        self.lower = np.full(n_tickers, np.inf)
+        self.upper = np.full(n_tickers, -np.inf)
+
+    def locate(self, rows, values):
+        """數值在各標的區間中的位置 (絕對索引)"""
+        ranks = np.searchsorted(self.levels, values, side=self.side)
+        return np.searchsorted(self.keys, rows * self.stride + ranks)
+
+    def update(self, rows, values):
+        """移動游標並回傳這次被穿越的規則位置 (缺資料 NaN 的標的不會移動)
+
+        above：前值 < 門檻 <= 現值；below：現值 <= 門檻 < 前值
+        """
+        lower, upper = self.lower[rows], self.upper[rows]
+        if self.side == 'right':
+            moved = (values < lower) | (values >= upper)
+        else:
+            moved = (values <= lower) | (values > upper)
+        if not moved.any():
+            return np.empty(0, dtype='int64')
+
+        rows, values = rows[moved], values[moved]
+        cursor = self.cursor[rows]
+        target = self.locate(rows, values)
+        self.cursor[rows] = target
+        self.lower[rows] = np.where(target > self.start[rows], self.padded[target], -np.inf)
+        self.upper[rows] = np.where(target < self.end[rows], self.padded[target + 1], np.inf)
+
+        # 第一次的數值只建立基準；往反方向移動只是重新布防，都不會觸發
+        based = cursor >= 0
+        if self.op == 'above':
+            up = based & (target > cursor)
+            return self.positions[_ranges(cursor[up], target[up])]
+        down = based & (target < cursor)
+        return self.positions[_ranges(target[down], cursor[down])]
+
+
+def _ranges(start, stop):
+    """把多段 [start, stop) 區間展開成一個索引陣列"""
+    lengths = stop - start
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype='int64')
+    offsets = np.repeat(start - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+
+class AlertEngine:
+    """以排序門檻索引評估所有警示規則
+
+    每支標的第一次出現的數值只用來建立基準，不會觸發；之後每次 evaluate
+    找出上次與這次數值之間被穿越的規則，再套用冷卻時間
+    """
+
+    def __init__(self, rules, cooldown=ALERT_COOLDOWN_SECONDS):
+        self.rules = list(rules)
+        self.cooldown = cooldown
+        self.tickers = sorted({rule.ticker for rule in self.rules})
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.last_fired = np.full(len(self.rules), -np.inf)
+
+        self.indexes = {}
+        for field in FIELDS:
+            for op in OPS:
+                positions = np.array([i for i, rule in enumerate(self.rules)
+                                      if rule.field == field and rule.op == op], dtype='int64')
+                if len(positions):
+                    self.indexes[field, op] = ThresholdIndex(
+                        np.array([self.ticker_index[self.rules[i].ticker] for i in positions], dtype='int64'),
+                        np.array([self.rules[i].threshold for i in positions], dtype='float64'),
+                        positions, op, len(self.tickers),
+                    )
+
+    def rows(self, tickers):
+        return np.array([self.ticker_index.get(ticker, -1) for ticker in tickers], dtype='int64')
+
+    def evaluate(self, tickers, values, now=None, rows=None):
+        """以這一批標的的最新數值評估規則，回傳觸發的規則 (已套用冷卻與去重)
+
+        values: {'price': 陣列, 'change_pct': 陣列}，與 tickers 對齊
+        rows: 可傳入預先算好的 self.rows(tickers) 省去查表
+        """
+        now = time.time() if now is None else now
+        rows = self.rows(tickers) if rows is None else rows
+        known = rows >= 0
+        rows = rows[known]
+        fired = []
+        for field in FIELDS:
+            if field not in values:
+                continue
+            # 缺資料的標的保留原本的位置，下次有資料時才比較
+            current = np.asarray(values[field], dtype='float64')[known]
+            for op in OPS:
+                index = self.indexes.get((field, op))
+                if index is not None:
+                    fired.append(index.update(rows, current))
+
+        positions = np.unique(np.concatenate(fired)) if fired else np.empty(0, dtype='int64')
+        positions = positions[now - self.last_fired[positions] >= self.cooldown]
+        self.last_fired[positions] = now
+        return [self.rules[i] for i in positions]
+
+
+def format_alerts(fired, latest=None):
+    """把觸發的規則整理成一則通知；完全相同的規則只列一次
+
+    latest: {ticker: (價格, 漲跌幅)}，提供時附上目前報價
+    """
+    lines, seen = [], set()
+    for rule in sorted(fired, key=lambda rule: (rule.ticker, rule.field, rule.op, rule.threshold)):
+        key = (rule.ticker, rule.field, rule.op, rule.threshold)
+        if key in seen:
+            continue
+        seen.add(key)
+        line = f"● {rule.describe()}"
+        if latest and rule.ticker in latest:
+            price, change_pct = latest[rule.ticker]
+            line += f" (現價 {price:.2f}, {change_pct:+.2f}%)"
+        if rule.note:
+            line += f" - {rule.note}"
+        lines.append(line)
+    return "🔔 盤中價格警示\n" + "\n".join(lines)
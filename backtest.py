@@ -0,0 +1,244 @@
+"""
+歷史回測 - 以價格快取中的日 K 線重播篩選條件：整個 (日期 × 標的) 矩陣一次運算，不逐日逐支迴圈
+每個交易日收盤後入選的標的以隔日開盤價買進、持有 N 日後以收盤價計算報酬，
+統計平均報酬、相對全股票池的超額報酬、勝率與名單週轉率；參數掃描以多個行程平行執行，
+各行程以記憶體映射讀取同一份指標矩陣
+"""
+
+import os
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+from price_store import open_arrays, share_arrays, sync
+from screener import DEFAULT_RULES, min_avg_volume, price_between
+
+BACKTEST_YEARS = float(os.environ.get('BACKTEST_YEARS', 5))
+# 持有天數 (交易日)
+HORIZONS = (1, 5, 20)
+# 與線上篩選相同：均量取最近 5 個交易日
+VOLUME_WINDOW = 5
+# 參數掃描的預設範圍：價格區間 (元) 與日均量門檻 (張)
+SWEEP_PRICE_BANDS = ((10, 30), (20, 50), (30, 80), (50, 150))
+SWEEP_MIN_LOTS = (1000, 2000, 3000, 5000, 10000)
+
+# 回測可用的指標欄位 (技術指標的滾動狀態只有最新值，無法重播)
+METRIC_COLUMNS = ('close', 'prev_close', 'open', 'avg_volume', 'change_pct', 'gap_pct')
+
+
+def rolling_nanmean(matrix, window):
+    """沿日期方向的滾動平均 (忽略 NaN)，以累計和一次算出所有視窗"""
+    valid = ~np.isnan(matrix)
+    sums = np.cumsum(np.where(valid, matrix, 0.0), axis=0)
+    counts = np.cumsum(valid, axis=0)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts[window:] = counts[window:] - counts[:-window]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def shift(matrix, periods):
+    """沿日期方向平移 (正數往後移，空出的列補 NaN)"""
+    shifted = np.full_like(matrix, np.nan)
+    if periods > 0:
+        shifted[periods:] = matrix[:-periods]
+    elif periods < 0:
+        shifted[:periods] = matrix[-periods:]
+    else:
+        shifted[:] = matrix
+    return shifted
+
+
+def metric_matrices(matrices):
+    """由 OHLCV 矩陣算出每個交易日的篩選指標 (與 screener.compute_metrics 的欄位相同)"""
+    close, opens = matrices['Close'], matrices['Open']
+    prev_close = shift(close, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'close': close,
+            'prev_close': prev_close,
+            'open': opens,
+            'avg_volume': rolling_nanmean(matrices['Volume'], VOLUME_WINDOW),
+            'change_pct': (close / prev_close - 1) * 100,
+            'gap_pct': (opens / prev_close - 1) * 100,
+        }
+
+
+def forward_returns(matrices, horizons=HORIZONS):
+    """{持有天數: 報酬矩陣 (%)}：第 t 日收盤後入選，第 t+1 日開盤買進、第 t+h 日收盤賣出"""
+    entry = shift(matrices['Open'], -1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {h: (shift(matrices['Close'], -h) / entry - 1) * 100 for h in horizons}
+
+
+def rule_mask(rule, metrics):
+    """在 (日期 × 標的) 指標矩陣上套用 screener.Rule (與 Rule.mask 相同的端點規則)"""
+    if rule.column not in metrics:
+        raise ValueError(f"回測不支援的篩選欄位: {rule.column} ({rule.name})")
+    values = metrics[rule.column]
+    passed = np.ones(values.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        if rule.low is not None:
+            passed &= values > rule.low if rule.strict else values >= rule.low
+        if rule.high is not None:
+            passed &= values < rule.high if rule.strict else values <= rule.high
+    return passed
+
+
+def qualified_matrix(metrics, rules):
+    """每個交易日入選的標的 (布林矩陣)"""
+    mask = ~np.isnan(metrics['close'])
+    for rule in rules:
+        mask &= rule_mask(rule, metrics)
+    return mask
+
+
+def evaluate(mask, returns, benchmarks):
+    """統計一組入選矩陣：{持有天數: 指標}，以及名單週轉率
+
+    平均報酬與超額報酬以每日等權的入選組合計算後再對訊號日平均；勝率以個別入選標的計算；
+    週轉率為前後兩日都有名單時，今日名單中新進標的的比例
+    """
+    stats = {}
+    for h, forward in returns.items():
+        valid = mask & ~np.isnan(forward)
+        counts = valid.sum(axis=1)
+        days = counts > 0
+        if not days.any():
+            stats[h] = {'signal_days': 0, 'avg_picks': 0.0, 'mean_return': np.nan, 'excess_return': np.nan,
+                        'hit_rate': np.nan}
+            continue
+        daily = np.where(valid, forward, 0.0).sum(axis=1)[days] / counts[days]
+        stats[h] = {
+            'signal_days': int(days.sum()),
+            'avg_picks': float(counts[days].mean()),
+            'mean_return': float(daily.mean()),
+            'excess_return': float(np.nanmean(daily - benchmarks[h][days])),
+            'hit_rate': float((valid & (forward > 0)).sum() / counts.sum() * 100),
+        }
+    size = mask[1:].sum(axis=1)
+    both = (size > 0) & (mask[:-1].sum(axis=1) > 0)
+    kept = (mask[1:] & mask[:-1]).sum(axis=1)
+    turnover = float(np.mean(1 - kept[both] / size[both]) * 100) if both.any() else np.nan
+    return stats, turnover
+
+
+# 工作行程中的指標矩陣、前瞻報酬與基準 (平行掃描時為 share_arrays 寫出的唯讀記憶體映射)
+_shared = {}
+
+
+def _flatten(metrics, returns, benchmarks):
+    arrays = {f"metrics.{name}": matrix for name, matrix in metrics.items()}
+    arrays.update({f"returns.{h}": matrix for h, matrix in returns.items()})
+    arrays.update({f"benchmarks.{h}": series for h, series in benchmarks.items()})
+    return arrays
+
+
+def _init_worker(directory):
+    """工作行程啟動時映射父行程寫出的矩陣：所有行程共用作業系統的同一份分頁，不會各自複製一份"""
+    groups = {'metrics': {}, 'returns': {}, 'benchmarks': {}}
+    for name, array in open_arrays(directory).items():
+        group, key = name.split('.', 1)
+        groups[group][key if group == 'metrics' else int(key)] = array
+    _shared.update(groups)
+
+
+def _evaluate_rules(rules):
+    mask = qualified_matrix(_shared['metrics'], rules)
+    return evaluate(mask, _shared['returns'], _shared['benchmarks'])
+
+
+def sweep_rules(price_bands=SWEEP_PRICE_BANDS, min_lots=SWEEP_MIN_LOTS):
+    """參數掃描的條件組合 [(標籤, 條件)]"""
+    return [(f"{low}-{high} 元, 均量 > {lots} 張", (price_between(low, high), min_avg_volume(lots * 1000)))
+            for low, high in price_bands for lots in min_lots]
+
+
+def prepare(matrices, horizons=HORIZONS):
+    """回測用的指標矩陣、前瞻報酬與每日全股票池的平均報酬 (各組條件共用)"""
+    metrics = metric_matrices(matrices)
+    returns = forward_returns(matrices, horizons)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # 整列缺資料時 nanmean 會警告
+        benchmarks = {h: np.nanmean(forward, axis=1) for h, forward in returns.items()}
+    return metrics, returns, benchmarks
+
+
+def run_sweep(matrices, candidates, horizons=HORIZONS, workers=None):
+    """對每組條件回測，回傳 [(標籤, {持有天數: 指標}, 週轉率)]
+
+    workers: 平行行程數 (預設為 CPU 核心數，1 為不開子行程)；各組條件互不相依，依序分配給各行程。
+    平行時指標矩陣只寫出一份暫存 .npy 讓各行程映射，不經由序列化傳給每個行程
+    """
+    metrics, returns, benchmarks = prepare(matrices, horizons)
+    labels, rule_sets = zip(*candidates) if candidates else ((), ())
+    workers = min(workers or os.cpu_count() or 1, len(rule_sets)) or 1
+    if workers == 1:
+        _shared.update(metrics=metrics, returns=returns, benchmarks=benchmarks)
+        results = [_evaluate_rules(rules) for rules in rule_sets]
+    else:
+        with tempfile.TemporaryDirectory(prefix='backtest-') as directory:
+            share_arrays(directory, _flatten(metrics, returns, benchmarks))
+            del metrics, returns, benchmarks
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(directory,)) as executor:
+                results = list(executor.map(_evaluate_rules, rule_sets))
+    return [(label, stats, turnover) for label, (stats, turnover) in zip(labels, results)]
+
+
+def load_history(tickers, years=BACKTEST_YEARS, offline=False):
+    """讀出最近 years 年的 (日期 × 標的) 矩陣；offline=False 時先補抓快取中缺少的較早歷史
+
+    矩陣由欄位式價格存放區讀出，存放區只併入上次回測之後價格快取新寫入的 K 棒
+    """
+    import price_cache
+
+    since = date.today() - timedelta(days=int(years * 365.25))
+    if not offline:
+        stats = {}
+        start_time = time.perf_counter()
+        count = price_cache.backfill(tickers, since, stats=stats)
+        if count:
+            print(f"   💾 補抓 {count} 支標的 {since} 起的歷史: 新增 {stats['rows']} 筆 K 棒, "
+                  f"失敗 {len(stats.get('failed', []))} 支, 耗時 {time.perf_counter() - start_time:.1f} 秒")
+    return sync(tickers, since).matrices(list(tickers), since=since)
+
+
+def format_results(results, horizons=HORIZONS):
+    """回測結果表格 (每個持有天數一段)"""
+    lines = []
+    width = max((len(label) for label, _, _ in results), default=10) + 2
+    for h in horizons:
+        lines.append(f"\n📈 持有 {h} 日 (隔日開盤買進)")
+        lines.append(f"   {'條件':<{width}} {'訊號日':>6} {'平均入選':>8} {'平均報酬':>8} {'超額報酬':>8} "
+                     f"{'勝率':>7} {'週轉率':>7}")
+        for label, stats, turnover in results:
+            s = stats[h]
+            lines.append(f"   {label:<{width}} {s['signal_days']:>6} {s['avg_picks']:>9.1f} {s['mean_return']:>+9.2f}% "
+                         f"{s['excess_return']:>+9.2f}% {s['hit_rate']:>6.1f}% {turnover:>6.1f}%")
+    return "\n".join(lines)
+
+
+def run_backtest(tickers, years=BACKTEST_YEARS, sweep=False, rules=None, workers=None, offline=False,
+                 horizons=HORIZONS):
+    """回測入口：讀取歷史後以目前的篩選條件 (sweep=True 時改為參數掃描) 重播，輸出統計表並回傳結果"""
+    rules = DEFAULT_RULES if rules is None else rules
+    print(f"🧪 回測 {len(tickers)} 支標的, 最近 {years:g} 年...")
+    start_time = time.perf_counter()
+    dates, matrices = load_history(tickers, years, offline)
+    if len(dates) < 2:
+        print("⚠️ 價格快取中沒有足夠的歷史資料")
+        return []
+    print(f"   📂 讀取 {len(dates)} 個交易日 ({dates[0]} ~ {dates[-1]}), "
+          f"耗時 {time.perf_counter() - start_time:.2f} 秒")
+
+    candidates = sweep_rules() if sweep else [("目前條件", tuple(rules))]
+    start_time = time.perf_counter()
+    results = run_sweep(matrices, candidates, horizons, workers)
+    print(format_results(results, horizons))
+    print(f"\n⏱️  {len(candidates)} 組條件回測耗時 {time.perf_counter() - start_time:.2f} 秒")
+    return results
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+警示引擎效能比較 - 逐條規則比對 vs 排序門檻索引 (AlertEngine)
+以合成的規則與隨機漫步報價模擬盤中每次檢查，不需要網路
+
+用法：
+    python benchmarks/bench_alerts.py
+    python benchmarks/bench_alerts.py --rules 10000 50000 --tickers 2000 --ticks 200
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alerts import AlertEngine, AlertRule  # noqa: E402
+
+
+def make_rules(n_rules, n_tickers, seed=0):
+    """在每支標的目前價位附近隨機產生價格與漲跌幅門檻"""
+    rng = np.random.default_rng(seed)
+    tickers = [f"{1000 + i}.TW" for i in range(n_tickers)]
+    base = rng.uniform(10, 800, n_tickers)
+    rules = []
+    for _ in range(n_rules):
+        t = int(rng.integers(n_tickers))
+        op = 'above' if rng.random() < 0.5 else 'below'
+        if rng.random() < 0.7:
+            threshold = round(base[t] * (1 + rng.normal(0, 0.03)), 1)
+            rules.append(AlertRule(tickers[t], 'price', op, threshold))
+        else:
+            rules.append(AlertRule(tickers[t], 'change_pct', op, round(float(rng.normal(0, 4)), 1)))
+    return tickers, base, rules
+
+
+def make_ticks(base, n_ticks, seed=1):
+    """每次檢查的 (價格, 漲跌幅)：以開盤價為基準的隨機漫步"""
+    rng = np.random.default_rng(seed)
+    steps = np.cumprod(1 + rng.normal(0, 0.004, (n_ticks, len(base))), axis=0)
+    prices = base * steps
+    return [{'price': prices[i], 'change_pct': (steps[i] - 1) * 100} for i in range(n_ticks)]
+
+
+class LinearScan:
+    """對照組：每次檢查都逐條比對所有規則"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.previous = {}
+
+    def evaluate(self, tickers, values):
+        current = {field: dict(zip(tickers, array)) for field, array in values.items()}
+        fired = []
+        for rule in self.rules:
+            now = current[rule.field].get(rule.ticker)
+            before = self.previous.get((rule.field, rule.ticker))
+            if now is None or before is None:
+                continue
+            if (rule.op == 'above' and before < rule.threshold <= now) or \
+                    (rule.op == 'below' and now <= rule.threshold < before):
+                fired.append(rule)
+        for field, mapping in current.items():
+            for ticker, value in mapping.items():
+                self.previous[field, ticker] = value
+        return fired
+
+
+def run(engine_factory, tickers, ticks, **kwargs):
+    """回傳每次檢查的耗時 (秒) 與觸發的規則集合"""
+    engine = engine_factory()
+    timings, fired = [], []
+    for i, values in enumerate(ticks):
+        start = time.perf_counter()
+        result = engine.evaluate(tickers, values, **kwargs)
+        timings.append(time.perf_counter() - start)
+        fired.append({(rule.ticker, rule.field, rule.op, rule.threshold) for rule in result})
+    return np.array(timings[1:]), fired
+
+
+def main():
+    parser = argparse.ArgumentParser(description="警示引擎效能比較")
+    parser.add_argument('--rules', type=int, nargs='+', default=[1000, 10000, 50000], help="規則數")
+    parser.add_argument('--tickers', type=int, default=2000, help="標的數")
+    parser.add_argument('--ticks', type=int, default=100, help="模擬的檢查次數")
+    args = parser.parse_args()
+
+    print(f"⏱️  警示引擎效能比較 ({args.tickers} 支標的, {args.ticks} 次檢查)")
+    print(f"   {'規則數':>6} | {'逐條比對 p50':>12} | {'索引 p50':>10} | {'索引 p99':>10} | {'加速':>6} | 觸發")
+    for n_rules in args.rules:
+        tickers, base, rules = make_rules(n_rules, args.tickers)
+        ticks = make_ticks(base, args.ticks)
+
+        linear_times, linear_fired = run(lambda: LinearScan(rules), tickers, ticks)
+        # 冷卻設為 0 才能與逐條比對的結果逐次比較；標的序號只需查一次
+        engine = AlertEngine(rules, cooldown=0)
+        rows = engine.rows(tickers)
+        indexed_times, indexed_fired = run(lambda: engine, tickers, ticks, rows=rows)
+        assert [set(f) for f in linear_fired] == [set(f) for f in indexed_fired], "索引結果與逐條比對不一致"
+
+        linear_p50 = np.median(linear_times)
+        indexed_p50, indexed_p99 = np.median(indexed_times), np.percentile(indexed_times, 99)
+        print(f"   {n_rules:>6} | {linear_p50 * 1000:>10.3f}ms | {indexed_p50 * 1000:>8.3f}ms | "
+              f"{indexed_p99 * 1000:>8.3f}ms | {linear_p50 / indexed_p50:>5.0f}x | "
+              f"{sum(len(f) for f in indexed_fired)}")
+
+
+if __name__ == "__main__":
+    main()
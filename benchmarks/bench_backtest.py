@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+回測效能 - 以合成的 (日期 × 標的) 日 K 線比較：
+逐日呼叫 screener.screen 重播 (線上流程的寫法，取部分交易日外推) vs 整個矩陣一次運算，
+以及參數掃描單一行程與多行程平行的耗時；加上 --cache 時另外量測從 SQLite 價格快取讀出矩陣
+與欄位式價格存放區 (建立、開啟、每日附加) 的時間，加上 --memory 時比較平行掃描各工作行程
+以序列化傳入矩陣與映射共用檔案的記憶體用量 (PSS，以 spawn 啟動行程，只支援 Linux)
+
+用法：
+    python benchmarks/bench_backtest.py
+    python benchmarks/bench_backtest.py --tickers 1800 --years 5 --workers 1 2 4 --cache --memory
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backtest  # noqa: E402
+from backtest import VOLUME_WINDOW, prepare, run_sweep, sweep_rules  # noqa: E402
+from price_cache import FIELDS  # noqa: E402
+from screener import screen  # noqa: E402
+
+
+def make_matrices(n_tickers, n_days, seed=0):
+    """合成日 K 線矩陣：價格 5-300 元的隨機漫步，約 1/5 的標的在期間中才上市"""
+    rng = np.random.default_rng(seed)
+    base = np.exp(rng.uniform(np.log(5), np.log(300), n_tickers))
+    close = base * np.cumprod(1 + rng.normal(0.0003, 0.02, (n_days, n_tickers)), axis=0)
+    opens = close * (1 + rng.normal(0, 0.005, close.shape))
+    volume = np.exp(rng.normal(np.log(2e6), 1.2, n_tickers)) * rng.lognormal(0, 0.4, close.shape)
+    listed = np.where(rng.random(n_tickers) < 0.2, rng.integers(0, n_days, n_tickers), 0)
+    missing = np.arange(n_days)[:, None] < listed[None, :]
+    matrices = {'Open': opens, 'High': close * 1.02, 'Low': close * 0.98, 'Close': close, 'Volume': volume}
+    for matrix in matrices.values():
+        matrix[missing] = np.nan
+    return matrices
+
+
+def daily_replay(matrices, tickers, days, rules):
+    """線上流程的寫法：每個交易日組出最近 5 日的 yf.download 格式資料表後呼叫 screen"""
+    dates = pd.bdate_range(end="2024-01-31", periods=len(matrices['Close']))
+    columns = pd.MultiIndex.from_product([tickers, FIELDS])
+    picks = 0
+    for t in days:
+        window = slice(max(t - VOLUME_WINDOW + 1, 0), t + 1)
+        values = np.stack([matrices[field][window] for field in FIELDS], axis=2).reshape(-1, len(tickers) * len(FIELDS))
+        data = pd.DataFrame(values, index=dates[window], columns=columns)
+        picks += int(screen(data, tickers, rules=rules)['qualified'].sum())
+    return picks
+
+
+def build_cache(matrices, tickers, path):
+    """把矩陣寫入暫存的 SQLite 價格快取"""
+    import price_cache
+
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=len(matrices['Close']))
+    conn = price_cache.connect(path)
+    frames = {ticker: pd.DataFrame({field: matrices[field][:, i] for field in FIELDS}, index=dates)
+              for i, ticker in enumerate(tickers)}
+    price_cache.store_frames(conn, frames)
+    conn.close()
+    return dates
+
+
+def _init_copy(metrics, returns, benchmarks):
+    """舊寫法：矩陣隨 initargs 序列化傳給每個工作行程"""
+    backtest._shared.update(metrics=metrics, returns=returns, benchmarks=benchmarks)
+
+
+def _worker_pss(rules):
+    """在工作行程中跑一組條件後回報本行程的 PSS (MB，共用分頁依共用行程數分攤)"""
+    backtest._evaluate_rules(rules)
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def worker_memory(matrices, candidates, workers):
+    """兩種傳遞方式下各工作行程的平均 PSS 與整個行程池的合計 (spawn 不會繼承父行程的記憶體)"""
+    metrics, returns, benchmarks = prepare(matrices)
+    context = multiprocessing.get_context('spawn')
+    rules = [rules for _, rules in candidates[:workers]]
+    results = {}
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_copy,
+                             initargs=(metrics, returns, benchmarks)) as executor:
+        results['序列化傳入'] = list(executor.map(_worker_pss, rules))
+    with tempfile.TemporaryDirectory(prefix='backtest-') as directory:
+        backtest.share_arrays(directory, backtest._flatten(metrics, returns, benchmarks))
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=backtest._init_worker,
+                                 initargs=(directory,)) as executor:
+            results['映射共用檔案'] = list(executor.map(_worker_pss, rules))
+    size = sum(a.nbytes for group in (metrics, returns, benchmarks) for a in group.values()) / 2**20
+    return size, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回測效能")
+    parser.add_argument('--tickers', type=int, default=1800, help="標的數")
+    parser.add_argument('--years', type=float, default=5, help="年數 (每年 250 個交易日)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1], help="平行行程數")
+    parser.add_argument('--replay-days', type=int, default=20, help="逐日重播實際執行的交易日數 (其餘外推)")
+    parser.add_argument('--cache', action='store_true', help="另外量測 SQLite 價格快取與欄位式存放區讀出矩陣的時間")
+    parser.add_argument('--memory', action='store_true', help="另外比較平行掃描各工作行程的記憶體用量")
+    args = parser.parse_args()
+
+    n_days = int(args.years * 250)
+    tickers = [f"{1000 + i}.TW" for i in range(args.tickers)]
+    matrices = make_matrices(args.tickers, n_days)
+    candidates = sweep_rules()
+    print(f"🧪 回測效能 ({args.tickers} 支 × {n_days} 個交易日, 參數掃描 {len(candidates)} 組, CPU {os.cpu_count()} 核)")
+
+    if args.cache:
+        import price_cache
+        import price_store
+
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, 'prices.sqlite')
+            store_path = os.path.join(workdir, 'price_store')
+            start = time.perf_counter()
+            dates = build_cache(matrices, tickers, path)
+            print(f"   寫入暫存價格快取                   {time.perf_counter() - start:>8.2f}s  (只在第一次下載時發生)")
+            conn = price_cache.connect(path)
+            since = dates[0].date()
+            start = time.perf_counter()
+            price_cache.load_matrix(conn, tickers, since=since - pd.Timedelta(days=1))
+            print(f"   SQLite 讀出 (日期 × 標的) 矩陣       {time.perf_counter() - start:>8.2f}s")
+            conn.close()
+            start = time.perf_counter()
+            price_store.sync(tickers, since, path=store_path, db_path=path)
+            print(f"   建立欄位式存放區                   {time.perf_counter() - start:>8.2f}s  (只在第一次回測時發生)")
+            start = time.perf_counter()
+            price_store.sync(tickers, since, path=store_path, db_path=path).matrices(tickers, since=since)
+            print(f"   存放區同步 + 讀出矩陣               {time.perf_counter() - start:>8.2f}s")
+            conn = price_cache.connect(path)
+            next_day = dates[-1] + pd.offsets.BDay(1)
+            price_cache.store_frames(conn, {ticker: pd.DataFrame({field: [matrices[field][-1, i]] for field in FIELDS},
+                                                                 index=[next_day]) for i, ticker in enumerate(tickers)})
+            conn.close()
+            start = time.perf_counter()
+            price_store.sync(tickers, since, path=store_path, db_path=path)
+            print(f"   存放區附加一個交易日                {time.perf_counter() - start:>8.2f}s")
+            size = sum(os.path.getsize(os.path.join(store_path, name)) for name in os.listdir(store_path))
+            print(f"   存放區大小 {size / 2**20:.0f} MB, SQLite {os.path.getsize(path) / 2**20:.0f} MB")
+
+    replay_days = np.linspace(VOLUME_WINDOW, n_days - 1, args.replay_days).astype(int)
+    start = time.perf_counter()
+    daily_replay(matrices, tickers, replay_days, candidates[0][1])
+    per_day = (time.perf_counter() - start) / len(replay_days)
+    print(f"   逐日 screen() 重播 1 組條件            {per_day * n_days:>8.2f}s  (實測 {len(replay_days)} 日外推)")
+    print(f"   逐日 screen() 重播 {len(candidates)} 組條件           {per_day * n_days * len(candidates):>8.2f}s  (外推)")
+
+    start = time.perf_counter()
+    prepare(matrices)
+    print(f"   向量化: 指標與前瞻報酬矩陣              {time.perf_counter() - start:>8.2f}s")
+    for workers in dict.fromkeys(args.workers):
+        start = time.perf_counter()
+        run_sweep(matrices, candidates[:1], workers=1)
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        run_sweep(matrices, candidates, workers=workers)
+        print(f"   向量化: 1 組 / {len(candidates)} 組條件 ({workers} 個行程)      "
+              f"{single:>6.2f}s / {time.perf_counter() - start:.2f}s")
+
+    if args.memory:
+        workers = max(max(args.workers), 2)
+        size, results = worker_memory(matrices, candidates, workers)
+        print(f"\n🧠 平行掃描的工作行程記憶體 ({workers} 個行程, 指標與報酬矩陣 {size:.0f} MB)")
+        for label, pss in results.items():
+            print(f"   {label:<10} 每個行程 PSS {sum(pss) / len(pss):>7.1f} MB, 合計 {sum(pss):>7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
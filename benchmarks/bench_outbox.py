@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+推播外送匣效能 - 以本機模擬的 Discord Webhook (依機率回應 429 與 Retry-After) 比較：
+舊寫法 (每個對象依序送出各分段、429 最多重試 3 次後放棄但仍回報成功) 與外送匣 (背景分道並行、
+暫時性錯誤持續退避重試)，量測推播函式回傳前的耗時、全部送達的耗時、遺失的分段數，
+以及同一天重跑時重複送出的分段數；不需要網路
+
+用法：
+    python benchmarks/bench_outbox.py
+    python benchmarks/bench_outbox.py --targets 50 --paragraphs 40 --rate-limit 0.4 --latency 0.02
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FlakyWebhook(BaseHTTPRequestHandler):
+    """模擬 Discord Webhook：每個請求延遲 latency 秒，以 rate_limit 的機率回應 429 (Retry-After 0.05 秒)"""
+    latency = 0.0
+    rate_limit = 0.0
+    received = Counter()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latency)
+        if random.random() < self.rate_limit:
+            payload = b'{"retry_after": 0.05}'
+            self.send_response(429)
+            self.send_header('Retry-After', '0.05')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        with self.lock:
+            self.received[(self.path, body)] += 1
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def legacy_send_discord(stock_bot, message, webhook_url, max_retries=3):
+    """舊版 send_discord_message：429 重試 max_retries 次後放棄該分段，但整體仍回傳 True"""
+    session = stock_bot.get_discord_session()
+    for payload in stock_bot.pack_discord_payloads(message, use_embeds=stock_bot.DISCORD_USE_EMBEDS):
+        for attempt in range(max_retries + 1):
+            response = session.post(webhook_url, json=payload, timeout=10)
+            wait = stock_bot.discord_wait_seconds(response)
+            if response.status_code != 429 or attempt == max_retries:
+                break
+            time.sleep(wait)
+        if wait:
+            time.sleep(wait)
+    return True
+
+
+def make_message(paragraphs, seed):
+    rng = random.Random(seed)
+    return "\n\n".join(f"● 段落 {i}: " + "台股產業新聞摘要內容" * rng.randint(20, 60) for i in range(paragraphs))
+
+
+def delivered(expected):
+    """(送達的分段數, 重複送達的分段數)"""
+    with FlakyWebhook.lock:
+        received = dict(FlakyWebhook.received)
+    got = sum(1 for key in expected if received.get(key))
+    duplicates = sum(max(received.get(key, 0) - 1, 0) for key in expected)
+    return got, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推播外送匣效能")
+    parser.add_argument('--targets', type=int, default=20, help="Discord Webhook 數 (推播對象)")
+    parser.add_argument('--paragraphs', type=int, default=30, help="每則訊息的段落數")
+    parser.add_argument('--rate-limit', type=float, default=0.3, help="模擬伺服器回應 429 的機率")
+    parser.add_argument('--latency', type=float, default=0.01, help="模擬伺服器每個請求的延遲秒數")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    FlakyWebhook.latency, FlakyWebhook.rate_limit = args.latency, args.rate_limit
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyWebhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ['STOCK_BOT_CACHE_DIR'] = cache_dir
+        import stock_bot
+
+        stock_bot.DELIVERY_RETRY_POLICY.base_delay = 0.05
+        message = make_message(args.paragraphs, args.seed)
+        payloads = stock_bot.pack_discord_payloads(message, use_embeds=stock_bot.DISCORD_USE_EMBEDS)
+        webhooks = [f"{endpoint}/webhook/{i}" for i in range(args.targets)]
+        print(f"📮 推播 {args.targets} 個對象 × {len(payloads)} 個請求, 429 機率 {args.rate_limit:.0%}, "
+              f"每個請求延遲 {args.latency * 1000:.0f}ms")
+        print(f"   {'寫法':<16} {'回傳前':>8} {'全部送達':>9} {'遺失分段':>8} {'重跑後重複':>10}")
+
+        # 伺服器收到的 (路徑, 請求內容)，requests 以 json.dumps 的預設格式序列化 payload
+        expected = [(f"/webhook/{i}", json.dumps(payload).encode()) for i in range(args.targets) for payload in payloads]
+
+        # 舊寫法：與舊版 deliver_reports 相同，以 DELIVERY_CONCURRENCY 個執行緒同時送給各對象
+        FlakyWebhook.received.clear()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=stock_bot.DELIVERY_CONCURRENCY) as executor:
+            list(executor.map(lambda url: legacy_send_discord(stock_bot, message, url), webhooks))
+        elapsed = time.perf_counter() - start
+        got, _ = delivered(expected)
+        with ThreadPoolExecutor(max_workers=stock_bot.DELIVERY_CONCURRENCY) as executor:
+            list(executor.map(lambda url: legacy_send_discord(stock_bot, message, url), webhooks))
+        _, duplicates = delivered(expected)
+        total = len(expected)
+        print(f"   {'逐一送出 (舊)':<16} {elapsed:>7.2f}s {elapsed:>8.2f}s {total - got:>8} {duplicates:>10}")
+
+        # 外送匣：排入後立即回傳，背景分道並行送出；同一天重跑時以冪等鍵略過已送達的分段
+        FlakyWebhook.received.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for url in webhooks:
+                stock_bot.enqueue_message('Discord', url, message, topic='report')
+            queued = time.perf_counter() - start
+            stock_bot.wait_for_delivery(timeout=600)
+            elapsed = time.perf_counter() - start
+            got, _ = delivered(expected)
+            for url in webhooks:
+                stock_bot.enqueue_message('Discord', url, message, topic='report')
+            stock_bot.wait_for_delivery(timeout=600)
+            _, duplicates = delivered(expected)
+            stats = dict(stock_bot.get_outbox().stats)
+            stock_bot.close_outbox()
+        print(f"   {'外送匣':<16} {queued:>7.2f}s {elapsed:>8.2f}s {total - got:>8} {duplicates:>10}  "
+              f"(重試 {stats['retries']} 次)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
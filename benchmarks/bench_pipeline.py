@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+整體流程離線效能測試 - 重播固定的 MoneyDJ 頁面、yfinance 資料與 Gemini 回應，
+並以本機模擬伺服器代替 LINE / Discord，量測各階段的耗時、CPU、記憶體與請求數
+
+用法：
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --sizes 60 600 2000 --output result.json
+    python benchmarks/bench_pipeline.py --baseline result.json --threshold 0.25
+    python benchmarks/bench_pipeline.py --sizes 600 --subscribers 1000 --variants 4
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+sys.path.insert(0, ROOT)
+
+COUNTERS = {}
+_counter_lock = threading.Lock()
+
+
+def count(name, amount=1):
+    with _counter_lock:
+        COUNTERS[name] = COUNTERS.get(name, 0) + amount
+
+
+# --- 模擬的外部服務 ---
+
+class StubHandler(BaseHTTPRequestHandler):
+    """LINE 與 Discord 的本機模擬端點：記錄請求數並回傳成功 (fail_line 為 True 時 LINE 回傳 500)"""
+    fail_line = False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.startswith('/v2/bot/message'):
+            count('line_requests')
+            if self.fail_line:
+                body = b'{"message": "Internal server error"}'
+                self.send_response(500)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            body = b'{}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            count('discord_requests')
+            self.send_response(204)
+            self.send_header('X-RateLimit-Remaining', '5')
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def replay_download(tickers, start=None, end=None, period=None, **kwargs):
+    """代替 yf.download：每支標的以代號為種子產生固定的日 K 線"""
+    count('yfinance_requests')
+    if isinstance(tickers, str):
+        tickers = [tickers]
+    end_date = pd.Timestamp.today().normalize()
+    if start is not None:
+        dates = pd.bdate_range(start=start, end=end_date)
+    else:
+        dates = pd.bdate_range(end=end_date, periods=22)
+    frames = {}
+    for ticker in tickers:
+        rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+        base = rng.uniform(10, 80)
+        close = base * np.cumprod(1 + rng.normal(0, 0.02, len(dates)))
+        frames[ticker] = pd.DataFrame({
+            'Open': close * (1 + rng.normal(0, 0.005, len(dates))),
+            'High': close * 1.02,
+            'Low': close * 0.98,
+            'Close': close,
+            'Volume': rng.uniform(1e5, 1e7, len(dates)),
+        }, index=dates)
+    return pd.concat(frames, axis=1)
+
+
+def replay_read_html(url, **kwargs):
+    """代替 pd.read_html：讀取固定的 MoneyDJ 0050 成分股頁面"""
+    count('moneydj_requests')
+    with open(os.path.join(FIXTURES, 'moneydj_0050.html'), encoding='utf-8') as f:
+        return _read_html(io.StringIO(f.read()))
+
+
+class FakeModels:
+    """代替 genai.Client().models：依 Prompt 回傳固定早報中對應段落的內容
+
+    回應延遲為 latency 加上每個輸出 Token 的 token_latency 秒 (生成時間大致與輸出長度成正比)
+    """
+
+    def __init__(self, latency, token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        with open(os.path.join(FIXTURES, 'gemini_report.txt'), encoding='utf-8') as f:
+            self.report = f.read()
+        blocks = {block.split("\n", 1)[0]: block for block in self.report.split("\n\n")}
+        self.us_news = "\n".join(line for line in blocks["📰 1. 美股新聞重點"].splitlines() if line.startswith("●"))
+        self.tw_news = "\n".join(line for line in blocks["📰 2. 台股新聞重點"].splitlines() if line.startswith("●"))
+        # 精選個股：(公司名稱, 理由)，代號改用 Prompt 中候選表格的前幾列
+        lines = self.report.split("🎯", 1)[1].split("⚠️", 1)[0].splitlines()
+        self.picks = [(line.split()[2], lines[i + 1].removeprefix("理由："))
+                      for i, line in enumerate(lines) if line.startswith("● ") and i + 1 < len(lines)]
+
+    def reply(self, contents):
+        if "美股 3 個關鍵新聞" in contents:
+            return self.us_news
+        if "台股 3 個重要產業新聞" in contents:
+            return self.tw_news
+        if "候選清單" in contents:
+            codes = [line.split("|", 1)[0] for line in contents.splitlines() if line[:1].isdigit() and "|" in line]
+            return "\n".join(f"{code}|{name}|{reason}" for code, (name, reason) in zip(codes, self.picks))
+        return self.report
+
+    def generate_content(self, model, contents, config=None):
+        count('gemini_requests')
+        text = self.reply(contents)
+        output_tokens = -(-len(text.encode('utf-8')) // 3)
+        time.sleep(self.latency + self.token_latency * output_tokens)
+        usage = type('Usage', (), {'prompt_token_count': -(-len(contents.encode('utf-8')) // 3),
+                                   'candidates_token_count': output_tokens,
+                                   'total_token_count': 0})()
+        return type('Response', (), {'text': text, 'usage_metadata': usage})()
+
+    def count_tokens(self, model, contents):
+        """UTF-8 每 3 位元組約 1 個 Token (中文約 1 字 1 Token)"""
+        count('gemini_count_requests')
+        return type('CountTokensResponse', (), {'total_tokens': -(-len(contents.encode('utf-8')) // 3)})()
+
+
+class FakeClient:
+    def __init__(self, latency=0.0, token_latency=0.0):
+        self.models = FakeModels(latency, token_latency)
+
+
+# --- 量測 ---
+
+def max_rss_mb():
+    """目前行程的記憶體最高水位 (MB)"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / 1024 / 1024 if sys.platform == 'darwin' else usage / 1024
+
+
+def measure(name, func, verbose=False, trace_memory=False):
+    """執行單一階段並記錄耗時、CPU 時間、記憶體峰值與期間的請求數
+
+    預設以行程的最高水位 (max RSS) 表示記憶體；trace_memory=True 時改用 tracemalloc
+    量測該階段 Python 配置的峰值，較精確但會明顯拖慢耗時數字
+    """
+    before = dict(COUNTERS)
+    if trace_memory:
+        tracemalloc.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if verbose else output):
+        result = func()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    else:
+        peak_mb = max_rss_mb()
+    requests_made = {
+        key: COUNTERS[key] - before.get(key, 0)
+        for key in COUNTERS if COUNTERS[key] != before.get(key, 0)
+    }
+    return result, {
+        'stage': name,
+        'wall_s': round(wall, 4),
+        'cpu_s': round(cpu, 4),
+        'peak_mb': round(peak_mb, 2),
+        'requests': requests_made,
+    }
+
+
+def make_subscribers(n_subscribers, n_variants, endpoint):
+    """n_subscribers 位訂閱者平均分成 n_variants 種設定，每 3 人中有 1 人另外訂閱 Discord"""
+    from subscribers import Subscriber, Variant
+    variants = [Variant(limit=5 + k) for k in range(n_variants)]
+    return [
+        Subscriber(f"user-{i}", line_user_id=f"U{i:032x}",
+                   discord_webhook=f"{endpoint}/discord/{i % n_variants}" if i % 3 == 0 else None,
+                   variant=variants[i % n_variants])
+        for i in range(n_subscribers)
+    ]
+
+
+def reset_outbox(stock_bot):
+    """停止背景推播並刪除外送匣，之後的推播視為第一次送出"""
+    import outbox
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        stock_bot.close_outbox(timeout=0)
+    for suffix in ('', '-wal', '-shm'):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(outbox.OUTBOX_PATH + suffix)
+
+
+def run_size(stock_bot, n_tickers, client, verbose=False, trace_memory=False, subscribers=None):
+    """以 n_tickers 支合成標的跑一次完整流程 (冷啟動後再跑一次暖快取)"""
+    from checkpoints import RunCheckpoint
+
+    tickers = [f"{1000 + i}.TW" for i in range(n_tickers)]
+    original_pool = stock_bot.get_taiwan_stock_pool
+    results = []
+
+    _, stats = measure('get_taiwan_stock_pool', lambda: original_pool(ttl_hours=0), verbose, trace_memory)
+    results.append(stats)
+
+    stock_bot.get_taiwan_stock_pool = lambda: tickers
+    try:
+        (market_data, qualified), stats = measure('get_market_data (cold)', stock_bot.get_market_data,
+                                                  verbose, trace_memory)
+        results.append(stats)
+        _, stats = measure('get_market_data (warm)', stock_bot.get_market_data,
+                           verbose, trace_memory)
+        results.append(stats)
+        # 完整流程；同一天不加 --resume 重跑 (外送匣以冪等鍵略過已送達的分段，不應有任何推播請求)；
+        # 再以全新的外送匣模擬 LINE 失敗的一次執行，之後以 --resume 只補送 LINE
+        label = f"run_pipeline ({len(subscribers)} 位訂閱者)" if subscribers else "run_pipeline"
+        for name, resume, fail_line in [(label, False, False), (f"{label} 重跑", False, False),
+                                        (f"{label} LINE 失敗", False, True), (f"{label} --resume", True, False)]:
+            if fail_line:
+                reset_outbox(stock_bot)
+            StubHandler.fail_line = fail_line
+            # LINE 失敗時不必等滿整個送達期限，未送達的分段留在外送匣由 --resume 接續
+            stock_bot.DELIVERY_WAIT_SECONDS = 0.5 if fail_line else 30
+            checkpoint = RunCheckpoint(stock_bot.trading_date(), resume=resume)
+            _, stats = measure(name, lambda: stock_bot.run_pipeline(subscribers or [], checkpoint, client),
+                               verbose, trace_memory)
+            results.append(stats)
+        StubHandler.fail_line = False
+    finally:
+        stock_bot.get_taiwan_stock_pool = original_pool
+
+    report, stats = measure('generate_report_with_retry',
+                            lambda: stock_bot.generate_report_with_retry(client, market_data, qualified),
+                            verbose, trace_memory)
+    results.append(stats)
+    # 與早報內容不同的訊息，否則外送匣會視為同一天的重送而略過
+    message = f"{report}\n\n(推播測試 {n_tickers})"
+    _, stats = measure('notify_all (排入外送匣)', lambda: stock_bot.notify_all(message), verbose, trace_memory)
+    results.append(stats)
+    _, stats = measure('notify_all (等待送達)', stock_bot.wait_for_delivery, verbose, trace_memory)
+    results.append(stats)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stock_bot.close_outbox()
+    return results
+
+
+# 兩次都低於此秒數的階段不做退步比較
+MIN_COMPARABLE_SECONDS = 0.05
+
+
+def check_regressions(results, baseline, threshold):
+    """與基準結果比較，耗時超過基準 (1 + threshold) 倍的階段視為退步"""
+    previous = {(row['size'], row['stage']): row for row in baseline}
+    regressions = []
+    for row in results:
+        base = previous.get((row['size'], row['stage']))
+        # 太短的階段誤差過大，不列入比較
+        if not base or max(base['wall_s'], row['wall_s']) < MIN_COMPARABLE_SECONDS:
+            continue
+        ratio = row['wall_s'] / base['wall_s']
+        if ratio > 1 + threshold:
+            regressions.append((row, base, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="股票機器人離線效能測試")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[60, 600, 2000], help="合成股票池大小")
+    parser.add_argument('--gemini-latency', type=float, default=0.0, help="模擬 Gemini 回應延遲秒數")
+    parser.add_argument('--gemini-token-latency', type=float, default=0.0,
+                        help="模擬 Gemini 每個輸出 Token 的生成秒數 (整份報告一次生成時約為各段落之和)")
+    parser.add_argument('--download-rate', type=float, default=1e6,
+                        help="下載限速 (每秒個股請求數)，預設不限速以量測程式本身的成本")
+    parser.add_argument('--output', help="將結果寫入 JSON 檔")
+    parser.add_argument('--baseline', help="基準結果 JSON，用於偵測效能退步")
+    parser.add_argument('--threshold', type=float, default=0.25, help="允許的耗時增加比例 (預設 25%%)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="以 tracemalloc 量測各階段記憶體峰值 (會拖慢耗時)")
+    parser.add_argument('--subscribers', type=int, default=0, help="另外量測多訂閱者推播的訂閱者數 (0 為略過)")
+    parser.add_argument('--variants', type=int, default=4, help="訂閱者設定的種類數")
+    parser.add_argument('--verbose', action='store_true', help="顯示各階段原本的輸出")
+    args = parser.parse_args()
+
+    server = start_stub_server()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+    results = []
+    for size in args.sizes:
+        # 每個股票池大小使用全新的快取目錄，確保第一次是冷啟動
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ.update({
+                'STOCK_BOT_CACHE_DIR': cache_dir,
+                'LINE_ACCESS_TOKEN': 'offline-token',
+                'LINE_USER_ID': 'U-offline',
+                'LINE_API_ENDPOINT': endpoint,
+                'DISCORD_WEBHOOK_URL': f"{endpoint}/discord",
+                'DOWNLOAD_RATE': str(args.download_rate),
+            })
+            for name in [m for m in sys.modules if m in PROJECT_MODULES]:
+                del sys.modules[name]
+            import stock_bot
+            # stock_bot 在各階段第一次用到時才載入 SDK；載入成本由 bench_startup.py 另外量測，
+            # 這裡先載入，避免算進第一個用到它的階段
+            import google.genai.types, linebot.models  # noqa: E401,F401
+            # stock_bot 在抓取 MoneyDJ 時才載入 pandas，直接替換 pandas.read_html
+            pd.read_html = replay_read_html
+            stock_bot.DEFAULT_RETRY_POLICY.deadline = 30
+            # 模擬伺服器失敗時以較短的退避重試，量測結果不受隨機等待時間影響
+            stock_bot.DELIVERY_RETRY_POLICY.base_delay = 0.05
+            stock_bot.DELIVERY_RETRY_POLICY.max_delay = 0.2
+
+            print(f"\n📦 股票池 {size} 支")
+            subscribers = make_subscribers(args.subscribers, args.variants, endpoint) if args.subscribers else None
+            for row in run_size(stock_bot, size, FakeClient(args.gemini_latency, args.gemini_token_latency),
+                                args.verbose, args.trace_memory, subscribers):
+                row['size'] = size
+                results.append(row)
+                reqs = ", ".join(f"{k}={v}" for k, v in sorted(row['requests'].items())) or "-"
+                print(f"   {row['stage']:<28} {row['wall_s'] * 1000:>9.1f}ms  CPU {row['cpu_s'] * 1000:>9.1f}ms  "
+                      f"峰值 {row['peak_mb']:>7.2f}MB  請求 {reqs}")
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 結果已寫入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = check_regressions(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n❌ 偵測到 {len(regressions)} 個階段效能退步:")
+            for row, base, ratio in regressions:
+                print(f"   {row['size']} 支 {row['stage']}: {base['wall_s']:.3f}s → {row['wall_s']:.3f}s ({ratio:.2f}x)")
+            sys.exit(1)
+        print("\n✅ 未偵測到效能退步")
+
+
+# 每輪都要以新的環境變數重新載入的專案模組
+PROJECT_MODULES = {
+    'stock_bot', 'price_cache', 'downloader', 'screener', 'report_cache',
+    'retry_policy', 'chunker', 'indicators', 'metrics', 'scheduler', 'alerts',
+    'subscribers', 'cache_paths', 'checkpoints', 'prompt_builder', 'report_sections', 'universe', 'outbox',
+}
+
+_read_html = pd.read_html
+
+if __name__ == "__main__":
+    import yfinance
+    yfinance.download = replay_download
+    main()
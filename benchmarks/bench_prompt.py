@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Prompt Token 比較 - 舊版單一 Prompt (市場數據重複兩次、逐支「代號(價:..,量:..)」前 15 支)
+vs 分段 Prompt (兩則新聞 + 依 Token 預算放入候選表格的精選個股，三者合計)
+預設以 UTF-8 每 3 位元組約 1 個 Token 的離線計數器計算；設定 GEMINI_API_KEY 並加上 --live 時改用 count_tokens API
+
+用法：
+    python benchmarks/bench_prompt.py
+    python benchmarks/bench_prompt.py --budgets 600 1000 1500 --candidates 300
+    GEMINI_API_KEY=... python benchmarks/bench_prompt.py --live
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_builder import count_tokens, pack_prompt  # noqa: E402
+from report_sections import SECTIONS, news_prompt, picks_prompt  # noqa: E402
+from screener import format_candidates  # noqa: E402
+
+MARKET_DATA = "【美股收盤與 VOO】\n● 道瓊: 38150.30 (-0.82%)\n● 標普500: 4845.65 (-1.61%)\n● VOO: 445.32 (-1.60%)\n"
+
+
+def make_result(n_candidates, seed=0):
+    """合成的篩選結果：全部入選，分數隨機"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'close': rng.uniform(20, 50, n_candidates),
+        'avg_volume': rng.uniform(3e6, 5e7, n_candidates),
+        'rsi14': rng.uniform(20, 80, n_candidates),
+        'volume_surge': rng.uniform(0.5, 3, n_candidates),
+        'score': rng.uniform(0, 1, n_candidates),
+        'qualified': True,
+    }, index=[f"{1000 + i}.TW" for i in range(n_candidates)])
+
+
+def legacy_candidates(result, limit=15):
+    """舊版候選字串：每支寫成 代號(價:..,量:..K,RSI:..,量比:..)，以逗號串接"""
+    picked = result.sort_values('score', ascending=False).head(limit)
+    return ", ".join(f"{ticker}(價:{row.close:.1f},量:{int(row.avg_volume / 1000)}K,"
+                     f"RSI:{row.rsi14:.0f},量比:{row.volume_surge:.1f})" for ticker, row in picked.iterrows())
+
+
+def legacy_prompt(market_data, qualified_stocks):
+    """舊版整份早報一次生成的 Prompt"""
+    return f"""
+    請以專業分析師身份，根據以下數據並使用 Google Search 撰寫投資早報：
+
+    1. 今日市場數據：
+    {market_data}
+
+    2. 台股潛力候選清單 (20-50元 & 高流動性)：
+    {qualified_stocks}
+
+    請執行以下任務並按照指定格式輸出：
+
+    🌅 投資早報 - [今日日期]
+
+    📈 美股收盤摘要
+    {market_data}
+
+    📰 1. 美股新聞重點
+    摘要今日美股 3 個關鍵新聞，每則新聞用「●」開頭，一行一則。
+
+    📰 2. 台股新聞重點
+    摘要今日台股 3 個重要產業新聞，每則新聞用「●」開頭，一行一則。
+
+    🎯 3. 精選潛力股 (5支)
+    從候選清單中精選 5 支股票，格式如下：
+    ● [股票代號] [公司名稱]
+    理由：[結合新聞的推薦理由，限50字內]
+
+    ⚠️ 投資提醒
+    本報告僅供參考，投資有風險請謹慎評估。
+
+    注意事項：
+    - 不要使用任何 Markdown 語法 (如 **、##、[]() 等)
+    - 使用 Emoji 和數字編號來美化排版
+    - 每個段落間空一行提升可讀性
+    - 內容簡潔適合手機 LINE 閱讀
+    - 使用繁體中文
+    """
+
+
+def offline_counter(text):
+    return -(-len(text.encode('utf-8')) // 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt Token 比較")
+    parser.add_argument('--budgets', type=int, nargs='+', default=[400, 600, 800, 1000, 1500], help="Token 預算")
+    parser.add_argument('--candidates', type=int, default=200, help="入選標的數")
+    parser.add_argument('--live', action='store_true', help="以 Gemini count_tokens API 計算 (需要 GEMINI_API_KEY)")
+    args = parser.parse_args()
+
+    calls = [0]
+    if args.live:
+        import stock_bot
+        client, model = stock_bot.get_genai_client(), stock_bot.REPORT_MODEL
+
+        def counter(text):
+            calls[0] += 1
+            return count_tokens(client, model, text)
+    else:
+        def counter(text):
+            calls[0] += 1
+            return offline_counter(text)
+
+    result = make_result(args.candidates)
+    table = format_candidates(result)
+
+    legacy_tokens = counter(legacy_prompt(MARKET_DATA, legacy_candidates(result)))
+    news_tokens = sum(counter(news_prompt(section.name, MARKET_DATA)) for section in SECTIONS if section.name != 'picks')
+    empty_tokens = counter(picks_prompt(""))
+    print(f"🧮 Prompt Token 比較 ({args.candidates} 支入選, {'count_tokens API' if args.live else '離線計數'})")
+    print(f"   新聞段落 Prompt 合計 {news_tokens} tokens (不含候選清單)")
+    print(f"   {'版本':<20} | {'合計 Token':>9} | {'候選':>5} | {'每支 Token':>9} | {'API 呼叫':>8} | {'耗時':>8}")
+    print(f"   {'舊版 (前 15 支)':<18} | {legacy_tokens:>9} | {15:>5} | {'-':>9} | {1:>8} | {'-':>8}")
+    for budget in args.budgets:
+        calls[0] = 0
+        start = time.perf_counter()
+        _, tokens, used, _, exact = pack_prompt(picks_prompt, table, counter, budget)
+        elapsed = time.perf_counter() - start
+        per_row = (tokens - empty_tokens) / used if used else 0
+        label = f"精選個股預算 {budget}" + ("" if exact else " (估計)")
+        print(f"   {label:<16} | {news_tokens + tokens:>9} | {used:>5} | {per_row:>9.1f} | {calls[0]:>8} | "
+              f"{elapsed * 1000:>6.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+篩選引擎效能比較 - 舊的逐支迴圈 vs 向量化 screen()
+使用合成資料，不需要網路
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from screener import screen  # noqa: E402
+
+
+def make_frame(n_tickers, n_days=5, seed=0):
+    """產生與 yf.download(group_by='ticker') 相同格式的合成資料"""
+    rng = np.random.default_rng(seed)
+    tickers = [f"{1000 + i}.TW" for i in range(n_tickers)]
+    dates = pd.bdate_range(end="2024-01-31", periods=n_days)
+    frames = {}
+    for ticker in tickers:
+        close = rng.uniform(10, 80) * np.cumprod(1 + rng.normal(0, 0.02, n_days))
+        frames[ticker] = pd.DataFrame({
+            'Open': close * (1 + rng.normal(0, 0.01, n_days)),
+            'High': close * 1.02,
+            'Low': close * 0.98,
+            'Close': close,
+            'Volume': rng.uniform(1e5, 1e7, n_days),
+        }, index=dates)
+    return tickers, pd.concat(frames, axis=1)
+
+
+def legacy_loop(data, ticker_pool):
+    """原本 get_market_data 內的逐支篩選寫法"""
+    qualified_stocks = []
+    for ticker in ticker_pool:
+        try:
+            hist = data[ticker]
+            price = hist['Close'].iloc[-1]
+            avg_vol = hist['Volume'].mean()
+            if 20 <= price <= 50 and avg_vol > 3000000:
+                qualified_stocks.append(ticker)
+        except Exception:
+            continue
+    return qualified_stocks
+
+
+def best_of(func, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    print("⏱️  篩選引擎效能比較")
+    print(f"   {'標的數':>6} | {'逐支迴圈':>10} | {'向量化':>10} | {'加速':>6}")
+    for n in (60, 600, 1800):
+        tickers, data = make_frame(n)
+        loop_time, loop_result = best_of(lambda: legacy_loop(data, tickers))
+        vec_time, result = best_of(lambda: screen(data, tickers))
+        vec_result = result.index[result['qualified']].tolist()
+        assert vec_result == loop_result, "向量化結果與逐支迴圈不一致"
+        print(f"   {n:>6} | {loop_time * 1000:>8.1f}ms | {vec_time * 1000:>8.1f}ms | {loop_time / vec_time:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+子命令啟動時間量測 - 每個子命令在全新的直譯器中以 -X importtime 實際執行一次，
+統計總耗時與各大型套件的載入時間；資料來源沿用 bench_pipeline 的離線重播，
+LINE / Discord 以本機模擬伺服器代替，不需要網路
+
+用法：
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 5 --commands send resend-cached
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COMMANDS = ['fetch', 'screen', 'report', 'send', 'resend-cached', 'dry-run']
+# 需要重播行情資料的子命令 (子行程中先替換 yfinance.download 與 pandas.read_html)
+DATA_COMMANDS = {'fetch', 'screen', 'report', 'dry-run'}
+# 需要 Gemini 的子命令 (改用 bench_pipeline 的固定回應)
+REPORT_COMMANDS = {'report', 'dry-run'}
+# 表格中列出載入時間的套件
+PACKAGES = ['pandas', 'yfinance', 'google.genai', 'linebot', 'requests']
+# 改版前 import stock_bot 就會載入的套件，作為對照
+EAGER_IMPORTS = "import pandas, requests, yfinance, google.genai, linebot.models"
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def run_child(command):
+    """子行程：替換外部資料來源後執行子命令"""
+    if command in DATA_COMMANDS:
+        import pandas
+        import yfinance
+
+        import bench_pipeline
+        yfinance.download = bench_pipeline.replay_download
+        pandas.read_html = bench_pipeline.replay_read_html
+    import stock_bot
+    if command in REPORT_COMMANDS:
+        stock_bot.get_genai_client = lambda: bench_pipeline.FakeClient()
+    return stock_bot.cli([command])
+
+
+def parse_importtime(stderr):
+    """回傳 {模組: 含子模組的累計載入毫秒}，同一模組只記第一次載入"""
+    cumulative = {}
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            cumulative.setdefault(match.group(4), int(match.group(2)) / 1000)
+    return cumulative
+
+
+def measure(args, env, cwd, stdin=None):
+    """在全新的直譯器中執行，回傳 (總耗時毫秒, {模組: 載入毫秒}, 輸出)"""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + args, env=env, cwd=cwd, input=stdin,
+                          capture_output=True, text=True, encoding='utf-8')
+    wall = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} 結束碼 {proc.returncode}\n{proc.stdout}\n{proc.stderr[-2000:]}")
+    return wall, parse_importtime(proc.stderr), proc.stdout
+
+
+def best_of(repeat, *args, **kwargs):
+    """重複執行取最快的一次 (第一次會順便建立快取與 .pyc)"""
+    runs = [measure(*args, **kwargs) for _ in range(repeat)]
+    return min(runs, key=lambda run: run[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="子命令啟動時間量測")
+    parser.add_argument('--commands', nargs='+', choices=COMMANDS, default=COMMANDS, help="要量測的子命令")
+    parser.add_argument('--repeat', type=int, default=3, help="每個子命令執行次數 (取最快的一次)")
+    parser.add_argument('--verbose', action='store_true', help="顯示子命令原本的輸出")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args.child)
+
+    from bench_pipeline import start_stub_server
+    from report_cache import put_cached_report
+
+    server = start_stub_server()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, **{
+            'STOCK_BOT_CACHE_DIR': os.path.join(workdir, 'cache'),
+            'LINE_ACCESS_TOKEN': 'offline-token',
+            'LINE_USER_ID': 'U-offline',
+            'LINE_API_ENDPOINT': endpoint,
+            'DISCORD_WEBHOOK_URL': f"{endpoint}/discord",
+        })
+        env.pop('GEMINI_API_KEY', None)
+        with open(os.path.join(ROOT, 'benchmarks', 'fixtures', 'gemini_report.txt'), encoding='utf-8') as f:
+            report = f.read()
+        put_cached_report('bench-startup', report, cache_dir=os.path.join(workdir, 'cache', 'reports'))
+
+        rows = [
+            ('python (空直譯器)', best_of(args.repeat, ['-c', 'pass'], env, workdir)),
+            ('改版前 import stock_bot', best_of(args.repeat, ['-c', EAGER_IMPORTS], env, workdir)),
+        ]
+        for command in args.commands:
+            child = [os.path.abspath(__file__), '--child', command]
+            # 報告快取命中時不會載入 google-genai，量測生成報告的子命令時停用快取
+            child_env = dict(env, REPORT_CACHE_TTL_HOURS='0') if command in REPORT_COMMANDS else env
+            rows.append((command, best_of(args.repeat, child, child_env, workdir,
+                                          stdin=report if command == 'send' else None)))
+    server.shutdown()
+
+    print(f"⏱️  子命令啟動時間 (全新直譯器, {args.repeat} 次取最快)")
+    print(f"   {'子命令':<24} {'總耗時':>9} | " + " | ".join(f"{name:>12}" for name in PACKAGES))
+    for name, (wall, imports, output) in rows:
+        cells = [f"{imports[package]:>10.0f}ms" if package in imports else f"{'-':>12}" for package in PACKAGES]
+        print(f"   {name:<24} {wall:>7.0f}ms | " + " | ".join(cells))
+        if args.verbose and output:
+            print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+全市場股票池索引效能 - 以合成的上市 / 上櫃公司基本資料 CSV 量測：
+名單解析與建索引、每次載入 (.npy 索引 vs 重新解析 CSV vs JSON 快照)、依市場與產業篩選，
+以及篩選後可省下的價格下載請求數 (以 DOWNLOAD_RATE 換算時間)；不需要網路
+
+用法：
+    python benchmarks/bench_universe.py
+    python benchmarks/bench_universe.py --twse 1000 --tpex 800 --industries 半導體業 電子零組件業
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import DOWNLOAD_RATE  # noqa: E402
+from universe import (INDUSTRY_NAMES, LISTING_URLS, MARKETS, build_index, load_index, parse_listing,  # noqa: E402
+                      read_listing, refresh_index, select, tickers)
+
+HEADER = ['出表日期', '公司代號', '公司名稱', '公司簡稱', '外國企業註冊地國', '產業別', '住址', '營利事業統一編號',
+          '董事長', '總經理', '成立日期', '上市日期', '實收資本額', '網址']
+
+
+def make_listing(n_companies, first_code, seed):
+    """合成一個市場的公司基本資料 CSV (欄位與官方檔案相同的子集)"""
+    rng = np.random.default_rng(seed)
+    industries = rng.choice(list(INDUSTRY_NAMES), n_companies)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(HEADER)
+    for i, industry in enumerate(industries):
+        code = str(first_code + i * 3)
+        writer.writerow(['1131018', code, f"合成股份有限公司{code}", f"合成{code}", '－ ', f"{industry:02d}",
+                         '台北市信義區', '12345678', '王大明', '李小華', '19900101', '20000101', '1000000000',
+                         'https://example.com'])
+    return out.getvalue()
+
+
+def best_ms(func, repeat=20):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全市場股票池索引效能")
+    parser.add_argument('--twse', type=int, default=1000, help="合成上市公司數")
+    parser.add_argument('--tpex', type=int, default=800, help="合成上櫃公司數")
+    parser.add_argument('--industries', nargs='+', default=['半導體業', '電子零組件業', '光電業'],
+                        help="篩選示範用的產業")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        listing_dir = os.path.join(workdir, 'listing')
+        os.makedirs(listing_dir)
+        for market, n, first_code, seed in (('TWSE', args.twse, 1101, 1), ('TPEx', args.tpex, 1102, 2)):
+            with open(os.path.join(listing_dir, LISTING_URLS[market].rsplit('/', 1)[-1]), 'w',
+                      encoding='utf-8-sig') as f:
+                f.write(make_listing(n, first_code, seed))
+        index_path = os.path.join(workdir, 'universe_index.npy')
+        snapshot_path = os.path.join(workdir, 'universe.json')
+
+        build_ms, index = best_ms(lambda: refresh_index(ttl_hours=0, path=index_path, listing_dir=listing_dir), 5)
+        with open(snapshot_path, 'w', encoding='utf-8') as f:
+            json.dump([{'code': str(r['code']), 'name': str(r['name']), 'market': int(r['market']),
+                        'industry': int(r['industry']), 'status': int(r['status'])} for r in index], f,
+                      ensure_ascii=False)
+
+        def parse_csv():
+            return build_index({m: parse_listing(read_listing(m, listing_dir), m) for m in MARKETS})
+
+        def load_json():
+            with open(snapshot_path, encoding='utf-8') as f:
+                return json.load(f)
+
+        npy_ms, _ = best_ms(lambda: load_index(index_path))
+        csv_ms, _ = best_ms(parse_csv, 5)
+        json_ms, _ = best_ms(load_json)
+
+        print(f"📇 股票池索引 (上市 {args.twse} + 上櫃 {args.tpex} 支, .npy {os.path.getsize(index_path) / 1024:.0f} KB)")
+        print(f"   下載後建立索引         {build_ms:>8.2f}ms")
+        print(f"   載入 .npy 索引          {npy_ms:>8.2f}ms")
+        print(f"   重新解析 CSV           {csv_ms:>8.2f}ms  ({csv_ms / npy_ms:.0f}x)")
+        print(f"   載入 JSON 快照          {json_ms:>8.2f}ms  ({json_ms / npy_ms:.0f}x)")
+
+        full = len(tickers(index, select(index)))
+        print(f"\n🔎 下載價格前篩選 (以 DOWNLOAD_RATE={DOWNLOAD_RATE:g} 支/秒換算冷啟動下載時間)")
+        print(f"   {'條件':<34} {'篩選耗時':>9} | {'標的數':>6} | {'省下請求':>8} | {'下載時間':>8}")
+        cases = [
+            ("全市場 (排除管理股票、存託憑證)", dict(exclude_industries=('管理股票', '存託憑證'))),
+            ("只有上市", dict(markets=('TWSE',))),
+            ("只有上櫃", dict(markets=('TPEx',))),
+            (f"產業: {'、'.join(args.industries)}", dict(industries=args.industries)),
+        ]
+        print(f"   {'不篩選':<34} {'-':>9} | {full:>6} | {0:>8} | {full / DOWNLOAD_RATE:>7.0f}s")
+        for label, kwargs in cases:
+            ms, mask = best_ms(lambda: select(index, **kwargs))
+            n = int(mask.sum())
+            print(f"   {label:<34} {ms:>7.3f}ms | {n:>6} | {full - n:>8} | {n / DOWNLOAD_RATE:>7.0f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""
+快取目錄設定 - 只依賴標準函式庫，任何模組都能引用而不必載入 pandas 等大型套件
+"""
+
+import os
+
+CACHE_DIR = os.environ.get('STOCK_BOT_CACHE_DIR', '.cache')
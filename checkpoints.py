@@ -0,0 +1,99 @@
+"""
+執行檢查點 - 早報流程的每個階段完成後把輸出存到 CACHE_DIR/checkpoints/<交易日>/<階段>.json
+以 --resume 重跑時跳過已完成的階段，推播只補送尚未確認送達的對象
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+from cache_paths import CACHE_DIR
+
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, 'checkpoints')
+CHECKPOINT_VERSION = 1
+# 保留最近幾個交易日的檢查點，其餘刪除
+CHECKPOINT_KEEP_DAYS = int(os.environ.get('CHECKPOINT_KEEP_DAYS', 7))
+
+
+class RunCheckpoint:
+    """單一交易日的執行檢查點
+
+    resume=False 時清除當天舊的檢查點重新開始 (仍會寫入新的檢查點，供之後 --resume 使用)；
+    persist=False 時只讀不寫 (試跑模式)
+    """
+
+    def __init__(self, trading_date, resume=False, root=CHECKPOINT_DIR, keep_days=CHECKPOINT_KEEP_DAYS,
+                 persist=True):
+        self.dir = os.path.join(root, str(trading_date))
+        self.resume = resume
+        self.persist = persist
+        self._lock = threading.Lock()
+        if persist:
+            if not resume:
+                shutil.rmtree(self.dir, ignore_errors=True)
+            os.makedirs(self.dir, exist_ok=True)
+            prune(root, keep_days)
+        self._delivered = set(self.load('deliver') or ()) if resume else set()
+
+    def _path(self, stage):
+        return os.path.join(self.dir, f"{stage}.json")
+
+    def load(self, stage):
+        """讀取階段輸出，沒有或格式不符時回傳 None"""
+        try:
+            with open(self._path(stage), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('version') != CHECKPOINT_VERSION:
+            return None
+        return entry.get('value')
+
+    def save(self, stage, value):
+        """寫入階段輸出 (先寫暫存檔再替換，中斷時不會留下壞檔)"""
+        if not self.persist:
+            return
+        path = self._path(stage)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CHECKPOINT_VERSION, 'saved_at': time.time(), 'value': value},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def stage(self, name, func, encode=None, decode=None, complete=None):
+        """執行階段或沿用檢查點
+
+        encode / decode: 階段輸出與 JSON 之間的轉換；complete(輸出) 為 False 時不寫入檢查點，
+        下次 --resume 會重新執行這個階段 (例如報告是錯誤訊息或備用報告)
+        """
+        if self.resume:
+            value = self.load(name)
+            if value is not None:
+                print(f"⏭️  沿用檢查點: {name}")
+                return decode(value) if decode else value
+        result = func()
+        if complete is None or complete(result):
+            self.save(name, encode(result) if encode else result)
+        return result
+
+    def delivered(self, key):
+        """這個推播對象是否已確認送達"""
+        return key in self._delivered
+
+    def confirm(self, key):
+        """記錄推播已送達 (每送達一個對象就寫入一次，中途失敗也不會遺失)"""
+        with self._lock:
+            self._delivered.add(key)
+            self.save('deliver', sorted(self._delivered))
+
+
+def prune(root=CHECKPOINT_DIR, keep_days=CHECKPOINT_KEEP_DAYS):
+    """只保留最近 keep_days 個交易日的檢查點 (目錄名稱為 ISO 日期，依名稱排序即依日期排序)"""
+    try:
+        days = sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+    except OSError:
+        return
+    for name in days[:max(len(days) - keep_days, 0)]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
@@ -0,0 +1,96 @@
+"""
+訊息分段器 - 只在段落或換行處切分報告，並依各平台的計算方式量測長度
+再把分段打包成最少次數的 API 請求 (LINE 一次最多 5 則、Discord 以 embeds 合併)
+"""
+
+# LINE 文字訊息上限 5000 字 (以 UTF-16 單位計)，一次 push 最多 5 則訊息
+LINE_MAX_TEXT = 5000
+LINE_MAX_MESSAGES_PER_PUSH = 5
+# Discord 一般訊息上限 2000 字；embed 說明欄上限 4096 字，單則訊息的 embeds 總字數上限 6000、最多 10 個
+DISCORD_MAX_CONTENT = 2000
+DISCORD_MAX_EMBED = 4096
+DISCORD_MAX_EMBED_TOTAL = 6000
+DISCORD_MAX_EMBEDS = 10
+
+
+def utf16_length(text):
+    """以 UTF-16 單位計算長度 (Emoji 等 BMP 以外字元算 2)，與 LINE / Discord 的計算方式一致"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _hard_split(line, limit, measure):
+    """單行就超過上限時才逐字切分 (不會切斷 Emoji 等單一字元)"""
+    pieces, current = [], ""
+    for char in line:
+        if current and measure(current + char) > limit:
+            pieces.append(current)
+            current = ""
+        current += char
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_message(message, limit, measure=utf16_length):
+    """把訊息切成不超過 limit 的分段
+
+    優先在段落 (空行) 之間切分，段落太長時改在行尾切分，單行仍超過上限時才逐字切分
+    """
+    chunks, current = [], ""
+
+    def flush():
+        nonlocal current
+        if current.strip():
+            chunks.append(current.strip('\n'))
+        current = ""
+
+    for paragraph in message.split('\n\n'):
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if measure(candidate) <= limit:
+            current = candidate
+            continue
+        flush()
+        if measure(paragraph) <= limit:
+            current = paragraph
+            continue
+        for line in paragraph.split('\n'):
+            candidate = f"{current}\n{line}" if current else line
+            if measure(candidate) <= limit:
+                current = candidate
+                continue
+            flush()
+            if measure(line) <= limit:
+                current = line
+            else:
+                *pieces, current = _hard_split(line, limit, measure)
+                chunks.extend(pieces)
+    flush()
+    return chunks
+
+
+def pack_line_messages(message):
+    """LINE：回傳每次 push 要送出的文字訊息清單 (每批最多 5 則)"""
+    chunks = split_message(message, LINE_MAX_TEXT)
+    return [chunks[i:i + LINE_MAX_MESSAGES_PER_PUSH]
+            for i in range(0, len(chunks), LINE_MAX_MESSAGES_PER_PUSH)]
+
+
+def pack_discord_payloads(message, use_embeds=True):
+    """Discord：回傳每次 Webhook POST 的 payload
+
+    內容不超過 2000 字時以一般訊息送出；較長的報告改用 embeds，一次請求可容納約 6000 字
+    """
+    if not use_embeds or utf16_length(message) <= DISCORD_MAX_CONTENT:
+        return [{"content": chunk} for chunk in split_message(message, DISCORD_MAX_CONTENT)]
+
+    payloads, embeds, total = [], [], 0
+    for chunk in split_message(message, DISCORD_MAX_EMBED):
+        size = utf16_length(chunk)
+        if embeds and (total + size > DISCORD_MAX_EMBED_TOTAL or len(embeds) == DISCORD_MAX_EMBEDS):
+            payloads.append({"embeds": embeds})
+            embeds, total = [], 0
+        embeds.append({"description": chunk})
+        total += size
+    if embeds:
+        payloads.append({"embeds": embeds})
+    return payloads
@@ -0,0 +1,123 @@
+"""
+分批限速下載器 - 全市場股票池專用
+將股票池切成多個批次，以有限的並行數與 Token Bucket 限速下載；
+失敗的批次以退避重試，批次成功但沒有資料的個股只再試一次，每完成一批就立刻交給呼叫端處理
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 50))
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 4))
+# 每秒允許發出的個股請求數 (yfinance 每支標的一次請求)
+DOWNLOAD_RATE = float(os.environ.get('DOWNLOAD_RATE', 20))
+DOWNLOAD_MAX_RETRIES = int(os.environ.get('DOWNLOAD_MAX_RETRIES', 3))
+
+
+class TokenBucket:
+    """Token Bucket 限速器：每秒補充 rate 個 token，最多累積 capacity 個
+
+    一次要求超過現有 token 時先扣除全部 (可以欠債)，再等到補足欠額為止，
+    所以一批 50 支的請求也會照實扣 50 個 token，長期速率不會超過 rate
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """取得 token，不足時等待欠額補足 (之後的呼叫端排在後面，等待時間依序累加)"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """指數退避加上隨機抖動，避免所有批次同時重試"""
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def fetch_chunk(tickers, bucket, **kwargs):
+    """下載單一批次，回傳 {ticker: DataFrame} (沒有資料的個股不在結果中)"""
+    import yfinance as yf  # 載入約需 1 秒，只在真的要下載時才載入
+
+    bucket.acquire(len(tickers))
+    data = yf.download(tickers, group_by='ticker', progress=False, threads=False, **kwargs)
+    frames = {}
+    if data is None or data.empty:
+        return frames
+    available = set(data.columns.get_level_values(0))
+    for ticker in tickers:
+        if ticker in available:
+            hist = data[ticker].dropna(subset=['Close'])
+            if not hist.empty:
+                frames[ticker] = hist
+    return frames
+
+
+def download_in_chunks(tickers, chunk_size=DOWNLOAD_CHUNK_SIZE, max_workers=DOWNLOAD_WORKERS,
+                       rate=DOWNLOAD_RATE, max_retries=DOWNLOAD_MAX_RETRIES, stats=None, **kwargs):
+    """分批下載並逐批產出 {ticker: DataFrame}
+
+    整批失敗 (連線問題、限流) 時以指數退避整批重試，重試次數用完仍失敗的個股記錄在 stats['failed']；
+    批次成功但沒有資料的個股 (下市、停牌或代號錯誤) 只在下一輪再試一次，仍沒有資料時記錄在 stats['empty']
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault('requests', 0)
+    stats.setdefault('retries', 0)
+    stats.setdefault('failed', [])
+    stats.setdefault('empty', [])
+    bucket = TokenBucket(rate)
+
+    failed, empty, retried_empty = list(tickers), [], set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for attempt in range(max_retries + 1):
+            pending = failed + empty
+            if not pending:
+                break
+            if attempt:
+                stats['retries'] += len(chunked(pending, chunk_size))
+                # 只剩沒有資料的個股要再試時不必退避
+                if failed:
+                    time.sleep(backoff_delay(attempt - 1))
+
+            futures = {executor.submit(fetch_chunk, chunk, bucket, **kwargs): chunk
+                       for chunk in chunked(pending, chunk_size)}
+            stats['requests'] += len(futures)
+            failed, empty = [], []
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    frames = future.result()
+                except Exception as e:
+                    print(f"   ⚠️  批次下載失敗 ({len(chunk)} 支): {e}")
+                    failed.extend(chunk)
+                    continue
+                for ticker in chunk:
+                    if ticker in frames:
+                        continue
+                    if ticker in retried_empty:
+                        stats['empty'].append(ticker)
+                    else:
+                        retried_empty.add(ticker)
+                        empty.append(ticker)
+                if frames:
+                    yield frames
+
+    stats['failed'].extend(failed)
+    stats['empty'].extend(empty)
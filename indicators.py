@@ -0,0 +1,345 @@
+"""
+技術指標引擎 - 均線、RSI、ATR、量比與 52 週區間位置
+以 (日期 × 標的) 矩陣一次計算整個股票池；滾動狀態以記憶體映射檔保存在磁碟，
+每天只需把新的一根 K 棒就地併入狀態，成本與歷史長度無關
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache_paths import CACHE_DIR
+from price_cache import connect, load_matrix
+
+# 狀態目錄：每個欄位一個 .npy (以 mmap 開啟、就地更新) 加上標的清單
+INDICATOR_STATE_DIR = os.path.join(CACHE_DIR, 'indicator_state')
+INDICATOR_STATE_VERSION = 2
+# 更新進行中的標記，存在代表上次更新沒有正常結束，狀態需重建
+_DIRTY_MARKER = 'DIRTY'
+
+MA_WINDOWS = (5, 20, 60)
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+VOLUME_WINDOW = 20
+RANGE_WINDOW = 252  # 約 52 週交易日
+# 新標的初始化狀態時讀取的歷史筆數
+HISTORY_DAYS = RANGE_WINDOW + 10
+
+INDICATOR_COLUMNS = ['ma5', 'ma20', 'ma60', 'rsi14', 'atr_pct', 'volume_surge', 'range_pos_52w']
+
+# 每支標的的狀態欄位：(名稱, 每支標的的形狀, 初始值)
+_STATE_FIELDS = (
+    ('count', (), 0),
+    ('first_date', (), np.datetime64('NaT', 'D')),
+    ('last_date', (), np.datetime64('NaT', 'D')),
+    ('prev_close', (), np.nan),
+    ('avg_gain', (), np.nan),
+    ('avg_loss', (), np.nan),
+    ('atr', (), np.nan),
+    # 各均線視窗的收盤價累計和與最近 VOLUME_WINDOW + 1 筆成交量的累計和
+    ('close_sums', (len(MA_WINDOWS),), 0.0),
+    ('volume_sum', (), 0.0),
+    ('close_ring', (RANGE_WINDOW,), np.nan),
+    ('high_ring', (RANGE_WINDOW,), np.nan),
+    ('low_ring', (RANGE_WINDOW,), np.nan),
+    ('volume_ring', (VOLUME_WINDOW + 1,), np.nan),
+)
+
+
+def _field_dtype(name):
+    if name.endswith('_date'):
+        return 'datetime64[D]'
+    return 'int64' if name == 'count' else 'float64'
+
+
+class IndicatorState:
+    """整個股票池的滾動狀態：每支標的一列，包含累計和、環狀緩衝區與 Wilder 平滑值
+
+    從磁碟載入時各欄位是記憶體映射陣列，update 直接改寫檔案內容，
+    save 只需 flush；加入新標的時陣列會變長，save 時才整批改寫檔案
+    """
+
+    def __init__(self, tickers=(), arrays=None, path=None):
+        self.tickers = list(tickers)
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.arrays = arrays or {
+            name: np.full((len(self.tickers),) + shape, initial, dtype=_field_dtype(name))
+            for name, shape, initial in _STATE_FIELDS
+        }
+        self.path = path
+        self._resized = arrays is None
+        self._dirty = False
+
+    @classmethod
+    def load(cls, path=INDICATOR_STATE_DIR):
+        """以記憶體映射開啟狀態目錄；不存在、格式不符或上次更新中斷時回傳空狀態"""
+        try:
+            if os.path.exists(os.path.join(path, _DIRTY_MARKER)):
+                print("   ⚠️ 技術指標狀態上次未完整寫入，將由價格快取重建")
+                return cls(path=path)
+            with open(os.path.join(path, 'tickers.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != INDICATOR_STATE_VERSION:
+                return cls(path=path)
+            tickers = meta['tickers']
+            arrays = {}
+            for name, shape, _ in _STATE_FIELDS:
+                array = np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r+', allow_pickle=False)
+                if array.shape != (len(tickers),) + shape or array.dtype != np.dtype(_field_dtype(name)):
+                    return cls(path=path)
+                arrays[name] = array
+            return cls(tickers, arrays, path)
+        except (OSError, KeyError, ValueError):
+            return cls(path=path)
+
+    def save(self, path=None):
+        """寫回磁碟：大小未變時只 flush 記憶體映射，否則整批改寫各欄位檔案"""
+        path = path or self.path or INDICATOR_STATE_DIR
+        os.makedirs(path, exist_ok=True)
+        if self._resized or path != self.path:
+            self.path = path
+            self._mark_dirty()
+            for name, array in self.arrays.items():
+                target = os.path.join(path, f"{name}.npy")
+                tmp_path = os.path.join(path, f"{name}.tmp.npy")
+                np.save(tmp_path, np.asarray(array))
+                os.replace(tmp_path, target)
+                # 改寫後重新以記憶體映射開啟，之後的更新直接寫入檔案
+                self.arrays[name] = np.load(target, mmap_mode='r+', allow_pickle=False)
+        else:
+            for array in self.arrays.values():
+                array.flush()
+        tmp_path = os.path.join(path, 'tickers.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDICATOR_STATE_VERSION, 'tickers': self.tickers}, f)
+        os.replace(tmp_path, os.path.join(path, 'tickers.json'))
+        self._clear_dirty(path)
+        self.path = path
+        self._resized = False
+
+    def _mark_dirty(self):
+        """改寫狀態檔之前先留下標記，避免中斷後沿用寫到一半的狀態"""
+        if self.path and not self._dirty and os.path.isdir(self.path):
+            open(os.path.join(self.path, _DIRTY_MARKER), 'w').close()
+            self._dirty = True
+
+    def _clear_dirty(self, path):
+        try:
+            os.remove(os.path.join(path, _DIRTY_MARKER))
+        except FileNotFoundError:
+            pass
+        self._dirty = False
+
+    def ensure(self, tickers):
+        """加入尚未追蹤的標的 (狀態為空)，回傳這些新標的"""
+        new = [ticker for ticker in dict.fromkeys(tickers) if ticker not in self.index]
+        if new:
+            empty = IndicatorState(new)
+            for name in self.arrays:
+                self.arrays[name] = np.concatenate([self.arrays[name], empty.arrays[name]])
+            for ticker in new:
+                self.index[ticker] = len(self.tickers)
+                self.tickers.append(ticker)
+            self._resized = True
+        return new
+
+    def reset(self, tickers):
+        """清空指定標的的狀態，下次更新時會以完整歷史重建"""
+        rows = self.rows(tickers)
+        self._mark_dirty()
+        for name, shape, initial in _STATE_FIELDS:
+            self.arrays[name][rows] = initial
+
+    def rows(self, tickers):
+        return np.array([self.index[ticker] for ticker in tickers], dtype='int64')
+
+    def update(self, tickers, dates, bars):
+        """依時間順序把 (日期 × 標的) 的 K 棒併入狀態
+
+        每一列只對「有資料且日期晚於該標的最後狀態日期」的標的生效，
+        所以重複餵入同一天的資料不會重複計算
+        """
+        rows = self.rows(tickers)
+        a = self.arrays
+        if len(dates):
+            self._mark_dirty()
+        for t, day in enumerate(dates):
+            close, high, low, volume = (bars[field][t] for field in ('Close', 'High', 'Low', 'Volume'))
+            last = a['last_date'][rows]
+            valid = ~np.isnan(close) & (np.isnat(last) | (last < day))
+            if not valid.any():
+                continue
+            idx = rows[valid]
+            c, h, l, v = close[valid], high[valid], low[valid], volume[valid]
+            prev = a['prev_close'][idx]
+            count = a['count'][idx]
+
+            # RSI：前 RSI_PERIOD 個漲跌以簡單平均起算，之後以 Wilder 平滑
+            has_prev = ~np.isnan(prev)
+            delta = np.where(has_prev, c - prev, 0.0)
+            _wilder(a, 'avg_gain', idx[has_prev], np.maximum(delta, 0)[has_prev], count[has_prev], RSI_PERIOD)
+            _wilder(a, 'avg_loss', idx[has_prev], np.maximum(-delta, 0)[has_prev], count[has_prev], RSI_PERIOD)
+
+            # ATR：真實區間 (第一根 K 棒沒有前收時為高低差)
+            true_range = np.where(
+                has_prev,
+                np.maximum.reduce([h - l, np.abs(h - prev), np.abs(l - prev)]),
+                h - l,
+            )
+            _wilder(a, 'atr', idx, true_range, count + 1, ATR_PERIOD)
+
+            # 累計和：加上新值、扣掉滑出視窗的舊值 (須在覆寫環狀緩衝區之前讀出)
+            for k, window in enumerate(MA_WINDOWS):
+                leaving = np.where(count >= window, a['close_ring'][idx, (count - window) % RANGE_WINDOW], 0.0)
+                a['close_sums'][idx, k] += c - leaving
+            leaving = np.where(count > VOLUME_WINDOW, a['volume_ring'][idx, count % (VOLUME_WINDOW + 1)], 0.0)
+            a['volume_sum'][idx] += v - leaving
+
+            a['close_ring'][idx, count % RANGE_WINDOW] = c
+            a['high_ring'][idx, count % RANGE_WINDOW] = h
+            a['low_ring'][idx, count % RANGE_WINDOW] = l
+            a['volume_ring'][idx, count % (VOLUME_WINDOW + 1)] = v
+            a['prev_close'][idx] = c
+            a['count'][idx] = count + 1
+            a['first_date'][idx] = np.where(count == 0, day, a['first_date'][idx])
+            a['last_date'][idx] = day
+
+    def values(self, tickers):
+        """依目前狀態算出各標的的指標值"""
+        rows = self.rows(tickers)
+        a = self.arrays
+        count = a['count'][rows]
+        result = pd.DataFrame(index=pd.Index(tickers, name='ticker'), columns=INDICATOR_COLUMNS, dtype='float64')
+        if not len(rows):
+            return result
+
+        close = _last_values(a['close_ring'][rows], count, 1)[:, 0]
+        sums = a['close_sums'][rows]
+        for k, window in enumerate(MA_WINDOWS):
+            result[f'ma{window}'] = np.where(count >= window, sums[:, k] / window, np.nan)
+
+        avg_gain, avg_loss = a['avg_gain'][rows], a['avg_loss'][rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+            result['rsi14'] = np.where(count > RSI_PERIOD, rsi, np.nan)
+            result['atr_pct'] = np.where(count >= ATR_PERIOD, a['atr'][rows] / close * 100, np.nan)
+
+            volume = _last_values(a['volume_ring'][rows], count, 1)[:, 0]
+            previous_mean = (a['volume_sum'][rows] - volume) / VOLUME_WINDOW
+            result['volume_surge'] = np.where(count > VOLUME_WINDOW, volume / previous_mean, np.nan)
+
+            filled = np.minimum(count, RANGE_WINDOW)
+            high52 = _masked_reduce(a['high_ring'][rows], filled, np.max, -np.inf)
+            low52 = _masked_reduce(a['low_ring'][rows], filled, np.min, np.inf)
+            result['range_pos_52w'] = np.where(
+                count > 0, (close - low52) / (high52 - low52), np.nan)
+        return result
+
+
+def _wilder(arrays, name, idx, values, seen, period):
+    """Wilder 平滑：前 period 個值取簡單平均，之後 avg = (avg × (period - 1) + x) / period
+
+    seen 為包含本次在內已看過的值個數
+    """
+    if not len(idx):
+        return
+    current = arrays[name][idx]
+    current = np.where(np.isnan(current), 0.0, current)
+    warmup = seen <= period
+    updated = np.where(
+        warmup,
+        current + (values - current) / np.maximum(seen, 1),
+        (current * (period - 1) + values) / period,
+    )
+    arrays[name][idx] = updated
+
+
+def _last_values(ring, count, k):
+    """從環狀緩衝區取出最近 k 筆 (第 0 欄為最新)"""
+    size = ring.shape[1]
+    offsets = (count[:, None] - 1 - np.arange(k)[None, :]) % size
+    return np.take_along_axis(ring, offsets, axis=1)
+
+
+def _masked_reduce(ring, filled, reducer, fill):
+    """只對環狀緩衝區中已填入的部分做 max / min"""
+    mask = np.arange(ring.shape[1])[None, :] < filled[:, None]
+    return reducer(np.where(mask, ring, fill), axis=1)
+
+
+def update_from_cache(state, conn, tickers, until=None):
+    """把價格快取中新的 K 棒併入狀態
+
+    新標的讀取最近 HISTORY_DAYS 筆建立狀態；已追蹤的標的依各自的最後狀態日期分組，每組只讀取該日期之後的 K 棒，
+    停牌或下市的標的不會讓同批其他標的重讀整段歷史。until 之後 (含) 的 K 棒不併入，避免盤中未收盤的資料被寫進狀態
+    """
+    state.ensure(tickers)
+    last = state.arrays['last_date'][state.rows(tickers)]
+    fresh = [ticker for ticker, day in zip(tickers, last) if np.isnat(day)]
+    groups = {}
+    for ticker, day in zip(tickers, last):
+        if not np.isnat(day):
+            groups.setdefault(day, []).append(ticker)
+
+    if fresh:
+        dates, bars = load_matrix(conn, fresh, days=HISTORY_DAYS, until=until)
+        state.update(fresh, dates, bars)
+    # 大多數標的的最後日期相同，組數通常只有一兩組
+    for since, known in groups.items():
+        dates, bars = load_matrix(conn, known, since=since, until=until)
+        state.update(known, dates, bars)
+    return state.values(tickers)
+
+
+def verify(state, conn, tickers, rtol=1e-6):
+    """驗證模式：以價格快取從每支標的的起始日完整重算，回傳與增量狀態不一致的標的
+
+    只比對已追蹤的標的，重算範圍與增量狀態相同 (first_date 至 last_date)
+    """
+    rows = state.rows(tickers)
+    first, last = state.arrays['first_date'][rows], state.arrays['last_date'][rows]
+    tracked = ~np.isnat(last)
+    tickers = [ticker for ticker, ok in zip(tickers, tracked) if ok]
+    if not tickers:
+        return []
+    first, last = first[tracked], last[tracked]
+
+    dates, bars = load_matrix(conn, tickers, since=first.min() - 1, until=last.max() + 1)
+    # 每支標的只保留自己的 [first_date, last_date] 區間
+    outside = (dates[:, None] < first[None, :]) | (dates[:, None] > last[None, :])
+    bars = {field: np.where(outside, np.nan, matrix) for field, matrix in bars.items()}
+    rebuilt = IndicatorState(tickers)
+    rebuilt.update(tickers, dates, bars)
+
+    expected, actual = rebuilt.values(tickers), state.values(tickers)
+    close = np.isclose(actual.to_numpy(), expected.to_numpy(), rtol=rtol, equal_nan=True).all(axis=1)
+    same_count = rebuilt.arrays['count'] == state.arrays['count'][state.rows(tickers)]
+    return [ticker for ticker, ok in zip(tickers, close & same_count) if not ok]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="技術指標狀態工具")
+    parser.add_argument('--verify', action='store_true', help="以價格快取完整重算，比對增量狀態")
+    parser.add_argument('--repair', action='store_true', help="驗證後清空不一致的標的並重建")
+    args = parser.parse_args()
+
+    state = IndicatorState.load()
+    print(f"📈 技術指標狀態：{len(state.tickers)} 支標的 ({INDICATOR_STATE_DIR})")
+    if args.verify or args.repair:
+        conn = connect()
+        try:
+            mismatched = verify(state, conn, state.tickers)
+            print(f"   {'❌' if mismatched else '✅'} 與完整重算不一致 {len(mismatched)} 支"
+                  + (f": {', '.join(mismatched[:20])}" if mismatched else ""))
+            if args.repair and mismatched:
+                # 重建到與其他標的相同的最後日期為止
+                until = state.arrays['last_date'][state.rows(mismatched)].max() + 1
+                state.reset(mismatched)
+                update_from_cache(state, conn, mismatched, until=until)
+                state.save()
+                print(f"   🔧 已重建 {len(mismatched)} 支標的")
+        finally:
+            conn.close()
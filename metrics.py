@@ -0,0 +1,114 @@
+"""
+執行指標 - 各階段計時、計數器、傳輸量與 Gemini Token 用量
+每次執行結束輸出 JSON 報告 (可選 Prometheus textfile) 與一行摘要
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+_started_at = time.time()
+
+
+def reset():
+    """清空所有指標 (常駐模式每次觸發前呼叫)"""
+    global _started_at
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _started_at = time.time()
+
+
+@contextmanager
+def span(name):
+    """計時區塊：with span('report'): ...，同名區塊的耗時會累加"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            entry = _spans.setdefault(name, {'seconds': 0.0, 'count': 0})
+            entry['seconds'] += elapsed
+            entry['count'] += 1
+
+
+def incr(name, amount=1):
+    """累加計數器 (次數、位元組、Token 等)"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def record_usage(usage_metadata):
+    """記錄 Gemini 回應中的 Token 用量"""
+    if usage_metadata is None:
+        return
+    incr('gemini_prompt_tokens', getattr(usage_metadata, 'prompt_token_count', 0) or 0)
+    incr('gemini_output_tokens', getattr(usage_metadata, 'candidates_token_count', 0) or 0)
+    incr('gemini_total_tokens', getattr(usage_metadata, 'total_token_count', 0) or 0)
+
+
+def snapshot():
+    """目前所有指標的副本"""
+    with _lock:
+        return {
+            'started_at': datetime.fromtimestamp(_started_at, timezone.utc).isoformat(),
+            'spans': {name: dict(entry) for name, entry in _spans.items()},
+            'counters': dict(_counters),
+        }
+
+
+def to_prometheus(data):
+    """轉成 Prometheus textfile collector 格式"""
+    lines = [
+        "# HELP stock_bot_stage_seconds Wall time spent in each stage of the last run.",
+        "# TYPE stock_bot_stage_seconds gauge",
+    ]
+    for name, entry in sorted(data['spans'].items()):
+        lines.append(f'stock_bot_stage_seconds{{stage="{name}"}} {entry["seconds"]:.6f}')
+    lines += [
+        "# HELP stock_bot_counter Counters of the last run.",
+        "# TYPE stock_bot_counter gauge",
+    ]
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f'stock_bot_counter{{name="{name}"}} {value}')
+    lines.append(f"stock_bot_last_run_timestamp_seconds {_started_at:.0f}")
+    return "\n".join(lines) + "\n"
+
+
+def _atomic_write(path, content):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def summary_line(data):
+    """一行摘要：總耗時、各階段耗時與主要計數"""
+    spans = data['spans']
+    counters = data['counters']
+    total = spans.get('run', {}).get('seconds', 0.0)
+    stages = " ".join(
+        f"{name}={entry['seconds']:.2f}s" for name, entry in spans.items() if name != 'run'
+    )
+    keys = ('tickers_fetched', 'tickers_missing', 'tickers_qualified', 'chunks_sent',
+            'retries', 'prompt_candidates', 'gemini_prompt_tokens', 'gemini_output_tokens')
+    counts = " ".join(f"{key}={counters[key]}" for key in keys if key in counters)
+    return f"📊 執行摘要 total={total:.2f}s {stages} {counts}".rstrip()
+
+
+def write_report(json_path=None, prometheus_path=None):
+    """寫出本次執行的指標報告並回傳摘要文字"""
+    data = snapshot()
+    if json_path:
+        _atomic_write(json_path, json.dumps(data, ensure_ascii=False, indent=2))
+    if prometheus_path:
+        _atomic_write(prometheus_path, to_prometheus(data))
+    return summary_line(data)
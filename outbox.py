@@ -0,0 +1,328 @@
+"""
+推播外送匣 - 每個推播請求 (Discord 一個 payload、LINE 一批最多 5 則訊息) 先寫入 SQLite 再送出
+以冪等鍵 (交易日 + 管道 + 對象 + 主題 + 版本 + 分段序號) 去重，版本為整則訊息內容的雜湊值；
+同一主題每天只送一個版本：重跑時內容相同則略過已送達的分段，已完整送出另一版本時不再送新版本。
+背景執行緒依對象分道並行送出 (同一對象的分段維持順序)，暫時性錯誤以退避重試，確認送達才標為已送出
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache_paths import CACHE_DIR
+from retry_policy import RetryPolicy, is_retryable
+
+OUTBOX_PATH = os.path.join(CACHE_DIR, 'outbox.sqlite')
+# 超過此時數仍未送達的分段不再送出 (例如隔天才重跑時，前一天的盤中警示已無意義)
+OUTBOX_MAX_AGE_HOURS = float(os.environ.get('OUTBOX_MAX_AGE_HOURS', 12))
+# 已送出或放棄的紀錄保留天數
+OUTBOX_KEEP_DAYS = float(os.environ.get('OUTBOX_KEEP_DAYS', 7))
+
+PENDING, SENT, FAILED = 'pending', 'sent', 'failed'
+# 資料表格式版本 (PRAGMA user_version)，舊格式的冪等鍵無法沿用，開啟時直接重建
+OUTBOX_SCHEMA_VERSION = 2
+
+
+def series_of(run_date, channel, target, topic):
+    """同一交易日送給同一對象的同一主題 (例如早報) 的所有分段"""
+    return json.dumps([str(run_date), channel, target, topic], ensure_ascii=False)
+
+
+def content_version(payloads):
+    """整則訊息的版本：所有請求內容的雜湊值"""
+    return hashlib.sha256(json.dumps(payloads, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def idempotency_key(series, version, index):
+    """分段的冪等鍵：某個主題的某個版本的第 index 個請求"""
+    payload = json.dumps([series, version, index], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def lane_of(channel, target):
+    """分道：同一管道、同一對象的分段依序送出"""
+    return f"{channel}:{json.dumps(target, ensure_ascii=False)}"
+
+
+class Outbox:
+    """SQLite 外送匣，可由多個執行緒共用 (寫入以鎖保護)"""
+
+    def __init__(self, path=OUTBOX_PATH, keep_days=OUTBOX_KEEP_DAYS):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != OUTBOX_SCHEMA_VERSION:
+            with self.conn:
+                self.conn.execute("DROP TABLE IF EXISTS outbox")
+                self.conn.execute("DROP TABLE IF EXISTS outbox_series")
+                self.conn.execute(f"PRAGMA user_version = {OUTBOX_SCHEMA_VERSION}")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                key          TEXT PRIMARY KEY,
+                lane         TEXT NOT NULL,
+                channel      TEXT NOT NULL,
+                target       TEXT NOT NULL,
+                payload      TEXT NOT NULL,
+                status       TEXT NOT NULL,
+                attempts     INTEGER NOT NULL DEFAULT 0,
+                error        TEXT,
+                created_at   REAL NOT NULL,
+                sent_at      REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, lane)")
+        # 每個主題目前採用的版本與該版本的所有冪等鍵；complete 為 0 代表串流中、分段尚未排入完畢
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox_series (
+                series       TEXT PRIMARY KEY,
+                version      TEXT NOT NULL,
+                complete     INTEGER NOT NULL,
+                keys         TEXT NOT NULL,
+                updated_at   REAL NOT NULL
+            )
+        """)
+        with self._lock, self.conn:
+            expired = time.time() - keep_days * 86400
+            self.conn.execute("DELETE FROM outbox WHERE status != ? AND created_at < ?", (PENDING, expired))
+            self.conn.execute("DELETE FROM outbox_series WHERE updated_at < ?", (expired,))
+
+    def enqueue(self, run_date, channel, target, topic, payloads, stream=None):
+        """排入一則訊息的所有請求，回傳應等待送達的冪等鍵
+
+        版本為內容的雜湊值：與目前版本相同時只補送尚未送達的分段；目前版本還沒有任何分段送達時，
+        舊版本未送出的分段標為已取代並改送新版本；目前版本已完整送出 (或送出中) 時不送新版本，
+        回傳目前版本的冪等鍵 (只有確實送達才算完成)。目前版本只送出部分內容且無法補齊時改送完整的新版本。
+        stream 為串流識別碼時，payloads 只是串流中的一個段落，分段序號接在同一串流先前的段落之後，
+        全部段落排入後以 seal 登記完整內容的版本
+        """
+        series = series_of(run_date, channel, target, topic)
+        version = stream or content_version(payloads)
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                "SELECT version, complete, keys FROM outbox_series WHERE series = ?", (series,)).fetchone()
+            if row is not None and row[0] != version:
+                current, complete, current_keys = row[0], row[1], json.loads(row[2])
+                statuses = self._statuses(current_keys)
+                if complete and SENT in statuses.values():
+                    self._revive(current_keys)
+                    print(f"⏭️  {channel}: 今天已送出另一版本的內容，不再送出新版本 (只補送舊版本未送達的分段)")
+                    return current_keys
+                self.conn.executemany("UPDATE outbox SET status = ?, error = ? WHERE key = ? AND status = ?",
+                                      [(FAILED, "已由較新的內容取代", key, PENDING) for key in current_keys])
+                if SENT in statuses.values():
+                    print(f"⚠️ {channel}: 前一版本只送出部分內容，改送完整的新版本")
+                row = None
+
+            start = len(json.loads(row[2])) if row is not None and stream else 0
+            if row is not None and not stream:
+                keys = json.loads(row[2])
+                self._revive(keys)
+                return keys
+            keys = [idempotency_key(series, version, i) for i in range(start, start + len(payloads))]
+            now = time.time()
+            self.conn.executemany("""
+                INSERT INTO outbox (key, lane, channel, target, payload, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET status = excluded.status, attempts = 0, error = NULL,
+                    created_at = excluded.created_at
+                WHERE outbox.status = 'failed'
+            """, [(key, lane_of(channel, target), channel, json.dumps(target, ensure_ascii=False),
+                   json.dumps(payload, ensure_ascii=False), PENDING, now) for key, payload in zip(keys, payloads)])
+            all_keys = (json.loads(row[2]) if row is not None else []) + keys
+            self.conn.execute("INSERT OR REPLACE INTO outbox_series VALUES (?, ?, ?, ?, ?)",
+                              (series, version, 0 if stream else 1, json.dumps(all_keys), now))
+        return keys
+
+    def seal(self, run_date, channel, target, topic, stream, payloads):
+        """串流的所有段落都已排入：把串流登記為完整內容 (payloads 為整則訊息的請求) 的版本，
+        之後以同樣內容排入時 (例如重跑時讀到快取的報告) 沿用串流送出的分段
+        """
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE outbox_series SET version = ?, complete = 1, updated_at = ? WHERE series = ? AND version = ?",
+                (content_version(payloads), time.time(), series_of(run_date, channel, target, topic), stream))
+
+    def _revive(self, keys):
+        # 呼叫端已持有鎖：先前放棄的分段重新排入
+        self.conn.executemany(
+            "UPDATE outbox SET status = ?, attempts = 0, error = NULL, created_at = ? WHERE key = ? AND status = ?",
+            [(PENDING, time.time(), key, FAILED) for key in keys])
+
+    def _statuses(self, keys):
+        # 呼叫端已持有鎖
+        result = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            result.update(self.conn.execute(
+                f"SELECT key, status FROM outbox WHERE key IN ({', '.join('?' * len(batch))})", batch))
+        return result
+
+    def pending_lanes(self):
+        with self._lock:
+            return [lane for lane, in self.conn.execute(
+                "SELECT DISTINCT lane FROM outbox WHERE status = ?", (PENDING,))]
+
+    def head(self, lane):
+        """分道中最早排入且尚未送出的分段：(冪等鍵, 管道, 對象, payload, 已嘗試次數, 排入時間)，沒有則回傳 None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT key, channel, target, payload, attempts, created_at FROM outbox "
+                "WHERE lane = ? AND status = ? ORDER BY rowid LIMIT 1", (lane, PENDING)).fetchone()
+        if row is None:
+            return None
+        key, channel, target, payload, attempts, created_at = row
+        return key, channel, json.loads(target), json.loads(payload), attempts, created_at
+
+    def mark(self, key, status, error=None):
+        """記錄一次嘗試的結果 (status 為 PENDING 代表稍後重試)"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, error = ?, "
+                "sent_at = CASE WHEN ? = 'sent' THEN ? ELSE sent_at END WHERE key = ?",
+                (status, error, status, time.time(), key))
+
+    def _select(self, columns, keys):
+        # 每次查詢最多 500 個參數 (SQLite 的參數數量有上限)
+        result = {}
+        keys = list(keys)
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                result.update(self.conn.execute(
+                    f"SELECT key, {columns} FROM outbox WHERE key IN ({', '.join('?' * len(batch))})", batch))
+        return result
+
+    def statuses(self, keys):
+        """{冪等鍵: 狀態}"""
+        return self._select('status', keys)
+
+    def sent_times(self, keys):
+        """{冪等鍵: 送達時間 (epoch 秒)}，只含已送出的分段"""
+        return {key: at for key, at in self._select('sent_at', keys).items() if at is not None}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class Drainer:
+    """背景推播：每個分道由一個工作執行緒依序送出，不同分道同時進行 (最多 workers 個)
+
+    send(管道, 對象, payload, 冪等鍵) 成功時正常回傳，失敗時拋出例外：可重試的錯誤 (429、5xx、連線問題)
+    依 policy 退避後重試，不會放棄；其餘錯誤標為 failed 並繼續送同一分道的下一段。
+    分段排入超過 max_age_hours 仍未送達時標為 failed，不再送出
+    """
+
+    def __init__(self, outbox, send, workers=4, policy=None, max_age_hours=OUTBOX_MAX_AGE_HOURS):
+        self.outbox = outbox
+        self.send = send
+        self.workers = workers
+        self.policy = policy or RetryPolicy(base_delay=1.0, max_delay=30.0)
+        self.max_age_hours = max_age_hours
+        self.stats = {'sent': 0, 'retries': 0, 'failed': 0}
+        self._stats_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._active = set()
+        self._not_before = {}
+        self._submitted = []
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        """啟動背景執行緒 (會一併送出先前執行留下、尚未送達的分段)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='outbox-drainer', daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, run_date, channel, target, topic, payloads, stream=None):
+        """排入一則訊息 (或串流中的一個段落) 後立即回傳應等待的冪等鍵，實際送出由背景執行緒進行"""
+        keys = self.outbox.enqueue(run_date, channel, target, topic, payloads, stream)
+        with self._cond:
+            self._submitted.extend(keys)
+            self._cond.notify_all()
+        return keys
+
+    def _count(self, name):
+        # 各分道在不同執行緒更新統計
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def seal(self, run_date, channel, target, topic, stream, payloads):
+        """串流的所有段落都已排入，見 Outbox.seal"""
+        self.outbox.seal(run_date, channel, target, topic, stream, payloads)
+
+    def wait(self, keys=None, timeout=None):
+        """等到 keys (預設為本行程排入的所有分段) 都已送出或放棄，或超過 timeout 秒；回傳 {冪等鍵: 狀態}"""
+        keys = list(self._submitted if keys is None else keys)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                statuses = self.outbox.statuses(keys)
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if PENDING not in statuses.values() or (remaining is not None and remaining <= 0):
+                    return statuses
+                self._cond.wait(1.0 if remaining is None else min(remaining, 1.0))
+
+    def stop(self):
+        """停止背景執行緒 (等待進行中的請求完成)；未送出的分段留在外送匣，下次啟動時繼續"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='outbox') as pool:
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    for lane in self.outbox.pending_lanes():
+                        if lane not in self._active and self._not_before.get(lane, 0) <= now:
+                            self._active.add(lane)
+                            pool.submit(self._drain_lane, lane)
+                    # 等到有新的分段排入、某個分道告一段落，或最早的退避時間到期
+                    due = [at - now for lane, at in self._not_before.items() if at > now and lane not in self._active]
+                    self._cond.wait(min(due, default=None))
+
+    def _drain_lane(self, lane):
+        try:
+            while not self._stopped:
+                head = self.outbox.head(lane)
+                if head is None:
+                    break
+                key, channel, target, payload, attempts, created_at = head
+                if time.time() - created_at > self.max_age_hours * 3600:
+                    self.outbox.mark(key, FAILED, "超過有效時間仍未送達")
+                    self._count('failed')
+                    continue
+                try:
+                    self.send(channel, target, payload, key)
+                except Exception as e:
+                    if is_retryable(e):
+                        delay = self.policy.delay(attempts, e)
+                        self.outbox.mark(key, PENDING, str(e))
+                        self._count('retries')
+                        print(f"⏳ {channel} 暫時無法送達 ({e})，{delay:.1f} 秒後重試")
+                        with self._cond:
+                            self._not_before[lane] = time.monotonic() + delay
+                        break
+                    self.outbox.mark(key, FAILED, str(e))
+                    self._count('failed')
+                    print(f"❌ {channel} 分段送出失敗: {e}")
+                else:
+                    self.outbox.mark(key, SENT)
+                    self._count('sent')
+                with self._cond:
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._active.discard(lane)
+                self._cond.notify_all()
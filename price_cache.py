@@ -0,0 +1,266 @@
+"""
+本地價格快取 - 以 SQLite 依 (代號, 日期) 儲存日 K 線
+每次執行只下載最後儲存日期之後缺少的 K 棒，其餘直接從磁碟讀取
+"""
+
+import os
+import sqlite3
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from cache_paths import CACHE_DIR
+from downloader import DOWNLOAD_CHUNK_SIZE, chunked, download_in_chunks
+
+PRICE_DB_PATH = os.path.join(CACHE_DIR, 'prices.sqlite')
+# 冷啟動 (完全沒有快取) 時下載的歷史長度，需涵蓋 52 週區間等長天期指標
+COLD_START_PERIOD = os.environ.get('PRICE_COLD_START_PERIOD', '1y')
+# 下載成功卻沒有資料的標的 (下市、長期停牌) 記錄在 empty_tickers 表，此天數內不再下載
+EMPTY_RETRY_DAYS = int(os.environ.get('PRICE_EMPTY_RETRY_DAYS', 7))
+
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def connect(path=PRICE_DB_PATH):
+    """開啟價格資料庫，必要時建立資料表"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS prices (
+            ticker TEXT NOT NULL,
+            date   TEXT NOT NULL,
+            open REAL, high REAL, low REAL, close REAL, volume REAL,
+            PRIMARY KEY (ticker, date)
+        )
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS empty_tickers (ticker TEXT PRIMARY KEY, checked TEXT NOT NULL)")
+    return conn
+
+
+def last_dates(conn, tickers):
+    """回傳每支標的最後一筆已儲存的日期 (沒有資料者不在結果中)"""
+    rows = conn.execute(
+        "SELECT ticker, MAX(date) FROM prices GROUP BY ticker"
+    ).fetchall()
+    wanted = set(tickers)
+    return {ticker: last for ticker, last in rows if ticker in wanted}
+
+
+def store_frames(conn, frames):
+    """將下載結果寫入資料庫 (同一天重複下載時以新資料覆蓋)"""
+    rows = []
+    for ticker, hist in frames.items():
+        hist = hist.dropna(subset=['Close'])
+        dates = hist.index.strftime('%Y-%m-%d')
+        values = hist[FIELDS].to_numpy(dtype='float64').tolist()
+        rows.extend((ticker, day, *bar) for day, bar in zip(dates, values))
+    conn.executemany(
+        "INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+    )
+    conn.commit()
+    return len(rows)
+
+
+def load_prices(conn, tickers, days=5):
+    """從快取讀出最近 N 個交易日，格式與 yf.download(group_by='ticker') 相同"""
+    if not tickers:
+        return pd.DataFrame()
+    placeholders = ", ".join("?" * len(tickers))
+    rows = conn.execute(
+        f"""
+        SELECT ticker, date, open, high, low, close, volume FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY date DESC) AS rn
+            FROM prices WHERE ticker IN ({placeholders})
+        ) WHERE rn <= ?
+        """,
+        (*tickers, days),
+    ).fetchall()
+    if not rows:
+        return pd.DataFrame()
+
+    long = pd.DataFrame(rows, columns=['ticker', 'Date'] + FIELDS)
+    long['Date'] = pd.to_datetime(long['Date'], format='%Y-%m-%d')
+    wide = long.set_index(['Date', 'ticker'])[FIELDS].unstack('ticker')
+    wide = wide.swaplevel(0, 1, axis=1)
+    # 依呼叫端的標的順序排列，欄位順序固定為 FIELDS
+    present = set(wide.columns.get_level_values(0))
+    order = [ticker for ticker in tickers if ticker in present]
+    return wide.reindex(columns=pd.MultiIndex.from_product([order, FIELDS]))
+
+
+def recently_empty(conn, days=EMPTY_RETRY_DAYS):
+    """最近 days 天內下載成功卻沒有資料的標的"""
+    since = (date.today() - timedelta(days=days)).isoformat()
+    return {ticker for ticker, in conn.execute("SELECT ticker FROM empty_tickers WHERE checked > ?", (since,))}
+
+
+def record_empty(conn, empty, downloaded):
+    """記錄這次沒有資料的標的，並移除重新有資料的標的"""
+    today = date.today().isoformat()
+    conn.executemany("INSERT OR REPLACE INTO empty_tickers VALUES (?, ?)", [(ticker, today) for ticker in empty])
+    conn.executemany("DELETE FROM empty_tickers WHERE ticker = ?", [(ticker,) for ticker in downloaded])
+    conn.commit()
+
+
+def download_plan(conn, tickers, refresh=False):
+    """依最後儲存日期分組，回傳 (不必下載的標的, [(下載參數, 標的清單)])
+
+    refresh=True 時今天已有 K 棒的標的也重抓 (盤中 K 棒尚未收盤)；
+    最近確認過沒有資料的標的 (見 EMPTY_RETRY_DAYS) 不下載，直接讀取快取中的舊資料
+    """
+    known = last_dates(conn, tickers)
+    skipped = recently_empty(conn)
+    groups = {}
+    for ticker in tickers:
+        if ticker not in skipped:
+            groups.setdefault(known.get(ticker), []).append(ticker)
+
+    today = date.today()
+    fresh, plan = [ticker for ticker in tickers if ticker in skipped], []
+    for last, group in groups.items():
+        if last is None:
+            plan.append(({'period': COLD_START_PERIOD}, group))
+            continue
+        # 從最後一天開始重抓，確保前一次抓到的未收盤 K 棒被更新
+        start = date.fromisoformat(last)
+        if start >= today and not refresh:
+            fresh.extend(group)
+        else:
+            plan.append(({'start': start.isoformat(),
+                          'end': (today + timedelta(days=1)).isoformat()}, group))
+    return fresh, plan
+
+
+def iter_prices(tickers, days=5, path=PRICE_DB_PATH, stats=None, refresh=False, offline=False):
+    """逐批產出 (標的清單, 最近 N 日資料)，每支標的剛好出現一次
+
+    已是最新的標的直接從磁碟讀取；其餘分批下載，每完成一批就寫入快取並立刻產出，
+    記憶體用量只與批次大小有關。下載失敗的標的最後以快取中的舊資料 (或空表) 產出
+    offline=True 時完全不下載，只讀取快取 (價格已在前一個階段更新過)
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault('rows', 0)
+    stats.setdefault('bytes', 0)
+    conn = connect(path)
+    try:
+        fresh, plan = (list(tickers), []) if offline else download_plan(conn, tickers, refresh)
+        stats['cold'] = len(fresh) == 0 and all('period' in kwargs for kwargs, _ in plan)
+
+        for chunk in chunked(fresh, DOWNLOAD_CHUNK_SIZE):
+            yield chunk, load_prices(conn, chunk, days)
+
+        done = set(fresh)
+        for kwargs, group in plan:
+            for frames in download_in_chunks(group, stats=stats, **kwargs):
+                stats['bytes'] += sum(int(hist.memory_usage(deep=True).sum()) for hist in frames.values())
+                stats['rows'] += store_frames(conn, frames)
+                chunk = list(frames)
+                done.update(chunk)
+                yield chunk, load_prices(conn, chunk, days)
+        if plan:
+            record_empty(conn, stats.get('empty', []), done - set(fresh))
+
+        remaining = [ticker for ticker in tickers if ticker not in done]
+        for chunk in chunked(remaining, DOWNLOAD_CHUNK_SIZE):
+            yield chunk, load_prices(conn, chunk, days)
+    finally:
+        conn.close()
+
+
+def backfill(tickers, since, path=PRICE_DB_PATH, stats=None):
+    """補抓 since 到快取最早日期之間的歷史 (回測用)，回傳補抓的標的數
+
+    同一支標的對同一個起始日只補抓一次 (記錄在 coverage 表)：上市日晚於 since 的標的
+    補抓不到更早的資料，不必每次重試；完全沒有快取又下載失敗的標的則下次再試
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault('rows', 0)
+    since = str(since)
+    conn = connect(path)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS coverage (ticker TEXT PRIMARY KEY, since TEXT NOT NULL)")
+        covered = dict(conn.execute("SELECT ticker, since FROM coverage").fetchall())
+        first = dict(conn.execute("SELECT ticker, MIN(date) FROM prices GROUP BY ticker").fetchall())
+        groups = {}
+        for ticker in tickers:
+            if covered.get(ticker, '9999-12-31') > since and first.get(ticker, '9999-12-31') > since:
+                groups.setdefault(first.get(ticker), []).append(ticker)
+
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        for end, group in groups.items():
+            for frames in download_in_chunks(group, stats=stats, start=since, end=end or tomorrow):
+                stats['rows'] += store_frames(conn, frames)
+            failed = set(stats.get('failed', []))
+            conn.executemany("INSERT OR REPLACE INTO coverage VALUES (?, ?)",
+                             [(ticker, since) for ticker in group if ticker not in failed or ticker in first])
+            conn.commit()
+        return sum(len(group) for group in groups.values())
+    finally:
+        conn.close()
+
+
+def report_stats(stats, n_tickers, elapsed):
+    """輸出下載耗時與資料量"""
+    mode = "冷啟動" if stats.get('cold') else "增量更新"
+    failed = len(stats.get('failed', []))
+    empty = len(stats.get('empty', []))
+    print(f"   💾 價格快取 ({mode}): {n_tickers} 支標的, "
+          f"{stats.get('requests', 0)} 次下載 (重試 {stats.get('retries', 0)} 批, 失敗 {failed} 支, 無資料 {empty} 支), "
+          f"新增 {stats['rows']} 筆 K 棒, 約 {stats['bytes'] / 1024:.1f} KB, 耗時 {elapsed:.2f} 秒")
+
+
+def get_prices(tickers, days=5, path=PRICE_DB_PATH, offline=False):
+    """補齊快取後回傳最近 N 日資料 (一次組成完整資料表，適合少量標的)"""
+    start_time = time.perf_counter()
+    stats = {}
+    frames = [frame for _, frame in iter_prices(tickers, days, path, stats, offline=offline) if not frame.empty]
+    report_stats(stats, len(tickers), time.perf_counter() - start_time)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, axis=1)
+
+
+def load_matrix(conn, tickers, since=None, days=None, until=None):
+    """讀出 (日期 × 標的) 的 numpy 矩陣，供指標計算使用
+
+    since: 只讀取此日期之後的 K 棒；days: 每支標的只取最近 N 筆；until: 只讀取此日期之前的 K 棒
+    回傳 (日期陣列, {欄位: 矩陣})，缺資料處為 NaN
+    """
+    if not tickers:
+        return np.array([], dtype='datetime64[D]'), {field: np.empty((0, 0)) for field in FIELDS}
+    placeholders = ", ".join("?" * len(tickers))
+    conditions, params = [f"ticker IN ({placeholders})"], list(tickers)
+    if since is not None:
+        conditions.append("date > ?")
+        params.append(str(since))
+    if until is not None:
+        conditions.append("date < ?")
+        params.append(str(until))
+    query = f"SELECT ticker, date, open, high, low, close, volume FROM prices WHERE {' AND '.join(conditions)}"
+    if days is not None:
+        query = f"""
+            SELECT ticker, date, open, high, low, close, volume FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY date DESC) AS rn
+                FROM prices WHERE {' AND '.join(conditions)}
+            ) WHERE rn <= ?
+        """
+        params.append(days)
+    return pivot_rows(conn.execute(query, params).fetchall(), tickers)
+
+
+def pivot_rows(rows, tickers):
+    """(代號, 日期, 開, 高, 低, 收, 量) 的資料列 → (日期陣列, {欄位: (日期 × 標的) 矩陣})，缺資料處為 NaN"""
+    if not rows:
+        return np.array([], dtype='datetime64[D]'), {field: np.empty((0, len(tickers))) for field in FIELDS}
+    symbols, dates, *values = zip(*rows)
+    dates = np.array(dates, dtype='datetime64[D]')
+    unique_dates, row_index = np.unique(dates, return_inverse=True)
+    col_index = pd.Index(tickers).get_indexer(symbols)
+    matrices = {}
+    for field, column in zip(FIELDS, values):
+        matrix = np.full((len(unique_dates), len(tickers)), np.nan)
+        matrix[row_index, col_index] = np.asarray(column, dtype='float64')
+        matrices[field] = matrix
+    return unique_dates, matrices
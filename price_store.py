@@ -0,0 +1,207 @@
+"""
+欄位式價格存放區 - 把價格快取 (SQLite) 的日 K 線整理成 (日期 × 標的) 的二進位欄位檔：
+開高低收為 float32、成交量為 int64，以記憶體映射唯讀開啟，多個行程同時讀取時共用作業系統的同一份分頁，
+不必各自從 SQLite 重組矩陣或 DataFrame；之後每次同步只把 SQLite 中新寫入的 K 棒併入 (新交易日附加在檔案尾端)
+"""
+
+import json
+import os
+
+import numpy as np
+
+from cache_paths import CACHE_DIR
+
+PRICE_STORE_DIR = os.path.join(CACHE_DIR, 'price_store')
+PRICE_STORE_VERSION = 1
+
+# 欄位順序與 price_cache.FIELDS 相同；成交量以 -1 代表缺資料
+FIELD_DTYPES = {
+    'Open': np.dtype('float32'),
+    'High': np.dtype('float32'),
+    'Low': np.dtype('float32'),
+    'Close': np.dtype('float32'),
+    'Volume': np.dtype('int64'),
+}
+MISSING_VOLUME = -1
+
+
+def encode(field, matrix):
+    """float64 矩陣 (缺資料為 NaN) → 存放區的欄位型別"""
+    matrix = np.asarray(matrix, dtype='float64')
+    if field == 'Volume':
+        return np.where(np.isnan(matrix), MISSING_VOLUME, np.rint(matrix)).astype('int64')
+    return matrix.astype('float32')
+
+
+def decode(field, block):
+    """存放區的欄位 → float64 矩陣 (缺資料為 NaN)，與 price_cache.load_matrix 的格式相同"""
+    if field == 'Volume':
+        return np.where(block == MISSING_VOLUME, np.nan, block).astype('float64')
+    return np.asarray(block, dtype='float64')
+
+
+class PriceStore:
+    """(日期 × 標的) 的欄位式日 K 線：每個欄位一個依日期列優先排列的二進位檔
+
+    columns 為唯讀記憶體映射；新交易日只需寫到檔案尾端，已存在日期的 K 棒 (例如重抓的最新一根) 就地改寫。
+    標的清單變大或起始日提前時整批重建：先刪除 meta.json 再以暫存檔替換各欄位檔，
+    中斷時下次開啟會發現沒有 meta.json 而重建，已映射舊檔的行程則繼續讀到舊內容
+    """
+
+    def __init__(self, path=PRICE_STORE_DIR, tickers=(), dates=None, since=None, watermark=0):
+        self.path = path
+        self.tickers = list(tickers)
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.dates = np.array([], dtype='datetime64[D]') if dates is None else np.asarray(dates, dtype='datetime64[D]')
+        self.since = None if since is None else np.datetime64(since, 'D')
+        # 已併入的 SQLite rowid 水位 (見 sync)
+        self.watermark = watermark
+        self.columns = self._map()
+
+    @classmethod
+    def load(cls, path=PRICE_STORE_DIR):
+        """開啟存放區；不存在、格式不符或上次重建中斷時回傳空的存放區 (下次同步時重建)"""
+        try:
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != PRICE_STORE_VERSION:
+                return cls(path)
+            dates = np.load(os.path.join(path, 'dates.npy'), allow_pickle=False)
+            if len(dates) != meta['days']:
+                return cls(path)
+            return cls(path, meta['tickers'], dates, meta['since'], meta['watermark'])
+        except (OSError, KeyError, ValueError):
+            return cls(path)
+
+    def _file(self, field):
+        return os.path.join(self.path, f"{field.lower()}.bin")
+
+    def _map(self, mode='r'):
+        shape = (len(self.dates), len(self.tickers))
+        if not shape[0] or not shape[1]:
+            return {field: np.empty(shape, dtype=dtype) for field, dtype in FIELD_DTYPES.items()}
+        # 檔案尾端可能有上次附加到一半的列，只映射 meta.json 記錄的列數
+        return {field: np.memmap(self._file(field), dtype=dtype, mode=mode, shape=shape)
+                for field, dtype in FIELD_DTYPES.items()}
+
+    def _save_meta(self):
+        tmp_path = os.path.join(self.path, 'dates.tmp.npy')
+        np.save(tmp_path, self.dates)
+        os.replace(tmp_path, os.path.join(self.path, 'dates.npy'))
+        meta = {'version': PRICE_STORE_VERSION, 'tickers': self.tickers, 'days': len(self.dates),
+                'since': str(self.since), 'watermark': self.watermark}
+        tmp_path = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+    def rebuild(self, tickers, since, dates, matrices, watermark):
+        """以完整的 (日期 × 標的) 矩陣改寫整個存放區"""
+        os.makedirs(self.path, exist_ok=True)
+        try:
+            os.remove(os.path.join(self.path, 'meta.json'))
+        except FileNotFoundError:
+            pass
+        for field in FIELD_DTYPES:
+            tmp_path = f"{self._file(field)}.tmp"
+            encode(field, matrices[field]).tofile(tmp_path)
+            os.replace(tmp_path, self._file(field))
+        self.tickers = list(tickers)
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.since = np.datetime64(since, 'D')
+        self.watermark = watermark
+        self._save_meta()
+        self.columns = self._map()
+
+    def merge(self, dates, matrices, watermark):
+        """併入新寫入的 K 棒 (以存放區的標的順序排列)：已有的日期就地改寫有資料的格子，較晚的日期附加在尾端
+
+        日期落在已有範圍內卻不是已知交易日時 (例如補抓了較早的歷史) 無法就地併入，回傳 False 由呼叫端重建
+        """
+        last = self.dates[-1] if len(self.dates) else np.datetime64('NaT', 'D')
+        appended = dates > last if len(self.dates) else np.ones(len(dates), dtype=bool)
+        positions = np.searchsorted(self.dates, dates[~appended])
+        if not np.array_equal(self.dates[np.minimum(positions, len(self.dates) - 1)], dates[~appended]):
+            return False
+
+        present = ~np.isnan(matrices['Close'][~appended])
+        if present.any():
+            rows, cols = np.nonzero(present)
+            for field, column in self._map('r+').items():
+                column[positions[rows], cols] = encode(field, matrices[field][~appended])[rows, cols]
+                column.flush()
+        if appended.any():
+            offset = len(self.dates) * len(self.tickers)
+            for field, dtype in FIELD_DTYPES.items():
+                with open(self._file(field), 'r+b') as f:
+                    f.seek(offset * dtype.itemsize)
+                    f.write(encode(field, matrices[field][appended]).tobytes())
+                    f.truncate()
+            self.dates = np.concatenate([self.dates, dates[appended]])
+        self.watermark = watermark
+        self._save_meta()
+        self.columns = self._map()
+        return True
+
+    def matrices(self, tickers=None, since=None):
+        """讀出 (日期陣列, {欄位: float64 矩陣})，格式與 price_cache.load_matrix 相同 (缺資料為 NaN)
+
+        tickers 須都在存放區中；since 為第一個要讀取的日期 (含)
+        """
+        start = 0 if since is None else int(np.searchsorted(self.dates, np.datetime64(since, 'D')))
+        cols = None if tickers is None else np.array([self.index[ticker] for ticker in tickers], dtype='int64')
+        result = {}
+        for field, column in self.columns.items():
+            block = column[start:] if cols is None else column[start:, cols]
+            result[field] = decode(field, block)
+        return self.dates[start:], result
+
+
+def sync(tickers, since, path=PRICE_STORE_DIR, db_path=None):
+    """把價格快取中新寫入的 K 棒併入存放區後回傳 (涵蓋 tickers 自 since 起的歷史)
+
+    以 SQLite 的 rowid 作為水位：價格快取只以 INSERT OR REPLACE 寫入，改寫同一根 K 棒時會刪除舊列再取得
+    目前最大 rowid + 1，所以 rowid 不小於上次水位的列就是上次同步之後新增或改寫的 K 棒
+    (上次最後一列被改寫時會沿用同一個 rowid，因此包含水位本身)；新標的或更早的起始日才需要整批重建
+    """
+    import price_cache
+
+    store = PriceStore.load(path)
+    since = np.datetime64(since, 'D')
+    conn = price_cache.connect(db_path or price_cache.PRICE_DB_PATH)
+    try:
+        # 先讀水位再讀資料：讀取期間才寫入的列 rowid 都大於水位，下次同步會再讀到
+        watermark = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM prices").fetchone()[0]
+        missing = [ticker for ticker in dict.fromkeys(tickers) if ticker not in store.index]
+        merged = False
+        if store.since is not None and not missing and since >= store.since:
+            rows = conn.execute(
+                "SELECT ticker, date, open, high, low, close, volume FROM prices WHERE rowid >= ?",
+                (store.watermark,),
+            ).fetchall()
+            first = str(store.since)
+            rows = [row for row in rows if row[0] in store.index and row[1] >= first]
+            dates, matrices = price_cache.pivot_rows(rows, store.tickers)
+            merged = store.merge(dates, matrices, watermark)
+        if not merged:
+            all_tickers = store.tickers + missing
+            start = since if store.since is None else min(since, store.since)
+            dates, matrices = price_cache.load_matrix(conn, all_tickers, since=start - 1)
+            store.rebuild(all_tickers, start, dates, matrices, watermark)
+    finally:
+        conn.close()
+    return store
+
+
+def share_arrays(directory, arrays):
+    """把 {名稱: 陣列} 寫成 directory 下的 .npy 檔，讓工作行程以 open_arrays 映射同一份資料而不是各自複製"""
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+
+def open_arrays(directory):
+    """以唯讀記憶體映射開啟 share_arrays 寫入的陣列"""
+    return {name[:-len('.npy')]: np.load(os.path.join(directory, name), mmap_mode='r', allow_pickle=False)
+            for name in sorted(os.listdir(directory)) if name.endswith('.npy')}
@@ -0,0 +1,104 @@
+"""
+Prompt 組裝 - 在 Token 預算內放入最多的候選標的
+候選表格已依篩選分數由高到低排序 (第一列為欄位名稱，之後每列一支)，超出預算時從分數最低的一列開始刪除；
+Token 數以 Gemini 的 count_tokens API 計算，無法使用時以字元數估算
+"""
+
+import os
+import re
+import threading
+
+# 放入候選表格的 Prompt (精選個股段落，含指示文字) 的 Token 預算
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', 400))
+# 確認 Token 數的 API 呼叫次數上限，用完後改以估計值刪減
+MAX_COUNT_CALLS = 4
+
+_CJK = re.compile(r'[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """粗估 Token 數：中日韓文字約 1 字 1 Token，其他約 4 字元 1 Token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_tokens(client, model, text):
+    """以 SDK 計算 Token 數，API 無法使用時回傳 None"""
+    try:
+        return client.models.count_tokens(model=model, contents=text).total_tokens
+    except Exception as e:
+        print(f"⚠️ 無法計算 Token 數，改用估計值: {e}")
+        return None
+
+
+def split_table(candidates):
+    """候選表格拆成 (欄位列, 資料列清單)"""
+    lines = candidates.splitlines()
+    return (lines[0], lines[1:]) if lines else ("", [])
+
+
+def pack_prompt(render, candidates, counter, budget=PROMPT_TOKEN_BUDGET):
+    """依分數順序放入最多的候選列，使 render(表格) 的 Token 數不超過預算
+
+    counter(文字) 回傳 Token 數 (None 表示無法計算)。先以估計值刪到接近預算，
+    之後以實際 Token 數換算每列的成本往回刪；第二次起改用兩次實際值之差換算，
+    不受指示文字與表格 Token 密度不同的影響，通常 2-3 次 API 呼叫即可確定
+    回傳 (Prompt, Token 數, 放入的列數, 總列數, Token 數是否為實際值)
+    """
+    header, rows = split_table(candidates)
+
+    def build(n):
+        return render("\n".join([header] + rows[:n]) if n else "")
+
+    # cost[i]: 前 i 列的估計 Token 數 (含換行)
+    cost = [0]
+    for row in rows:
+        cost.append(cost[-1] + estimate_tokens(row) + 1)
+    # 估計值可能偏低，先保留一半的餘裕，避免把整個股票池送去計算
+    base = estimate_tokens(build(0))
+    n = 0
+    while n < len(rows) and base + cost[n + 1] <= budget * 1.5:
+        n += 1
+
+    prompt = build(n)
+    tokens = counter(prompt)
+    exact, calls = tokens is not None, 1
+    if not exact:
+        tokens = estimate_tokens(prompt)
+    scale = tokens / max(estimate_tokens(prompt), 1)
+    while tokens > budget and n > 0:
+        keep = n
+        while keep > 0 and tokens - (cost[n] - cost[keep]) * scale > budget:
+            keep -= 1
+        prompt = build(keep)
+        counted = counter(prompt) if exact and calls < MAX_COUNT_CALLS else None
+        if counted is None:
+            tokens, exact = round(tokens - (cost[n] - cost[keep]) * scale), False
+        else:
+            calls += 1
+            if cost[n] > cost[keep]:
+                scale = max((tokens - counted) / (cost[n] - cost[keep]), 0.1)
+            tokens = counted
+        n = keep
+    return prompt, tokens, n, len(rows), exact
+
+
+class PromptCache:
+    """同一份輸入只組裝一次 (各段落的重試與改用備用模型都沿用同一份 Prompt；同一行程再次生成相同輸入的報告時，
+    例如常駐模式重跑或報告檢查點與候選清單不一致而重新生成，也不必再呼叫 count_tokens)"""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+        value = build()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = value
+        return value
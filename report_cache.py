@@ -0,0 +1,96 @@
+"""
+報告快取 - 以輸入內容的雜湊值為鍵，同一天重跑時不必再呼叫 Gemini
+鍵值涵蓋模型名稱、Prompt 版本、市場數據、候選清單與交易日
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from cache_paths import CACHE_DIR
+
+REPORT_CACHE_DIR = os.path.join(CACHE_DIR, 'reports')
+REPORT_CACHE_TTL_HOURS = float(os.environ.get('REPORT_CACHE_TTL_HOURS', 12))
+REPORT_CACHE_MAX_ENTRIES = int(os.environ.get('REPORT_CACHE_MAX_ENTRIES', 50))
+
+
+def report_key(model, prompt_version, market_data, qualified_stocks, trading_date):
+    """計算報告的內容位址 (輸入相同則鍵值相同)"""
+    payload = json.dumps({
+        'model': model,
+        'prompt_version': prompt_version,
+        'market_data': market_data,
+        'qualified_stocks': qualified_stocks,
+        'trading_date': str(trading_date),
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, f"{key}.json")
+
+
+def get_cached_report(key, ttl_hours=REPORT_CACHE_TTL_HOURS, cache_dir=REPORT_CACHE_DIR):
+    """讀取未過期的快取報告，沒有或已過期時回傳 None"""
+    path = _entry_path(key, cache_dir)
+    try:
+        with open(path, encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - entry.get('created_at', 0) > ttl_hours * 3600:
+        return None
+    # 更新存取時間，淘汰時以最久未使用的項目優先
+    os.utime(path)
+    return entry.get('report')
+
+
+def latest_cached_report(ttl_hours=REPORT_CACHE_TTL_HOURS, cache_dir=REPORT_CACHE_DIR):
+    """最近一次寫入且未過期的報告 (重送用)，沒有時回傳 None
+
+    讀取時會更新檔案時間，所以依內容中的 created_at 而非檔案時間判斷新舊
+    """
+    try:
+        names = [name for name in os.listdir(cache_dir) if name.endswith('.json')]
+    except OSError:
+        return None
+    newest = None
+    for name in names:
+        try:
+            with open(os.path.join(cache_dir, name), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if newest is None or entry.get('created_at', 0) > newest.get('created_at', 0):
+            newest = entry
+    if newest is None or time.time() - newest.get('created_at', 0) > ttl_hours * 3600:
+        return None
+    return newest.get('report')
+
+
+def put_cached_report(key, report, max_entries=REPORT_CACHE_MAX_ENTRIES, cache_dir=REPORT_CACHE_DIR):
+    """寫入報告並淘汰超出數量上限的舊項目"""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _entry_path(key, cache_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'created_at': time.time(), 'report': report}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    evict(max_entries, cache_dir)
+
+
+def evict(max_entries=REPORT_CACHE_MAX_ENTRIES, cache_dir=REPORT_CACHE_DIR):
+    """保留最近使用的 max_entries 份報告，其餘刪除"""
+    entries = [
+        os.path.join(cache_dir, name)
+        for name in os.listdir(cache_dir) if name.endswith('.json')
+    ]
+    if len(entries) <= max_entries:
+        return
+    entries.sort(key=os.path.getmtime)
+    for path in entries[:len(entries) - max_entries]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
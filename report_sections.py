@@ -0,0 +1,177 @@
+"""
+分段報告 - 美股新聞、台股新聞、精選個股各自以較短的 Prompt 同時向 Gemini 請求 (只有新聞段落使用 Google Search)，
+美股收盤摘要與候選標的的數字直接由本地資料套用模板，最後依原本的版面組合成完整早報
+"""
+
+from dataclasses import dataclass
+
+# 精選個股的支數
+PICKS_COUNT = 5
+
+REPORT_HEADER = """🌅 投資早報 - {date}
+
+📈 美股收盤摘要
+{market_summary}"""
+
+REPORT_FOOTER = """⚠️ 投資提醒
+本報告僅供參考，投資有風險請謹慎評估。"""
+
+# 有段落生成失敗時附在報告末尾 (這樣的報告不寫入快取與檢查點)
+PARTIAL_NOTICE = """⚠️ 系統提醒
+部分段落暫時無法生成，內容可能不完整。"""
+
+STYLE_RULES = """注意事項：
+- 不要使用任何 Markdown 語法 (如 **、##、[]() 等)
+- 不要輸出標題、開場白或結語
+- 使用繁體中文"""
+
+US_NEWS_PROMPT = """請以專業分析師身份使用 Google Search，摘要今日美股 3 個關鍵新聞。
+
+美股收盤數據 (供參考，不必重複)：
+{market_data}
+
+只輸出 3 行，每則新聞一行，以「●」開頭，每則限 50 字內。
+
+{style}"""
+
+TW_NEWS_PROMPT = """請以專業分析師身份使用 Google Search，摘要今日台股 3 個重要產業新聞。
+
+只輸出 3 行，每則新聞一行，以「●」開頭，每則限 50 字內。
+
+{style}"""
+
+PICKS_PROMPT = """請以專業分析師身份，從以下台股潛力候選清單中精選 {count} 支股票。
+
+候選清單 (依綜合分數由高到低，欄位以 | 分隔)：
+{candidates}
+
+只輸出 {count} 行，每行格式為「代號|公司名稱|推薦理由」，代號照抄候選清單，
+推薦理由結合產業趨勢，限 50 字內，不要重複表中的數字。
+
+{style}"""
+
+
+@dataclass(frozen=True)
+class Section:
+    """交給 Gemini 的段落：name 為識別名稱，title 為報告中的段落標題，grounded 決定是否使用 Google Search"""
+    name: str
+    title: str
+    grounded: bool
+
+
+SECTIONS = (
+    Section('us_news', "📰 1. 美股新聞重點", True),
+    Section('tw_news', "📰 2. 台股新聞重點", True),
+    Section('picks', f"🎯 3. 精選潛力股 ({PICKS_COUNT}支)", False),
+)
+
+
+def news_prompt(name, market_data=""):
+    """新聞段落的 Prompt (美股新聞附上收盤數據作為搜尋線索)"""
+    if name == 'us_news':
+        return US_NEWS_PROMPT.format(market_data=market_data.strip(), style=STYLE_RULES)
+    return TW_NEWS_PROMPT.format(style=STYLE_RULES)
+
+
+def picks_prompt(candidates):
+    """精選個股的 Prompt：只附上候選表格，模型只需回覆代號、名稱與理由"""
+    return PICKS_PROMPT.format(count=PICKS_COUNT, candidates=candidates, style=STYLE_RULES)
+
+
+def parse_table(candidates):
+    """候選表格 → (欄位名稱, {代號: 欄位值})，保留原本的分數順序"""
+    lines = [line for line in candidates.splitlines() if line.strip()]
+    if not lines:
+        return [], {}
+    header = lines[0].split("|")
+    rows = {}
+    for line in lines[1:]:
+        cells = line.split("|")
+        rows[cells[0]] = cells[1:]
+    return header, rows
+
+
+def render_market_summary(market_data):
+    """美股收盤摘要：沿用抓取時算好的數字，只去掉資料區塊的標題列"""
+    lines = [line for line in market_data.strip().splitlines() if line and not line.startswith("【")]
+    return "\n".join(lines) or "● 暫時無法取得美股數據"
+
+
+def render_news(text):
+    """新聞段落只保留「●」開頭的行，模型沒照格式回覆時原樣使用"""
+    bullets = [line.strip() for line in text.strip().splitlines() if line.strip().startswith("●")]
+    return "\n".join(bullets) or text.strip()
+
+
+def render_pick(code, name, reason, header, cells):
+    """單支精選個股：名稱與理由來自模型，數字一律取自候選表格"""
+    data = "｜".join(f"{label} {value}" for label, value in zip(header[1:], cells) if value != '-')
+    lines = [f"● {code} {name}".rstrip(), data]
+    if reason:
+        lines.append(f"理由：{reason}")
+    return "\n".join(line for line in lines if line)
+
+
+def parse_picks(text, rows):
+    """解析「代號|公司名稱|推薦理由」，只保留候選表格中的代號 (去除重複與模型虛構的代號)"""
+    picks = {}
+    for line in text.splitlines():
+        parts = [part.strip() for part in line.strip().lstrip("●").split("|")]
+        if len(parts) < 2:
+            continue
+        code = parts[0].split('.')[0]
+        if code in rows and code not in picks:
+            picks[code] = (parts[1], "|".join(parts[2:]))
+        if len(picks) == PICKS_COUNT:
+            break
+    return picks
+
+
+def render_picks(text, candidates):
+    """精選個股段落；text 為 None (生成失敗) 或沒有可用的代號時回傳 None"""
+    header, rows = parse_table(candidates)
+    if not rows:
+        return "● 今日無符合篩選條件的標的"
+    if text is None:
+        return None
+    picks = parse_picks(text, rows)
+    if not picks:
+        return None
+    return "\n\n".join(render_pick(code, name, reason, header, rows[code])
+                       for code, (name, reason) in picks.items())
+
+
+def fallback_section(section, candidates):
+    """生成失敗的段落：新聞改為提示文字，精選個股改列分數最高的候選 (只有數字，沒有理由)"""
+    if section.name != 'picks':
+        return "● 暫時無法取得新聞"
+    header, rows = parse_table(candidates)
+    return "\n\n".join(render_pick(code, "", "", header, cells)
+                       for code, cells in list(rows.items())[:PICKS_COUNT])
+
+
+def iter_report_parts(date, market_data, candidates, text_of):
+    """依原本的版面逐段產生報告 (串流模式下逐段推播，以空行串接即完整報告)
+
+    text_of(段落名稱) 回傳模型回覆，生成失敗時回傳 None；依版面順序呼叫，
+    摘要在任何段落完成前就能送出，之後每個段落只需等它自己的回覆
+    """
+    yield REPORT_HEADER.format(date=date.strftime('%Y/%m/%d'), market_summary=render_market_summary(market_data))
+    partial = False
+    for i, section in enumerate(SECTIONS):
+        text = text_of(section.name)
+        if section.name == 'picks':
+            body = render_picks(text, candidates)
+        else:
+            body = render_news(text) if text and text.strip() else None
+        if body is None:
+            body, partial = fallback_section(section, candidates), True
+        part = f"{section.title}\n{body}"
+        if i == len(SECTIONS) - 1:
+            part += "\n\n" + REPORT_FOOTER + ("\n\n" + PARTIAL_NOTICE if partial else "")
+        yield part
+
+
+def render_report(date, market_data, candidates, texts):
+    """完整報告文字；texts: {段落名稱: 模型回覆}，生成失敗的段落為 None 或不存在"""
+    return "\n\n".join(iter_report_parts(date, market_data, candidates, texts.get))
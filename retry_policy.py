@@ -0,0 +1,92 @@
+"""
+重試策略 - 指數退避加隨機抖動、總時間預算、伺服器 retry-after 提示
+以及可重試 / 不可重試錯誤的分類
+"""
+
+import random
+import re
+import sys
+import time
+from dataclasses import dataclass
+
+# 這些 HTTP 狀態碼代表暫時性問題，稍後重試可能成功
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# 金鑰或權限錯誤，換模型或重試都不會成功
+FATAL_STATUS_CODES = {401, 403}
+
+
+def status_code(error):
+    """取得錯誤對應的 HTTP 狀態碼 (沒有則回傳 None)"""
+    # Gemini 的錯誤只可能來自已載入的 SDK，不為了型別判斷而載入整個 google.genai
+    errors = sys.modules.get('google.genai.errors')
+    if errors is not None and isinstance(error, errors.APIError):
+        return error.code
+    response = getattr(error, 'response', None)
+    # LINE SDK 的 LineBotApiError 沒有 response，狀態碼直接放在例外上
+    return getattr(response, 'status_code', getattr(error, 'status_code', None))
+
+
+def is_retryable(error):
+    """判斷錯誤是否值得重試：暫時性的伺服器錯誤、限流與網路問題"""
+    code = status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (TimeoutError, ConnectionError)) or \
+        type(error).__name__ in ('ConnectError', 'ReadTimeout', 'ConnectTimeout', 'RemoteProtocolError',
+                                 'ConnectionError', 'Timeout')
+
+
+def is_fatal(error):
+    """判斷錯誤是否應立即放棄 (連備用模型都不必嘗試)"""
+    return status_code(error) in FATAL_STATUS_CODES
+
+
+def retry_after_seconds(error):
+    """讀取伺服器建議的等待秒數：Retry-After 標頭或 Gemini 的 RetryInfo.retryDelay"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None) or {}
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+
+    details = getattr(error, 'details', None)
+    if isinstance(details, dict):
+        for item in details.get('error', {}).get('details', []) or []:
+            delay = isinstance(item, dict) and item.get('retryDelay')
+            if delay:
+                match = re.match(r'^([\d.]+)s$', str(delay))
+                if match:
+                    return float(match.group(1))
+    return None
+
+
+@dataclass
+class RetryPolicy:
+    """重試策略設定
+
+    max_attempts: 每個模型最多嘗試次數
+    base_delay / max_delay: 指數退避的起始與上限秒數
+    deadline: 整個生成流程 (含所有模型) 的總時間預算秒數
+    """
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 20.0
+    deadline: float = 90.0
+
+    def start(self):
+        """開始計時，回傳截止時間點"""
+        return time.monotonic() + self.deadline
+
+    def remaining(self, deadline_at):
+        return max(0.0, deadline_at - time.monotonic())
+
+    def delay(self, attempt, error=None):
+        """第 attempt 次 (從 0 起算) 失敗後的等待秒數，伺服器有提示時以提示為準"""
+        hint = retry_after_seconds(error) if error is not None else None
+        if hint is not None:
+            return min(hint, self.max_delay)
+        # Full jitter：在 [0, 上限] 之間隨機，避免多個客戶端同時重試
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
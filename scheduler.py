@@ -0,0 +1,121 @@
+"""
+排程器 - 常駐模式下依台北時間觸發盤前報告、盤中檢查與收盤摘要
+工作在同一執行緒依序執行，同一工作執行太久而錯過的觸發時間直接略過
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from datetime import time as dtime
+from typing import Callable
+from zoneinfo import ZoneInfo
+
+TAIPEI = ZoneInfo('Asia/Taipei')
+# 週一至週五 (國定假日未排除，由各工作自行判斷是否有新資料)
+WEEKDAYS = (0, 1, 2, 3, 4)
+# 單次等待上限秒數，讓系統休眠或時鐘調整後能重新計算下一次觸發時間
+MAX_SLEEP_SECONDS = 60
+
+
+def parse_time(text):
+    """'HH:MM' 轉成 datetime.time"""
+    hour, minute = (int(part) for part in text.split(':'))
+    return dtime(hour, minute)
+
+
+@dataclass
+class Job:
+    """排程工作
+
+    at: 每日固定觸發時間 ('HH:MM')
+    every / between: 在 between 時段內每 every 分鐘觸發一次 (含起訖時間)
+    """
+    name: str
+    func: Callable[[], object]
+    at: tuple = ()
+    every: int = 0
+    between: tuple = ('09:00', '13:30')
+    weekdays: tuple = WEEKDAYS
+
+    def times(self):
+        """每日的觸發時間 (由早到晚)"""
+        times = {parse_time(text) for text in self.at}
+        if self.every > 0:
+            start, end = (parse_time(text) for text in self.between)
+            minute, last = start.hour * 60 + start.minute, end.hour * 60 + end.minute
+            while minute <= last:
+                times.add(dtime(minute // 60, minute % 60))
+                minute += self.every
+        return sorted(times)
+
+    def next_run(self, now):
+        """now 之後的下一次觸發時間 (now 需帶時區)，沒有則回傳 None"""
+        times = self.times()
+        for offset in range(8):
+            day = now.date() + timedelta(days=offset)
+            if day.weekday() not in self.weekdays:
+                continue
+            for at in times:
+                candidate = datetime.combine(day, at, tzinfo=now.tzinfo)
+                if candidate > now:
+                    return candidate
+        return None
+
+
+class Scheduler:
+    """依序執行到期的工作，stop() 可從其他執行緒 (或訊號處理) 結束迴圈"""
+
+    def __init__(self, jobs, tz=TAIPEI):
+        self.jobs = list(jobs)
+        self.tz = tz
+        self._stop = threading.Event()
+        self._pending = {}
+
+    def now(self):
+        return datetime.now(self.tz)
+
+    def next_due(self, now=None):
+        """回傳 (觸發時間, 工作)，沒有任何工作時回傳 (None, None)
+
+        每個工作各自記住下一次觸發時間，所以同一時間到期的多個工作都會執行
+        """
+        now = now or self.now()
+        upcoming = []
+        for i, job in enumerate(self.jobs):
+            if i not in self._pending:
+                self._pending[i] = job.next_run(now)
+            if self._pending[i] is not None:
+                upcoming.append((self._pending[i], i))
+        if not upcoming:
+            return None, None
+        when, i = min(upcoming)
+        return when, self.jobs[i]
+
+    def run_job(self, job, scheduled_at=None):
+        """執行單一工作，例外只記錄不中斷排程"""
+        if scheduled_at is not None:
+            lag = (self.now() - scheduled_at).total_seconds() * 1000
+            print(f"⏰ 觸發 {job.name} (排定 {scheduled_at:%H:%M}, 延遲 {lag:.0f} 毫秒)")
+        start = time.perf_counter()
+        try:
+            job.func()
+        except Exception as e:
+            print(f"❌ 排程工作 {job.name} 失敗: {e}")
+        print(f"   ⏱️  {job.name} 耗時 {time.perf_counter() - start:.2f} 秒")
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            when, job = self.next_due()
+            if job is None:
+                return
+            wait = (when - self.now()).total_seconds()
+            if wait > 0:
+                self._stop.wait(min(wait, MAX_SLEEP_SECONDS))
+                continue
+            self.run_job(job, when)
+            # 從執行結束的時間點往後找，略過執行期間錯過的觸發時間
+            self._pending[self.jobs.index(job)] = job.next_run(self.now())
+
+    def stop(self):
+        self._stop.set()
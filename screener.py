@@ -0,0 +1,178 @@
+"""
+向量化篩選引擎 - 一次處理整個下載結果，不再逐支標的迴圈
+篩選條件以 Rule 宣告，可自由組合；每支被剔除或缺資料的標的都附上原因
+"""
+
+import warnings
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class Rule:
+    """單一篩選條件：指標欄位需落在 [low, high] 區間 (strict=True 時不含端點)"""
+    name: str
+    column: str
+    low: float = None
+    high: float = None
+    strict: bool = False
+
+    def mask(self, metrics):
+        values = metrics[self.column]
+        passed = pd.Series(True, index=metrics.index)
+        if self.low is not None:
+            passed &= values > self.low if self.strict else values >= self.low
+        if self.high is not None:
+            passed &= values < self.high if self.strict else values <= self.high
+        return passed
+
+
+def price_between(low, high):
+    return Rule('價格區間', 'close', low, high)
+
+
+def min_avg_volume(shares):
+    return Rule('日均量', 'avg_volume', low=shares, strict=True)
+
+
+def change_pct_between(low=None, high=None):
+    return Rule('漲跌幅', 'change_pct', low, high)
+
+
+def gap_pct_between(low=None, high=None):
+    return Rule('跳空幅度', 'gap_pct', low, high)
+
+
+def rsi_between(low=None, high=None):
+    return Rule('RSI', 'rsi14', low, high)
+
+
+def min_volume_surge(ratio):
+    return Rule('量比', 'volume_surge', low=ratio)
+
+
+def above_ma20():
+    return Rule('站上月線', 'trend_pct', low=0)
+
+
+# 預設條件：價格 20-50 元，且日均量 > 3000 張
+DEFAULT_RULES = (price_between(20, 50), min_avg_volume(3_000_000))
+
+METRIC_COLUMNS = ['close', 'prev_close', 'open', 'avg_volume', 'change_pct', 'gap_pct']
+
+
+def field_matrices(data, tickers, fields=('Open', 'Close', 'Volume')):
+    """從 yf.download(group_by='ticker') 的結果一次取出各欄位的 (日期 × 標的) 陣列
+
+    先把整張表轉成單一 numpy 陣列再依欄位索引切片，避免對 MultiIndex 逐欄操作
+    """
+    n_days = 0 if data is None else len(data)
+    matrices = {field: np.full((n_days, len(tickers)), np.nan) for field in fields}
+    if not n_days or not isinstance(data.columns, pd.MultiIndex):
+        return matrices
+
+    values = data.to_numpy(dtype='float64', na_value=np.nan)
+    names = data.columns.get_level_values(0)
+    columns = data.columns.get_level_values(1)
+    for field in fields:
+        positions = np.flatnonzero(columns == field)
+        lookup = pd.Index(names[positions]).get_indexer(tickers)
+        found = lookup >= 0
+        matrices[field][:, found] = values[:, positions[lookup[found]]]
+    return matrices
+
+
+def compute_metrics(data, tickers):
+    """以欄位化運算一次算出所有標的的收盤價、均量、漲跌幅與跳空幅度"""
+    m = field_matrices(data, tickers)
+    close, volume, opens = m['Close'], m['Volume'], m['Open']
+    n_days = close.shape[0]
+    nan_row = np.full(len(tickers), np.nan)
+
+    last_close = close[-1] if n_days else nan_row
+    prev_close = close[-2] if n_days > 1 else nan_row
+    last_open = opens[-1] if n_days else nan_row
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # 整欄缺資料時 nanmean 會警告
+        avg_volume = np.nanmean(volume, axis=0) if n_days else nan_row  # 期間均量
+        change_pct = (last_close / prev_close - 1) * 100
+        gap_pct = (last_open / prev_close - 1) * 100
+
+    return pd.DataFrame({
+        'close': last_close,
+        'prev_close': prev_close,
+        'open': last_open,
+        'avg_volume': avg_volume,
+        'change_pct': change_pct,
+        'gap_pct': gap_pct,
+    }, index=pd.Index(tickers, name='ticker'), columns=METRIC_COLUMNS)
+
+
+def signal_score(result):
+    """排序用的綜合分數：量比越高、越站穩月線者越前面，RSI 過熱 (> 70) 者減半"""
+    surge = result['volume_surge'].fillna(1.0).clip(upper=5.0)
+    trend = result['trend_pct'].fillna(0.0).clip(-10.0, 10.0) / 10
+    overheat = np.where(result['rsi14'] > 70, 0.5, 1.0)
+    return (surge + trend) * overheat
+
+
+def screen(data, tickers, rules=DEFAULT_RULES, indicators=None):
+    """套用篩選條件，回傳每支標的的指標、是否入選與剔除原因
+
+    indicators: 以標的為索引的技術指標表 (indicators.IndicatorState.values)，
+    提供時條件可以引用其欄位，並依 signal_score 產生排序分數
+    """
+    result = compute_metrics(data, tickers)
+    if indicators is not None:
+        result = result.join(indicators.reindex(result.index))
+        result['trend_pct'] = (result['close'] / result['ma20'] - 1) * 100
+        result['score'] = signal_score(result)
+    return apply_rules(result, rules)
+
+
+def apply_rules(result, rules=DEFAULT_RULES):
+    """在已算好的指標表上套用條件，回傳附上 qualified / reason 欄位的新表
+
+    同一份指標可以用不同條件重複篩選 (例如各訂閱者自訂的門檻)，不必重新計算
+    """
+    result = result.drop(columns=['qualified', 'reason'], errors='ignore')
+    qualified = ~np.isnan(result['close'].to_numpy(dtype='float64'))
+    reason = np.where(qualified, '', '缺少資料').astype(object)
+
+    for rule in rules:
+        failed = qualified & ~rule.mask(result).to_numpy(dtype=bool)
+        reason[failed] = rule.name
+        qualified &= ~failed
+
+    result['qualified'] = qualified
+    result['reason'] = reason
+    return result
+
+
+def format_candidates(result, limit=None):
+    """將入選標的轉成 Prompt 使用的候選表格 (第一列為欄位名稱，之後每列一支，依排序分數由高到低)
+
+    以 | 分隔、不重複欄位名稱，比逐支寫成「代號(價:..,量:..)」省下約一半的 Token；
+    limit=None 時列出全部入選標的，實際放入 Prompt 的列數由 Token 預算決定
+    """
+    picked = result[result['qualified']]
+    if 'score' in picked:
+        picked = picked.sort_values('score', ascending=False, kind='stable')
+    if limit is not None:
+        picked = picked.head(limit)
+    if picked.empty:
+        return ""
+    columns = [('代號', None), ('收盤', 'close'), ('均量(張)', 'avg_volume')]
+    columns += [(label, name) for label, name in (('RSI', 'rsi14'), ('量比', 'volume_surge')) if name in picked]
+    formats = {'close': '{:.1f}', 'avg_volume': '{:.0f}', 'rsi14': '{:.0f}', 'volume_surge': '{:.1f}'}
+    values = {name: picked[name].to_numpy(dtype='float64') / (1000 if name == 'avg_volume' else 1)
+              for _, name in columns if name}
+    lines = ["|".join(label for label, _ in columns)]
+    for i, ticker in enumerate(picked.index):
+        cells = [ticker.split('.')[0]]
+        cells += ['-' if np.isnan(values[name][i]) else formats[name].format(values[name][i])
+                  for _, name in columns if name]
+        lines.append("|".join(cells))
+    return "\n".join(lines)
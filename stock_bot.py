@@ -1,288 +1,1196 @@
 import os
+import json
+import signal
+import sys
 import time
-import pandas as pd
-import yfinance as yf
-import requests
-from google import genai
-from google.genai import types
-from google.genai.errors import ServerError
-from linebot import LineBotApi
-from linebot.models import TextSendMessage
+import argparse
+import hashlib
+import uuid
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+# pandas、yfinance、google-genai、linebot、requests 合計載入約 2 秒，一律在用到的函式中才載入：
+# 只推播或重送快取報告的子命令不必付出抓資料與生成報告的載入成本
+from cache_paths import CACHE_DIR
+from chunker import pack_discord_payloads, pack_line_messages
+import metrics
+from prompt_builder import PROMPT_TOKEN_BUDGET, PromptCache, count_tokens, pack_prompt, split_table
+from report_cache import get_cached_report, latest_cached_report, put_cached_report, report_key
+from report_sections import PARTIAL_NOTICE, SECTIONS, iter_report_parts, news_prompt, picks_prompt, render_report
+from retry_policy import RetryPolicy, is_fatal, is_retryable
+from scheduler import Job, Scheduler
 
 # 1. 從環境變數讀取金鑰
 DISCORD_WEBHOOK_URL = os.environ.get('DISCORD_WEBHOOK_URL')
 LINE_ACCESS_TOKEN = os.environ.get('LINE_ACCESS_TOKEN')
 LINE_USER_ID = os.environ.get('LINE_USER_ID')
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+# LINE API 位址 (離線測試時可指向本機模擬伺服器)
+LINE_API_ENDPOINT = os.environ.get('LINE_API_ENDPOINT', 'https://api.line.me')
 
-def get_taiwan_stock_pool():
-    """獲取台股池 - 使用多重備用方案"""
-    print("🔍 正在獲取台股清單...")
+# 股票池快照：成分股每季才調整，快照未過期就不必重新抓取 MoneyDJ
+UNIVERSE_SNAPSHOT_PATH = os.path.join(CACHE_DIR, 'universe.json')
+UNIVERSE_SNAPSHOT_VERSION = 1
+UNIVERSE_TTL_HOURS = float(os.environ.get('UNIVERSE_TTL_HOURS', 24 * 7))
 
-    # 方案 1: 嘗試從 MoneyDJ 獲取 0050 成分股
+# 股票池來源：0050 (MoneyDJ 0050 成分股加熱門股，約 60 支) 或 listing (上市櫃全市場，約 1,800 支)
+UNIVERSE_SOURCE = os.environ.get('UNIVERSE_SOURCE', '0050')
+# 全市場模式下的市場與產業篩選 (逗號分隔，產業可用名稱或代碼；空白代表不限)，在下載價格前套用
+UNIVERSE_MARKETS = [m.strip() for m in os.environ.get('UNIVERSE_MARKETS', 'TWSE,TPEx').split(',') if m.strip()]
+UNIVERSE_INDUSTRIES = [i.strip() for i in os.environ.get('UNIVERSE_INDUSTRIES', '').split(',') if i.strip()] or None
+UNIVERSE_EXCLUDE_INDUSTRIES = [i.strip() for i in os.environ.get('UNIVERSE_EXCLUDE_INDUSTRIES',
+                                                                 '管理股票,存託憑證').split(',') if i.strip()]
+
+# 台股市值前 50 大熱門股票（手動維護清單，較穩定）
+POPULAR_TW_STOCKS = [
+    "2330", "2317", "2454", "2882", "6505", "2412", "2303", "3711", "2881", "2892",
+    "2891", "2002", "1303", "2408", "2886", "2395", "3008", "2409", "2912", "2885",
+    "2357", "2474", "2801", "2880", "2883", "2887", "3045", "2301", "2308", "2382",
+    "2888", "2890", "6669", "2327", "2379", "2324", "2344", "2201", "2207", "3231",
+    "1216", "6415", "6239", "2609", "1101", "1102", "2105", "2498", "8046"
+]
+
+# 備用的基本台股清單（ETF 成分股近似），只在完全沒有快照時使用
+BACKUP_TW_STOCKS = POPULAR_TW_STOCKS + [
+    "2823", "2615", "6446", "3034", "2618", "2610", "1301", "2049", "2020"
+]
+
+def load_universe_snapshot(path=UNIVERSE_SNAPSHOT_PATH):
+    """讀取上次成功解析的股票池快照，格式不符時視為不存在"""
     try:
-        print("   嘗試從 MoneyDJ 獲取 0050 成分股...")
-        url_0050 = "https://www.moneydj.com/ETF/X/Basic/Basic0007.xdjhtm?etfid=0050.TW"
-        tables = pd.read_html(url_0050, encoding='utf-8')
-        # 找到包含股票代號的表格
-        for table in tables:
-            if '代號' in str(table.columns) or '股票代號' in str(table.columns):
-                df_0050 = table
-                break
-        else:
-            df_0050 = tables[0]  # 如果找不到，使用第一個表格
+        with open(path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('version') != UNIVERSE_SNAPSHOT_VERSION or not snapshot.get('tickers'):
+        return None
+    return snapshot
 
-        # 提取股票代號
-        code_column = None
-        for col in df_0050.columns:
-            if '代號' in str(col) or 'code' in str(col).lower():
-                code_column = col
-                break
+def save_universe_snapshot(tickers, source, path=UNIVERSE_SNAPSHOT_PATH):
+    """儲存股票池快照 (先寫暫存檔再替換，避免寫到一半留下壞檔)"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    snapshot = {
+        'version': UNIVERSE_SNAPSHOT_VERSION,
+        'fetched_at': time.time(),
+        'source': source,
+        'tickers': tickers,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return snapshot
 
-        if code_column is not None:
-            codes_0050 = df_0050[code_column].dropna().astype(str).tolist()
-            print(f"   ✅ 從 MoneyDJ 獲取到 {len(codes_0050)} 支 0050 成分股")
-        else:
-            raise Exception("找不到股票代號欄位")
+def fetch_0050_codes():
+    """從 MoneyDJ 抓取 0050 成分股代號"""
+    import pandas as pd
+
+    url_0050 = "https://www.moneydj.com/ETF/X/Basic/Basic0007.xdjhtm?etfid=0050.TW"
+    tables = pd.read_html(url_0050, encoding='utf-8')
+    # 找到包含股票代號的表格
+    for table in tables:
+        if '代號' in str(table.columns) or '股票代號' in str(table.columns):
+            df_0050 = table
+            break
+    else:
+        df_0050 = tables[0]  # 如果找不到，使用第一個表格
+
+    # 提取股票代號
+    code_column = None
+    for col in df_0050.columns:
+        if '代號' in str(col) or 'code' in str(col).lower():
+            code_column = col
+            break
+
+    if code_column is None:
+        raise Exception("找不到股票代號欄位")
 
+    codes_0050 = df_0050[code_column].dropna().astype(str).tolist()
+    # 清理 0050 代碼格式
+    return [str(code).strip().replace('.TW', '') for code in codes_0050 if str(code).strip().isdigit()]
+
+def build_ticker_pool(codes):
+    """去重並排序，確保每次產生的股票池順序一致"""
+    return [f"{code}.TW" for code in sorted(set(codes)) if code.isdigit()]
+
+# 已讀入記憶體的股票池快照 (常駐模式下不必每次重讀檔案)
+_universe_snapshot = None
+
+def get_taiwan_stock_pool(ttl_hours=UNIVERSE_TTL_HOURS):
+    """獲取台股池 - 優先使用未過期快照，過期才重新抓取，失敗時沿用上次快照"""
+    global _universe_snapshot
+    print("🔍 正在獲取台股清單...")
+
+    if UNIVERSE_SOURCE == 'listing':
+        try:
+            from universe import full_market_pool
+
+            ticker_pool = full_market_pool(UNIVERSE_MARKETS, UNIVERSE_INDUSTRIES, UNIVERSE_EXCLUDE_INDUSTRIES)
+            if not ticker_pool:
+                raise ValueError("篩選後沒有任何標的")
+            print(f"   📇 上市櫃全市場索引: {len(ticker_pool)} 支標的 (市場 {','.join(UNIVERSE_MARKETS)})")
+            return ticker_pool
+        except Exception as e:
+            print(f"   ❌ 全市場名單無法使用，改用 0050 成分股: {e}")
+
+    snapshot = _universe_snapshot = _universe_snapshot or load_universe_snapshot()
+    if snapshot:
+        age_hours = (time.time() - snapshot['fetched_at']) / 3600
+        if age_hours < ttl_hours:
+            ticker_pool = snapshot['tickers']
+            print(f"   💾 使用股票池快照 ({age_hours:.1f} 小時前, 來源: {snapshot['source']})")
+            print(f"   📊 最終股票池: {len(ticker_pool)} 支標的")
+            return ticker_pool
+
+    # 方案 1: 嘗試從 MoneyDJ 獲取 0050 成分股
+    try:
+        print("   嘗試從 MoneyDJ 獲取 0050 成分股...")
+        codes_0050 = fetch_0050_codes()
+        if not codes_0050:
+            raise Exception("0050 成分股清單為空")
+        print(f"   ✅ 從 MoneyDJ 獲取到 {len(codes_0050)} 支 0050 成分股")
     except Exception as e:
         print(f"   ❌ MoneyDJ 方案失敗: {e}")
         codes_0050 = []
 
-    # 方案 2: 嘗試從 Yahoo Finance 獲取台股資訊
-    try:
-        print("   嘗試從 Yahoo Finance 獲取熱門台股...")
-        # 台股市值前 50 大熱門股票（手動維護清單，較穩定）
-        popular_tw_stocks = [
-            "2330", "2317", "2454", "2882", "6505", "2412", "2303", "3711", "2881", "2892",
-            "2891", "2002", "1303", "2408", "2886", "2395", "3008", "2409", "2002", "2912",
-            "2885", "2357", "2474", "2801", "2880", "2883", "2887", "3045", "2301", "2308",
-            "2382", "2888", "2890", "6669", "2327", "2379", "2324", "2344", "2201", "2207",
-            "3231", "1216", "6415", "6239", "2609", "1101", "1102", "2105", "2498", "8046"
-        ]
-        codes_yahoo = popular_tw_stocks
-        print(f"   ✅ 使用熱門台股清單 {len(codes_yahoo)} 支")
-    except Exception as e:
-        print(f"   ❌ Yahoo Finance 方案失敗: {e}")
-        codes_yahoo = []
-
-    # 方案 3: 備用的基本台股清單（ETF 成分股近似）
-    backup_stocks = [
-        "2330", "2317", "2454", "2882", "6505", "2412", "2303", "3711", "2881", "2892",
-        "2891", "2002", "1303", "2408", "2886", "2395", "3008", "2409", "2912", "2885",
-        "2357", "2474", "2801", "2880", "2883", "2887", "3045", "2301", "2308", "2382",
-        "2888", "2890", "6669", "2327", "2379", "2324", "2344", "2201", "2207", "3231",
-        "1216", "6415", "6239", "2609", "1101", "1102", "2105", "2498", "8046", "2823",
-        "2207", "2615", "6446", "3034", "2618", "2610", "1301", "2002", "2049", "2020"
-    ]
-
-    # 合併所有獲取的股票代號
-    all_codes = []
     if codes_0050:
-        # 清理 0050 代碼格式
-        clean_codes_0050 = [str(code).strip().replace('.TW', '') for code in codes_0050 if str(code).strip().isdigit()]
-        all_codes.extend(clean_codes_0050)
-
-    if codes_yahoo:
-        all_codes.extend(codes_yahoo)
-
-    # 如果前面的方案都失敗，使用備用清單
-    if not all_codes:
+        # 方案 2: 合併熱門台股清單後存成新快照
+        ticker_pool = build_ticker_pool(codes_0050 + POPULAR_TW_STOCKS)
+        _universe_snapshot = save_universe_snapshot(ticker_pool, source='moneydj')
+    elif snapshot:
+        # 抓取失敗時沿用上次成功的快照
+        print("   ⚠️  沿用上次成功的股票池快照")
+        ticker_pool = snapshot['tickers']
+    else:
+        # 方案 3: 完全沒有快照時才使用備用清單 (不寫入快照，下次仍會重試)
         print("   ⚠️  使用備用台股清單")
-        all_codes = backup_stocks
-
-    # 去重並格式化
-    unique_codes = list(set(all_codes))
-    ticker_pool = [f"{code}.TW" for code in unique_codes if code.isdigit()]
+        ticker_pool = build_ticker_pool(BACKUP_TW_STOCKS)
 
     print(f"   📊 最終股票池: {len(ticker_pool)} 支標的")
     print(f"   範例: {ticker_pool[:5]}")
 
     return ticker_pool
 
+# 執行指標報告輸出位置 (Prometheus textfile 可選)
+RUN_REPORT_PATH = os.environ.get('RUN_REPORT_PATH', os.path.join(CACHE_DIR, 'run_report.json'))
+METRICS_TEXTFILE = os.environ.get('METRICS_TEXTFILE')
+
+# 每次更新技術指標後以完整重算驗證增量狀態，不一致的標的會重建 (除錯用，較慢)
+INDICATOR_VERIFY = os.getenv('INDICATOR_VERIFY', '').lower() in ('1', 'true', 'yes')
+
+# 台股篩選條件 (None 為 screener.DEFAULT_RULES)，可加入技術指標條件，例如 rsi_between(None, 80) 或 min_volume_surge(1.5)
+SCREEN_RULES = None
+
+# 資料抓取階段中各來源的逾時秒數
+FETCH_TIMEOUTS = {'indices': 30, 'universe': 60, 'taiwan': 120}
+
+def timed(name, func, *args, **kwargs):
+    """在指定名稱的計時區塊內執行函式"""
+    with metrics.span(name):
+        return func(*args, **kwargs)
+
+def run_fetch_stage(sources, timeouts=FETCH_TIMEOUTS):
+    """同時執行互不相依的資料來源，總耗時取決於最慢的單一來源而非全部加總
+
+    sources: {名稱: 無參數函式}；逾時或失敗的來源結果為 None
+    """
+    stage_start = time.perf_counter()
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=len(sources))
+    futures = {name: executor.submit(timed, f"fetch.{name}", func) for name, func in sources.items()}
+    for name, future in futures.items():
+        remaining = stage_start + timeouts.get(name, 60) - time.perf_counter()
+        try:
+            results[name] = future.result(timeout=max(remaining, 0))
+            print(f"   ⏱️  {name} 完成 ({time.perf_counter() - stage_start:.2f} 秒)")
+        except FuturesTimeoutError:
+            print(f"   ❌ {name} 逾時 ({timeouts.get(name, 60)} 秒)")
+            results[name] = None
+        except Exception as e:
+            print(f"   ❌ {name} 失敗: {e}")
+            results[name] = None
+    # 逾時的工作無法中斷，不等待它們結束
+    executor.shutdown(wait=False, cancel_futures=True)
+    print(f"   ⏱️  資料抓取階段共 {time.perf_counter() - stage_start:.2f} 秒")
+    return results
+
+# 美股指數與 VOO (代號: 顯示名稱)
+US_INDICES = {"^DJI": "道瓊", "^GSPC": "標普500", "VOO": "VOO"}
+
+def fetch_us_indices(offline=False):
+    """美股指數與 VOO：三個代號合併成一次批次下載 (offline=True 時只讀取快取)"""
+    from price_cache import get_prices
+
+    market_summary = "【美股收盤與 VOO】\n"
+    # 取最近 5 天數據以確保能計算最新一天的漲跌幅（考慮週末），歷史資料由本地快取提供
+    index_data = get_prices(list(US_INDICES), offline=offline)
+    for symbol, name in US_INDICES.items():
+        if symbol not in index_data.columns.get_level_values(0):
+            continue
+        hist = index_data[symbol].dropna(subset=['Close'])
+        if len(hist) < 2: continue
+
+        last_close = hist['Close'].iloc[-1]
+        prev_close = hist['Close'].iloc[-2]
+        change_pct = ((last_close - prev_close) / prev_close) * 100
+        market_summary += f"● {name}: {last_close:.2f} ({change_pct:+.2f}%)\n"
+    return market_summary
+
+_indicator_state = None
+
+def get_indicator_state():
+    """技術指標的滾動狀態只載入一次，常駐模式下一直保留在記憶體"""
+    global _indicator_state
+    if _indicator_state is None:
+        from indicators import IndicatorState
+        _indicator_state = IndicatorState.load()
+    return _indicator_state
+
+def fetch_and_screen_taiwan(refresh=False, extra_tickers=(), universe=None, offline=False):
+    """獲取台股池後分批下載，每完成一批就更新技術指標並立刻篩選 (只補抓快取中缺少的日期)
+
+    refresh=True 時連今天已存在的 K 棒也重抓 (盤中檢查用，取得最新價量)
+    extra_tickers: 股票池以外也要一起處理的標的 (訂閱者的觀察清單)，結果以 in_universe 欄位區分
+    universe: 已取得的股票池 (省略時呼叫 get_taiwan_stock_pool)；offline=True 時不下載，只用快取篩選
+    """
+    import pandas as pd
+    import price_cache
+    from indicators import update_from_cache, verify
+    from screener import DEFAULT_RULES, screen
+
+    rules = DEFAULT_RULES if SCREEN_RULES is None else SCREEN_RULES
+    universe = universe if universe is not None else get_taiwan_stock_pool()
+    known = set(universe)
+    ticker_pool = universe + [ticker for ticker in dict.fromkeys(extra_tickers) if ticker not in known]
+    print(f"🔍 正在下載並過濾 {len(ticker_pool)} 支標的...")
+    start_time = time.perf_counter()
+    stats = {}
+    # 技術指標的滾動狀態：每批只把新的 K 棒併入，不重算整段歷史 (盤中未收盤的 K 棒不併入)
+    state = get_indicator_state()
+    conn = price_cache.connect()
+    try:
+        results = []
+        for chunk, data in price_cache.iter_prices(ticker_pool, days=5, stats=stats, refresh=refresh,
+                                                   offline=offline):
+            indicators = update_from_cache(state, conn, chunk, until=trading_date())
+            if INDICATOR_VERIFY:
+                mismatched = verify(state, conn, chunk)
+                metrics.incr('indicator_mismatches', len(mismatched))
+                if mismatched:
+                    print(f"   ⚠️ 技術指標狀態與完整重算不一致 {len(mismatched)} 支，重建中")
+                    state.reset(mismatched)
+                    indicators = update_from_cache(state, conn, chunk, until=trading_date())
+            # 篩選：價格 20-50 元，且日均量 > 3000 張 (每批整個資料表一次運算)
+            results.append(screen(data, chunk, rules=rules, indicators=indicators))
+    finally:
+        conn.close()
+    state.save()
+    price_cache.report_stats(stats, len(ticker_pool), time.perf_counter() - start_time)
+    result = pd.concat(results).reindex(ticker_pool)
+    result['in_universe'] = result.index.isin(universe)
+
+    missing = int((result['reason'] == '缺少資料').sum())
+    metrics.incr('tickers_fetched', len(ticker_pool) - missing)
+    metrics.incr('tickers_missing', missing)
+    metrics.incr('tickers_qualified', int(result['qualified'].sum()))
+    metrics.incr('download_requests', stats.get('requests', 0))
+    metrics.incr('retries', stats.get('retries', 0))
+    metrics.incr('bytes_downloaded', stats.get('bytes', 0))
+    return result
+
+def collect_market_data(extra_tickers=(), universe=None, offline=False):
+    """抓取美股指數並篩選台股，回傳 (市場摘要, 完整篩選結果)；台股失敗時結果為 None"""
+    # --- Spec 1 & 4: 美股指數與台股池彼此獨立，同時抓取 ---
+    fetched = run_fetch_stage({
+        'indices': lambda: fetch_us_indices(offline=offline),
+        'taiwan': lambda: fetch_and_screen_taiwan(extra_tickers=extra_tickers, universe=universe, offline=offline),
+    })
+
+    market_summary = fetched['indices'] or "【美股收盤與 VOO】\n● 暫時無法取得美股數據\n"
+    result = fetched['taiwan']
+    if result is not None:
+        rejected = result[~result['qualified']]
+        print(f"   ✅ 符合條件 {int(result['qualified'].sum())} 支, "
+              f"剔除 {len(rejected)} 支 (缺資料 {int((rejected['reason'] == '缺少資料').sum())} 支)")
+    return market_summary, result
+
+def fetch_universe_and_indices():
+    """早報的股票池階段：股票池與美股指數彼此獨立，同時抓取；指數寫入價格快取，篩選階段再離線讀取"""
+    fetched = run_fetch_stage({'universe': get_taiwan_stock_pool, 'indices': fetch_us_indices})
+    if fetched['universe'] is None:
+        raise RuntimeError("無法取得台股股票池")
+    return fetched['universe']
+
+def fetch_prices(tickers, refresh=False, include_indices=True):
+    """只更新價格快取：指定標的 (預設加上美股指數) 不篩選也不生成報告，回傳下載統計"""
+    from price_cache import iter_prices, report_stats
+
+    tickers = list(dict.fromkeys(list(tickers) + (list(US_INDICES) if include_indices else [])))
+    print(f"📥 正在更新 {len(tickers)} 支標的的價格快取...")
+    stats = {}
+    start_time = time.perf_counter()
+    for _ in iter_prices(tickers, days=1, stats=stats, refresh=refresh):
+        pass
+    report_stats(stats, len(tickers), time.perf_counter() - start_time)
+    metrics.incr('download_requests', stats.get('requests', 0))
+    metrics.incr('retries', stats.get('retries', 0))
+    metrics.incr('bytes_downloaded', stats.get('bytes', 0))
+    return {'tickers': len(tickers), 'requests': stats.get('requests', 0),
+            'failed': len(stats.get('failed', []))}
+
 def get_market_data():
     """獲取指數數據與台股潛力篩選名單"""
+    from screener import format_candidates
+
     print("📊 正在收集市場數據...")
     try:
-        # --- Spec 1: 美股指數與 VOO ---
-        indices = {"^DJI": "道瓊", "^GSPC": "標普500", "VOO": "VOO"}
-        market_summary = "【美股收盤與 VOO】\n"
-        for symbol, name in indices.items():
-            tk = yf.Ticker(symbol)
-            # 抓取 5 天數據以確保能計算最新一天的漲跌幅（考慮週末）
-            hist = tk.history(period="5d")
-            if len(hist) < 2: continue
-            
-            last_close = hist['Close'].iloc[-1]
-            prev_close = hist['Close'].iloc[-2]
-            change_pct = ((last_close - prev_close) / prev_close) * 100
-            market_summary += f"● {name}: {last_close:.2f} ({change_pct:+.2f}%)\n"
-
-        # --- Spec 4: 獲取台股池並過濾 (使用多重備用方案) ---
-        ticker_pool = get_taiwan_stock_pool()
-
-        # 批次下載數據加速篩選
-        print(f"🔍 正在過濾 {len(ticker_pool)} 支標的...")
-        data = yf.download(ticker_pool, period="5d", group_by='ticker', progress=False)
-        
-        qualified_stocks = []
-        for ticker in ticker_pool:
-            try:
-                hist = data[ticker]
-                price = hist['Close'].iloc[-1]
-                avg_vol = hist['Volume'].mean() # 5日均量
-                # 篩選：價格 20-50 元，且日均量 > 3000 張
-                if 20 <= price <= 50 and avg_vol > 3000000:
-                    qualified_stocks.append(f"{ticker}(價:{price:.1f},量:{int(avg_vol/1000)}K)")
-            except: continue
-        
-        qualified_str = ", ".join(qualified_stocks[:15]) # 限制長度避免 Prompt 過載
+        market_summary, result = collect_market_data()
+        if result is None:
+            return market_summary, ""
+
+        # 列出全部入選標的，放入 Prompt 的數量由 Token 預算決定
+        qualified_str = format_candidates(result)
         return market_summary, qualified_str
     
     except Exception as e:
         print(f"數據獲取錯誤: {e}")
         return "無法獲取市場數據", ""
 
-def generate_report_with_retry(client, market_data, qualified_stocks, max_retries=3):
-    """使用重試機制生成報告 (整合新聞與選股邏輯)"""
-    prompt = f"""
-    請以專業分析師身份，根據以下數據並使用 Google Search 撰寫投資早報：
+# Gemini 模型設定
+REPORT_MODEL = "gemini-2.0-flash-exp"
+# 依序嘗試的模型：(模型名稱, 是否使用 Google Search)；主模型過載時改用較快且不連網的模型
+REPORT_MODELS = [(REPORT_MODEL, True)] + [
+    (name.strip(), False)
+    for name in os.environ.get('GEMINI_FALLBACK_MODELS', 'gemini-2.0-flash-lite').split(',') if name.strip()
+]
+# 報告生成的重試策略與總時間預算 (秒)；各段落同時生成，共用同一個時間預算
+DEFAULT_RETRY_POLICY = RetryPolicy(max_attempts=2, deadline=float(os.environ.get('REPORT_DEADLINE_SECONDS', 90)))
+# Prompt 模板版本：修改 report_sections 的模板或版面時請遞增，讓舊的快取報告失效
+PROMPT_VERSION = 3
+# 串流模式：摘要立即推播，之後每完成一個段落就推播，第一則訊息不必等任何一次 Gemini 呼叫
+STREAM_REPORT = os.environ.get('STREAM_REPORT', '').lower() in ('1', 'true', 'yes')
+
+# 備用報告列出的候選數 (候選表格可能包含全部入選標的)
+FALLBACK_CANDIDATES = 15
 
-    1. 今日市場數據：
-    {market_data}
+def fallback_report(market_data, qualified_stocks):
+    """AI 無法使用時的基本報告"""
+    header, rows = split_table(qualified_stocks)
+    qualified_stocks = "\n".join([header] + rows[:FALLBACK_CANDIDATES]) if rows else qualified_stocks
+    return f"""🌅 投資早報 - 今日摘要
 
-    2. 台股潛力候選清單 (20-50元 & 高流動性)：
-    {qualified_stocks}
+📊 市場數據
+{market_data}
 
-    請執行以下任務並按照指定格式輸出：
+🎯 潛力股候選
+{qualified_stocks}
 
-    🌅 投資早報 - [今日日期]
+⚠️ 系統提醒
+AI 新聞分析功能暫時無法使用，僅提供基本市場數據。
 
-    📈 美股收盤摘要
-    {market_data}
+📱 完整分析將在系統恢復後提供。"""
 
-    📰 1. 美股新聞重點
-    摘要今日美股 3 個關鍵新聞，每則新聞用「●」開頭，一行一則。
+def report_config(grounded=True, timeout=None):
+    """生成設定：grounded 決定是否使用 Google Search，timeout 為單次請求秒數上限"""
+    from google.genai import types
 
-    📰 2. 台股新聞重點
-    摘要今日台股 3 個重要產業新聞，每則新聞用「●」開頭，一行一則。
+    return types.GenerateContentConfig(
+        tools=[types.Tool(google_search=types.GoogleSearch())] if grounded else None,
+        temperature=0.7,
+        http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None
+    )
 
-    🎯 3. 精選潛力股 (5支)
-    從候選清單中精選 5 支股票，格式如下：
-    ● [股票代號] [公司名稱]
-    理由：[結合新聞的推薦理由，限50字內]
+_prompt_cache = PromptCache()
 
-    ⚠️ 投資提醒
-    本報告僅供參考，投資有風險請謹慎評估。
+def report_prompts(client, market_data, qualified_stocks):
+    """各段落的 Prompt {段落名稱: Prompt}，沒有候選標的時不請求精選個股
 
-    注意事項：
-    - 不要使用任何 Markdown 語法 (如 **、##、[]() 等)
-    - 使用 Emoji 和數字編號來美化排版
-    - 每個段落間空一行提升可讀性
-    - 內容簡潔適合手機 LINE 閱讀
-    - 使用繁體中文
+    精選個股在 PROMPT_TOKEN_BUDGET 內依分數放入最多的候選標的，並記錄 Prompt 的 Token 數
     """
+    def build():
+        prompts = {section.name: news_prompt(section.name, market_data)
+                   for section in SECTIONS if section.name != 'picks'}
+        if qualified_stocks:
+            prompt, tokens, used, total, exact = pack_prompt(
+                picks_prompt, qualified_stocks,
+                lambda text: count_tokens(client, REPORT_MODEL, text), PROMPT_TOKEN_BUDGET)
+            print(f"🧮 精選個股 Prompt {tokens} tokens{'' if exact else ' (估計)'} / 預算 {PROMPT_TOKEN_BUDGET}, "
+                  f"候選 {used}/{total} 支")
+            metrics.incr('prompt_tokens', tokens)
+            metrics.incr('prompt_candidates', used)
+            prompts['picks'] = prompt
+        return prompts
+    return _prompt_cache.get_or_build((market_data, qualified_stocks, PROMPT_TOKEN_BUDGET), build)
 
-    for attempt in range(max_retries):
-        try:
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-exp",
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    tools=[types.Tool(google_search=types.GoogleSearch())],
-                    temperature=0.7
-                )
-            )
-            return response.text
-        except ServerError:
-            if attempt < max_retries - 1:
-                time.sleep((attempt + 1) * 5)
-            else:
-                return f"""🌅 投資早報 - 今日摘要
+def log_usage(usage_metadata):
+    """記錄並輸出 Gemini 回應的輸入 / 輸出 Token 數"""
+    metrics.record_usage(usage_metadata)
+    if usage_metadata is not None:
+        print(f"🧮 Gemini 用量: 輸入 {getattr(usage_metadata, 'prompt_token_count', 0) or 0} / "
+              f"輸出 {getattr(usage_metadata, 'candidates_token_count', 0) or 0} tokens")
 
-📊 市場數據
-{market_data}
+def generate_section_with_retry(client, prompt, grounded=True, policy=None, models=None, deadline_at=None):
+    """使用重試機制生成單一段落，回傳 (回覆文字, 實際使用的模型)
 
-🎯 潛力股候選
-{qualified_stocks}
+    依序嘗試 models 中的模型：暫時性錯誤在同一模型上退避重試，其他錯誤或重試用完則換下一個模型；
+    grounded=False 的段落在任何模型上都不使用 Google Search。所有嘗試都受 deadline_at 限制，
+    全部失敗時拋出最後一個錯誤 (金鑰錯誤立即拋出)
+    """
+    policy = policy or DEFAULT_RETRY_POLICY
+    models = models or REPORT_MODELS
+    deadline_at = deadline_at if deadline_at is not None else policy.start()
+    last_error = None
 
-⚠️ 系統提醒
-AI 新聞分析功能暫時無法使用，僅提供基本市場數據。
+    for model, model_grounded in models:
+        for attempt in range(policy.max_attempts):
+            remaining = policy.remaining(deadline_at)
+            if remaining <= 0:
+                break
+            try:
+                response = client.models.generate_content(
+                    model=model,
+                    contents=prompt,
+                    config=report_config(grounded and model_grounded, timeout=remaining)
+                )
+                log_usage(getattr(response, 'usage_metadata', None))
+                if model != models[0][0]:
+                    print(f"⚠️ 已改用備用模型 {model} 生成段落")
+                    metrics.incr('report_model_fallbacks')
+                return response.text, model
+            except Exception as e:
+                last_error = e
+                print(f"⚠️ {model} 第 {attempt + 1} 次生成失敗: {e}")
+                if is_fatal(e):
+                    raise
+                if not is_retryable(e) or attempt == policy.max_attempts - 1:
+                    break
+                delay = policy.delay(attempt, e)
+                if delay >= policy.remaining(deadline_at):
+                    break
+                metrics.incr('retries')
+                time.sleep(delay)
 
-📱 完整分析將在系統恢復後提供。"""
+    raise last_error or TimeoutError("已超過報告生成的時間預算")
+
+def submit_sections(executor, client, prompts, policy=None, models=None):
+    """各段落同時送出，共用同一個截止時間；回傳 {段落名稱: Future}"""
+    policy = policy or DEFAULT_RETRY_POLICY
+    deadline_at = policy.start()
+    grounded = {section.name: section.grounded for section in SECTIONS}
+    return {name: executor.submit(generate_section_with_retry, client, prompt, grounded[name], policy, models,
+                                  deadline_at)
+            for name, prompt in prompts.items()}
+
+def section_result(futures, errors, used=None):
+    """回傳 text_of(段落名稱)：等待該段落完成，失敗時記錄到 errors 並回傳 None；
+    有指定 used 時記錄各段落實際使用的模型 {段落名稱: 模型名稱}
+    """
+    def text_of(name):
+        if name not in futures:
+            return None
+        try:
+            text, model = futures[name].result()
         except Exception as e:
-            return f"❌ 生成報告錯誤: {str(e)}"
-    return None
+            errors[name] = e
+            return None
+        if used is not None:
+            used[name] = model
+        return text
+    return text_of
 
-def send_discord_message(message):
-    """發送 Discord 訊息 """
-    if not DISCORD_WEBHOOK_URL:
-        return False
+def generated_by_primary(used):
+    """所有段落都由主模型 (REPORT_MODEL，使用 Google Search) 生成；備用模型的報告不寫入快取，
+    以免之後主模型恢復時仍讀到以主模型為鍵的備用內容
+    """
+    fallbacks = sorted({model for model in used.values() if model != REPORT_MODEL})
+    if fallbacks:
+        print(f"⚠️ 部分段落由備用模型 {', '.join(fallbacks)} 生成，報告不寫入快取")
+    return not fallbacks
+
+def generate_report_with_retry(client, market_data, qualified_stocks, policy=None, models=None, used=None):
+    """分段生成報告 (新聞與選股同時請求，只有新聞使用 Google Search)，再依原本的版面組合
+
+    摘要與個股數字由本地資料組成，整體耗時約等於最慢的一個段落；
+    部分段落失敗時以預設內容代替並附上提醒，金鑰錯誤或全部失敗時沿用錯誤訊息與備用報告。
+    used 為字典時記錄各段落實際使用的模型
+    """
+    prompts = report_prompts(client, market_data, qualified_stocks)
+    errors = {}
+    with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+        text_of = section_result(submit_sections(executor, client, prompts, policy, models), errors, used)
+        texts = {name: text_of(name) for name in prompts}
+
+    fatal = next((e for e in errors.values() if is_fatal(e)), None)
+    if fatal is not None:
+        return f"❌ 生成報告錯誤: {str(fatal)}"
+    if len(errors) == len(prompts):
+        last_error = list(errors.values())[-1]
+        if not is_retryable(last_error):
+            return f"❌ 生成報告錯誤: {str(last_error)}"
+        return fallback_report(market_data, qualified_stocks)
+    if errors:
+        print(f"⚠️ {len(errors)} 個段落生成失敗，已改用預設內容")
+    return render_report(trading_date(), market_data, qualified_stocks, texts)
+
+def stream_report(client, market_data, qualified_stocks, on_section, used=None):
+    """分段生成報告，依版面順序在每個段落可用時呼叫 on_section(段落文字)
+
+    以段落為單位送出，不逐 token 串流：每個段落要等 Gemini 的回覆完整收到後才送出 (回覆需先經過
+    過濾與重新排版，且 LINE / Discord 無法編輯已送出的訊息)。美股收盤摘要由本地資料組成，
+    在任何 Gemini 呼叫完成前就送出；之後每個段落只等它自己的回覆，失敗的段落以預設內容代替。
+    used 為字典時記錄各段落實際使用的模型。回傳完整報告文字
+    """
+    prompts = report_prompts(client, market_data, qualified_stocks)
+    errors = {}
+    with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+        text_of = section_result(submit_sections(executor, client, prompts), errors, used)
+        parts = []
+        for part in iter_report_parts(trading_date(), market_data, qualified_stocks, text_of):
+            parts.append(part)
+            on_section(part)
+    if errors:
+        print(f"⚠️ {len(errors)} 個段落生成失敗，已改用預設內容")
+    return "\n\n".join(parts)
+
+# 長報告在 Discord 以 embeds 送出 (一次請求約可容納 6000 字)
+DISCORD_USE_EMBEDS = os.environ.get('DISCORD_USE_EMBEDS', 'true').lower() in ('1', 'true', 'yes')
+# 推播遇到暫時性錯誤 (429 / 5xx / 連線問題) 時的退避設定；外送匣會持續重試直到送達
+DELIVERY_RETRY_POLICY = RetryPolicy(base_delay=1.0, max_delay=30.0)
+# 前景等待推播送達的秒數上限 (早報推播與 send 等子命令結束前)，逾時的分段留在外送匣之後繼續送
+DELIVERY_WAIT_SECONDS = float(os.environ.get('DELIVERY_WAIT_SECONDS', 120))
+
+def pooled_http_client():
+    """LINE SDK 的 HTTP 客戶端類別，改用共用的 requests.Session 以重複使用 TLS 連線
+
+    繼承自 linebot 的類別，所以在第一次建立 LineBotApi 時才定義
+    """
+    import requests
+    from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+    class PooledHttpClient(RequestsHttpClient):
+        session = requests.Session()
+
+        def get(self, url, headers=None, params=None, stream=False, timeout=None):
+            response = self.session.get(url, headers=headers, params=params, stream=stream,
+                                        timeout=timeout or self.timeout)
+            return RequestsHttpResponse(response)
+
+        def post(self, url, headers=None, data=None, timeout=None):
+            response = self.session.post(url, headers=headers, data=data, timeout=timeout or self.timeout)
+            return RequestsHttpResponse(response)
+
+        def delete(self, url, headers=None, data=None, timeout=None):
+            response = self.session.delete(url, headers=headers, data=data, timeout=timeout or self.timeout)
+            return RequestsHttpResponse(response)
+
+    return PooledHttpClient
+
+_line_bot_api = None
+_discord_session = None
+_genai_client = None
+
+def get_genai_client():
+    """重複使用同一個 Gemini 客戶端 (常駐模式下不必每次重新建立)"""
+    global _genai_client
+    if _genai_client is None:
+        from google import genai
+        _genai_client = genai.Client(api_key=GEMINI_API_KEY)
+    return _genai_client
+
+def get_line_bot_api():
+    """重複使用同一個 LineBotApi (底層共用連線池)"""
+    global _line_bot_api
+    if _line_bot_api is None:
+        from linebot import LineBotApi
+        _line_bot_api = LineBotApi(LINE_ACCESS_TOKEN, endpoint=LINE_API_ENDPOINT, http_client=pooled_http_client())
+    return _line_bot_api
+
+def get_discord_session():
+    """Discord Webhook 專用的持久連線"""
+    global _discord_session
+    if _discord_session is None:
+        import requests
+        _discord_session = requests.Session()
+    return _discord_session
+
+# 試跑模式：跑完整個流程 (含分段與分組)，但只列出推播對象與請求數，不實際送出
+DRY_RUN = False
+
+def preview_delivery(channel, target, requests_count):
+    """試跑模式下代替實際推播，列出對象與會發出的請求數"""
+    if isinstance(target, (list, tuple)):
+        target = f"{len(target)} 位收件者"
+    print(f"🧪 [試跑] {channel} → {target}: {requests_count} 次請求")
+    return True
+
+def discord_wait_seconds(response):
+    """依 Discord 的速率限制標頭決定下一次請求前需要等待的秒數"""
+    if response.status_code == 429:
+        try:
+            return float(response.json().get('retry_after', 1))
+        except ValueError:
+            return float(response.headers.get('Retry-After', 1))
+    if response.headers.get('X-RateLimit-Remaining') == '0':
+        return float(response.headers.get('X-RateLimit-Reset-After', 0))
+    return 0.0
+
+def post_discord_payload(webhook_url, payload):
+    """送出一個 Discord 請求，非 2xx 時拋出 HTTPError (429 與 5xx 由外送匣退避後重試)"""
+    response = get_discord_session().post(webhook_url, json=payload, timeout=10)
+    wait = discord_wait_seconds(response)
+    response.raise_for_status()
+    metrics.incr('chunks_sent')
+    metrics.incr('bytes_sent', len(response.request.body or b''))
+    # 只有額度用完時才等待，不再固定休息
+    if wait:
+        time.sleep(wait)
+
+def push_line_batch(to, texts, retry_key=None):
+    """推送一批 LINE 訊息 (最多 5 則)；to 為清單時以 multicast 一次送給多位收件者
+
+    retry_key 讓 LINE 辨識重送的同一個請求：先前其實已受理時回應 409，視為已送達
+    """
+    from linebot.exceptions import LineBotApiError
+    from linebot.models import TextSendMessage
+
+    line_bot_api = get_line_bot_api()
+    messages = [TextSendMessage(text=text) for text in texts]
     try:
-        # Discord 的長度限制是 2000 字
-        max_length = 1900
-        for i in range(0, len(message), max_length):
-            payload = {"content": message[i:i+max_length]}
-            response = requests.post(DISCORD_WEBHOOK_URL, json=payload)
-            if response.status_code not in [200, 204]:
-                print(f"❌ Discord 傳送失敗: {response.status_code}")
-            time.sleep(0.5) # 避免觸發速率限制
-        return True
+        if isinstance(to, (list, tuple)):
+            line_bot_api.multicast(list(to), messages, retry_key=retry_key)
+        else:
+            line_bot_api.push_message(to, messages, retry_key=retry_key)
+    except LineBotApiError as e:
+        if e.status_code == 409:
+            return
+        raise
+    metrics.incr('chunks_sent')
+    metrics.incr('bytes_sent', sum(len(text.encode('utf-8')) for text in texts))
+
+def deliver_payload(channel, target, payload, key):
+    """外送匣的送出函式：payload 為 Discord 的 JSON 或 LINE 的一批文字，失敗時拋出例外"""
+    try:
+        if channel == 'LINE':
+            push_line_batch(target, payload, retry_key=str(uuid.UUID(key)))
+        else:
+            post_discord_payload(target, payload)
     except Exception as e:
-        print(f"❌ Discord 發送異常: {e}")
+        if is_retryable(e):
+            metrics.incr('retries')
+        raise
+
+_outbox_drainer = None
+
+def get_outbox():
+    """外送匣的背景推播執行緒 (第一次推播時啟動，並接續送出先前執行留下的分段)"""
+    global _outbox_drainer
+    if _outbox_drainer is None:
+        from outbox import Drainer, Outbox
+        _outbox_drainer = Drainer(Outbox(), deliver_payload, workers=DELIVERY_CONCURRENCY,
+                                  policy=DELIVERY_RETRY_POLICY).start()
+    return _outbox_drainer
+
+def pack_payloads(channel, message):
+    """把訊息切成該管道的請求內容"""
+    if channel == 'LINE':
+        # 只在段落或換行處分段，一次 push 最多帶 5 則訊息
+        return pack_line_messages(message)
+    # 只在段落或換行處分段，較長的報告以 embeds 合併成較少次請求
+    return pack_discord_payloads(message, use_embeds=DISCORD_USE_EMBEDS)
+
+def enqueue_message(channel, target, message, topic=None, stream=None):
+    """把訊息切成請求後排入外送匣，立即回傳應等待送達的冪等鍵 (試跑模式只列出請求數，回傳空清單)
+
+    同一交易日同一主題只送一個版本：早報以 'report' 排入，重跑時內容相同只補送未送達的分段，
+    已完整送出另一版本 (例如重新生成的報告) 時不再送一次；未指定主題時 (警示、收盤摘要、send、resend-cached)
+    每次呼叫都是新的一則，內容相同也會照送。stream 為串流識別碼時 message 是串流中的一個段落
+    """
+    payloads = pack_payloads(channel, message)
+    if DRY_RUN:
+        preview_delivery(channel, target, len(payloads))
+        return []
+    if topic is None:
+        topic = 'message:' + uuid.uuid4().hex
+    return get_outbox().submit(trading_date(), channel, target, topic, payloads, stream)
+
+def wait_for_delivery(keys=None, timeout=None):
+    """等待外送匣送出 keys (預設為本行程排入的全部分段)，回傳 {冪等鍵: 狀態}
+
+    最多等待 DELIVERY_WAIT_SECONDS 秒，逾時仍未送達的分段留在外送匣，由背景執行緒或下次執行繼續送
+    """
+    if _outbox_drainer is None or (keys is not None and not keys):
+        return {}
+    statuses = _outbox_drainer.wait(keys, DELIVERY_WAIT_SECONDS if timeout is None else timeout)
+    pending = sum(status == 'pending' for status in statuses.values())
+    if pending:
+        print(f"⏳ {pending} 個分段尚未送達，留在外送匣稍後重試")
+    return statuses
+
+def all_sent(statuses, keys):
+    return all(statuses.get(key) == 'sent' for key in keys)
+
+def close_outbox(timeout=None):
+    """等待本行程排入的推播送達後停止背景執行緒 (子命令結束前呼叫)"""
+    global _outbox_drainer
+    if _outbox_drainer is None:
+        return
+    statuses = wait_for_delivery(timeout=timeout)
+    stats = _outbox_drainer.stats
+    if statuses:
+        print(f"📮 外送匣: 送達 {stats['sent']} 個請求, 重試 {stats['retries']} 次, 失敗 {stats['failed']} 個")
+    _outbox_drainer.stop()
+    _outbox_drainer.outbox.close()
+    _outbox_drainer = None
+
+def send_discord_message(message, webhook_url=None):
+    """發送 Discord 訊息 (未指定 webhook_url 時使用環境變數中的 Webhook)，所有分段都送達才回傳 True"""
+    webhook_url = webhook_url or DISCORD_WEBHOOK_URL
+    if not webhook_url:
         return False
+    keys = enqueue_message('Discord', webhook_url, message)
+    return all_sent(wait_for_delivery(keys), keys)
 
-def send_line_message(message):
-    """發送 LINE 訊息 """
-    if not LINE_ACCESS_TOKEN or not LINE_USER_ID:
+def send_line_message(message, to=None):
+    """發送 LINE 訊息 (to 可為單一使用者或最多 500 人的清單，未指定時送給 LINE_USER_ID)，所有分段都送達才回傳 True"""
+    to = to or LINE_USER_ID
+    if not LINE_ACCESS_TOKEN or not to:
         print("🚫 缺少金鑰，輸出內容：\n", message)
         return False
-    try:
-        line_bot_api = LineBotApi(LINE_ACCESS_TOKEN)
-        max_length = 4500
-        for i in range(0, len(message), max_length):
-            line_bot_api.push_message(LINE_USER_ID, TextSendMessage(text=message[i:i+max_length]))
-            time.sleep(1)
-        return True
-    except Exception as e:
-        print(f"❌ LINE 發送失敗: {e}")
-        return False
+    keys = enqueue_message('LINE', to, message)
+    return all_sent(wait_for_delivery(keys), keys)
 
 def notify_all(message):
-    """根據環境變數決定發送對象"""
-    sent_any = False
-
-    # 嘗試發送 LINE
+    """根據環境變數決定發送對象，排入外送匣後立即回傳 (背景執行緒同時送往各管道)；回傳是否排入任何管道"""
+    targets = []
     if LINE_ACCESS_TOKEN and LINE_USER_ID:
-        if send_line_message(message):
-            print("✅ LINE 訊息已發送")
-            sent_any = True
-
-    # 嘗試發送 Discord
+        targets.append(('LINE', LINE_USER_ID))
     if DISCORD_WEBHOOK_URL:
-        if send_discord_message(message):
-            print("✅ Discord 訊息已發送")
-            sent_any = True
+        targets.append(('Discord', DISCORD_WEBHOOK_URL))
+    if not targets:
+        print("⚠️ 未設定任何通知管道。內容如下：\n", message)
+        return False
+
+    with metrics.span('deliver'):
+        for channel, target in targets:
+            keys = enqueue_message(channel, target, message)
+            if keys:
+                print(f"📮 {channel}: {len(keys)} 個請求已排入外送匣")
+    return True
+
+def trading_date():
+    """台北時間的今日日期 (報告快取以此區分交易日)"""
+    return datetime.now(ZoneInfo('Asia/Taipei')).date()
 
-    if not sent_any:
-        print("⚠️ 未設定任何通知管道，或發送皆失敗。內容如下：\n", message)
+def is_complete_report(report, market_data, qualified_stocks):
+    """只有完整的 AI 報告才寫入快取，錯誤訊息與備用報告不快取"""
+    return bool(report) and not report.startswith("❌") \
+        and report != fallback_report(market_data, qualified_stocks) \
+        and PARTIAL_NOTICE not in report
 
-def main():
+def main(resume=False):
     print("🚀 啟動早報機器人...")
+    metrics.reset()
     try:
-        # 你的金鑰讀取與初始化
-        client = genai.Client(api_key=GEMINI_API_KEY)
+        with metrics.span('run'):
+            from checkpoints import RunCheckpoint
+            from subscribers import load_subscribers
 
-        # 抓取資料與生成報表
-        market_data, qualified_stocks = get_market_data()
-        report = generate_report_with_retry(client, market_data, qualified_stocks)
-
-        if report:
-            notify_all(report)
+            # 試跑不寫入檢查點，以免之後的 --resume 誤以為已經推播過
+            checkpoint = RunCheckpoint(trading_date(), resume=resume, persist=not DRY_RUN)
+            run_pipeline(load_subscribers(), checkpoint)
 
         print("🎉 任務完成!")
     except Exception as e:
         print(f"❌ 執行異常: {e}")
+    finally:
+        print(metrics.write_report(RUN_REPORT_PATH, METRICS_TEXTFILE))
+
+# 多訂閱者模式：同時生成的報告版本數與同時進行的推播請求數上限
+FANOUT_REPORT_WORKERS = int(os.getenv('FANOUT_REPORT_WORKERS', '4'))
+DELIVERY_CONCURRENCY = int(os.getenv('DELIVERY_CONCURRENCY', '8'))
+
+def generate_cached_report(client, market_data, qualified_stocks):
+    """先查報告快取，沒有才呼叫 Gemini；完整且全部由主模型生成的報告寫回快取"""
+    cache_key = report_key(REPORT_MODEL, PROMPT_VERSION, market_data, qualified_stocks, trading_date())
+    cached = get_cached_report(cache_key)
+    if cached:
+        metrics.incr('report_cache_hits')
+        return cached
+    used = {}
+    report = generate_report_with_retry(client, market_data, qualified_stocks, used=used)
+    if is_complete_report(report, market_data, qualified_stocks) and generated_by_primary(used):
+        put_cached_report(cache_key, report)
+    return report
+
+def default_subscriber():
+    """沒有訂閱者名冊時的收件者：環境變數設定的 LINE 使用者與 Discord Webhook"""
+    from screener import DEFAULT_RULES
+    from subscribers import Subscriber, Variant
+
+    rules = DEFAULT_RULES if SCREEN_RULES is None else SCREEN_RULES
+    return Subscriber('default', LINE_USER_ID if LINE_ACCESS_TOKEN else None, DISCORD_WEBHOOK_URL,
+                      Variant(rules=rules))
+
+def encode_screen(value):
+    market_data, result = value
+    return {'market_data': market_data, 'result': result.to_json(orient='split', double_precision=15)}
+
+def decode_screen(value):
+    import io
+    import pandas as pd
+
+    result = pd.read_json(io.StringIO(value['result']), orient='split', convert_dates=False)
+    return value['market_data'], result
+
+def delivery_targets(members):
+    """一組收件者的推播對象 [(管道, 對象)]：LINE 每批最多 500 人 (只有一人時改用 push)，Discord 相同 Webhook 只送一次"""
+    from subscribers import recipient_batches
+
+    line_batches, webhooks = recipient_batches(members)
+    return [('LINE', batch[0] if len(batch) == 1 else batch) for batch in line_batches] + \
+        [('Discord', webhook) for webhook in webhooks]
+
+def delivery_tasks(reports, audiences):
+    """整理推播工作 [(管道, 對象, 報告)]"""
+    return [(channel, target, reports[candidates])
+            for candidates, members in audiences.items() if reports.get(candidates)
+            for channel, target in delivery_targets(members)]
+
+def delivery_key(channel, target, report):
+    """推播對象與內容的識別碼，--resume 時據此判斷是否已送達"""
+    payload = json.dumps([channel, target, report], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def send_to(channel, target, report):
+    sender = send_line_message if channel == 'LINE' else send_discord_message
+    return sender(report, target)
+
+def report_latency(statuses, report_start):
+    """從開始生成報告到第一則與最後一則訊息送達的時間 (依外送匣記錄的送達時間，先前執行已送達的分段不計)"""
+    sent_at = sorted(at for at in (get_outbox().outbox.sent_times(statuses).values() if statuses else [])
+                     if at >= report_start)
+    if sent_at:
+        print(f"⏱️  報告延遲: 第一則訊息 {sent_at[0] - report_start:.2f} 秒, 最後一則 {sent_at[-1] - report_start:.2f} 秒 "
+              f"(共 {len(sent_at)} 個請求)")
+
+def deliver_reports(tasks, checkpoint, report_start=None):
+    """把尚未確認送達的推播排入外送匣並等待送出，所有分段都送達的對象寫入檢查點；回傳是否全部送達
+
+    report_start 為開始生成報告的時間 (time.time())，有指定時另外印出報告延遲
+    """
+    pending = [task for task in tasks if not checkpoint.delivered(delivery_key(*task))]
+    if len(pending) < len(tasks):
+        print(f"⏭️  {len(tasks) - len(pending)} 批推播已送達，略過")
+    if not pending:
+        return True
+
+    start_time = time.perf_counter()
+    with metrics.span('deliver'):
+        queued = [(task, enqueue_message(*task, topic='report')) for task in pending]
+        statuses = wait_for_delivery([key for _, keys in queued for key in keys])
+    results = []
+    for task, keys in queued:
+        results.append(all_sent(statuses, keys))
+        if results[-1]:
+            checkpoint.confirm(delivery_key(*task))
+    print(f"✅ 推播完成 {sum(results)}/{len(pending)} 批 ({time.perf_counter() - start_time:.2f} 秒)")
+    if report_start is not None:
+        report_latency(statuses, report_start)
+    return all(results)
+
+def stream_and_deliver(client, market_data, candidates, targets, checkpoint, used=None):
+    """串流模式：每完成一個段落就排入外送匣 (背景執行緒在生成的同時依序送出)，
+    所有段落都送達的對象記入檢查點；回傳完整報告 (used 為字典時記錄各段落實際使用的模型)
+    """
+    report_start = time.time()
+    queued = []
+    # 同一次串流的段落接續編號；與一般模式同樣以 'report' 為主題，今天已送出另一版本的對象不再送
+    stream = uuid.uuid4().hex
+
+    def deliver(section):
+        for channel, target in targets:
+            queued.append(((channel, target), enqueue_message(channel, target, section, topic='report', stream=stream)))
+
+    with metrics.span('report'):
+        report = stream_report(client, market_data, candidates, on_section=deliver, used=used)
+    if not DRY_RUN:
+        # 登記完整報告的版本，重跑時讀到快取的同一份報告會沿用串流送出的分段
+        for channel, target in targets:
+            get_outbox().seal(trading_date(), channel, target, 'report', stream, pack_payloads(channel, report))
+    with metrics.span('deliver'):
+        statuses = wait_for_delivery([key for _, keys in queued for key in keys])
+    for channel, target in targets:
+        keys = [key for queued_target, keys in queued if queued_target == (channel, target) for key in keys]
+        if all_sent(statuses, keys):
+            checkpoint.confirm(delivery_key(channel, target, report))
+    report_latency(statuses, report_start)
+    return report
+
+def run_pipeline(subscribers, checkpoint, client=None):
+    """早報流程：股票池 → 價格 → 篩選 → 報告 → 推播，每個階段完成後寫入檢查點
+
+    有訂閱者名冊時依 (觀察清單, 條件, 名額) 分組，不同版本若選出相同候選清單也只生成一次報告；
+    沒有名冊時推送到環境變數設定的 LINE / Discord。--resume 時已完成的階段直接沿用檢查點，
+    推播只補送尚未確認送達的對象
+    """
+    from subscribers import group_by_variant, watchlist_tickers
+
+    members = subscribers or [default_subscriber()]
+    extra_tickers = watchlist_tickers(members)
+
+    # 美股指數在股票池階段已同時下載，價格階段只更新台股
+    universe = checkpoint.stage('universe', fetch_universe_and_indices)
+    checkpoint.stage('prices', lambda: timed('prices', fetch_prices, universe + extra_tickers, include_indices=False))
+    with metrics.span('market_data'):
+        # 價格已在上一個階段更新，篩選只讀取快取；台股篩選失敗時不寫入檢查點
+        market_data, result = checkpoint.stage(
+            'screen', lambda: collect_market_data(extra_tickers, universe=universe, offline=True),
+            encode=encode_screen, decode=decode_screen, complete=lambda value: value[1] is not None)
+
+    # 報告內容只取決於候選字串，以此再次分組
+    groups = group_by_variant(members)
+    audiences = {}
+    for variant, group in groups.items():
+        candidates = variant.candidates(result) if result is not None else ""
+        audiences.setdefault(candidates, []).extend(group)
+    if subscribers:
+        metrics.incr('subscribers', len(subscribers))
+        metrics.incr('report_variants', len(audiences))
+        print(f"👥 {len(subscribers)} 位訂閱者, {len(groups)} 組設定, {len(audiences)} 份不同報告")
+
+    def generate():
+        llm = client or get_genai_client()
+        if STREAM_REPORT and len(audiences) == 1:
+            candidates = next(iter(audiences))
+            cache_key = report_key(REPORT_MODEL, PROMPT_VERSION, market_data, candidates, trading_date())
+            if not get_cached_report(cache_key):
+                targets = delivery_targets(audiences[candidates])
+                used = {}
+                report = stream_and_deliver(llm, market_data, candidates, targets, checkpoint, used)
+                if is_complete_report(report, market_data, candidates) and generated_by_primary(used):
+                    put_cached_report(cache_key, report)
+                return {candidates: report}
+        with metrics.span('report'), ThreadPoolExecutor(max_workers=FANOUT_REPORT_WORKERS) as executor:
+            return dict(zip(audiences, executor.map(
+                lambda candidates: generate_cached_report(llm, market_data, candidates), audiences)))
+
+    def complete(reports):
+        return all(is_complete_report(report, market_data, candidates) for candidates, report in reports.items())
+
+    # 錯誤訊息或備用報告照常推送，但不寫入檢查點，--resume 時會重新生成
+    report_start = time.time()
+    reports = checkpoint.stage('report', generate, complete=complete)
+    if set(reports) != set(audiences):
+        print("⚠️ 報告檢查點與目前的候選清單不一致 (名冊或條件已修改)，重新生成")
+        reports = generate()
+        if complete(reports):
+            checkpoint.save('report', reports)
+
+    tasks = delivery_tasks(reports, audiences)
+    if not tasks:
+        for report in reports.values():
+            print("⚠️ 未設定任何通知管道。內容如下：\n", report)
+        return
+    deliver_reports(tasks, checkpoint, report_start)
+
+def format_close_summary(result, limit=5):
+    """收盤摘要：漲跌幅排行與符合篩選條件的標的數 (本地組成，不呼叫 Gemini)"""
+    moved = result.dropna(subset=['change_pct'])
+    gainers = moved.nlargest(limit, 'change_pct')
+    losers = moved.nsmallest(limit, 'change_pct')
+
+    def lines(rows):
+        return "\n".join(f"● {ticker}: {row.close:.2f} ({row.change_pct:+.2f}%)"
+                         for ticker, row in rows.iterrows()) or "● 無資料"
+
+    return (f"📊 台股收盤摘要 ({trading_date():%Y/%m/%d})\n\n"
+            f"【漲幅前 {limit} 名】\n{lines(gainers)}\n\n"
+            f"【跌幅前 {limit} 名】\n{lines(losers)}\n\n"
+            f"🎯 符合篩選條件: {int(result['qualified'].sum())} 支 / 股票池 {len(result)} 支")
+
+def intraday_check():
+    """盤中檢查：重抓今天的 K 棒並重新篩選，回傳篩選結果"""
+    metrics.reset()
+    with metrics.span('intraday'):
+        result = fetch_and_screen_taiwan(refresh=True)
+    print(f"📈 盤中檢查: 符合條件 {int(result['qualified'].sum())} 支")
+    print(metrics.summary_line(metrics.snapshot()))
+    return result
+
+def post_close_summary():
+    """收盤後整理當日漲跌並推播"""
+    metrics.reset()
+    with metrics.span('post_close'):
+        result = fetch_and_screen_taiwan(refresh=True)
+        notify_all(format_close_summary(result))
+    print(metrics.summary_line(metrics.snapshot()))
+
+def check_alerts(engine):
+    """分批抓取警示規則涉及的標的最新報價，有規則被觸發時合併成一則通知推播"""
+    from alerts import format_alerts
+    from price_cache import iter_prices
+    from screener import compute_metrics
+
+    fired, latest = [], {}
+    evaluate_seconds = 0.0
+    for chunk, data in iter_prices(engine.tickers, days=2, refresh=True):
+        quotes = compute_metrics(data, chunk)
+        start = time.perf_counter()
+        fired += engine.evaluate(chunk, {'price': quotes['close'].to_numpy(),
+                                         'change_pct': quotes['change_pct'].to_numpy()})
+        evaluate_seconds += time.perf_counter() - start
+        latest.update(zip(chunk, zip(quotes['close'], quotes['change_pct'])))
+    metrics.incr('alerts_fired', len(fired))
+    print(f"🔔 警示檢查: {len(engine.rules)} 條規則, 觸發 {len(fired)} 條 (評估 {evaluate_seconds * 1000:.2f} 毫秒)")
+    if fired:
+        notify_all(format_alerts(fired, latest))
+    return fired
+
+# 常駐模式的排程 (台北時間，週一至週五)
+DAEMON_PREOPEN_TIME = os.getenv('DAEMON_PREOPEN_TIME', '08:47')
+DAEMON_INTRADAY_MINUTES = int(os.getenv('DAEMON_INTRADAY_MINUTES', '30'))
+DAEMON_POSTCLOSE_TIME = os.getenv('DAEMON_POSTCLOSE_TIME', '14:05')
+# 盤中警示的檢查間隔分鐘 (設定了 ALERT_RULES_PATH 的規則檔才會啟用)
+ALERT_POLL_MINUTES = int(os.getenv('ALERT_POLL_MINUTES', '5'))
+
+def daemon_jobs():
+    from alerts import AlertEngine, load_rules
+
+    jobs = [Job('pre_open', main, at=(DAEMON_PREOPEN_TIME,))]
+    if DAEMON_INTRADAY_MINUTES > 0:
+        jobs.append(Job('intraday', intraday_check, every=DAEMON_INTRADAY_MINUTES, between=('09:00', '13:30')))
+    rules = load_rules()
+    if rules and ALERT_POLL_MINUTES > 0:
+        engine = AlertEngine(rules)
+        jobs.append(Job('alerts', lambda: check_alerts(engine), every=ALERT_POLL_MINUTES, between=('09:00', '13:30')))
+    if DAEMON_POSTCLOSE_TIME:
+        jobs.append(Job('post_close', post_close_summary, at=(DAEMON_POSTCLOSE_TIME,)))
+    return jobs
+
+def run_daemon():
+    """常駐模式：只在啟動時初始化一次客戶端與快取，之後依排程觸發各項工作"""
+    print("🚀 啟動常駐模式...")
+    start_time = time.perf_counter()
+    get_genai_client()
+    if LINE_ACCESS_TOKEN:
+        get_line_bot_api()
+    get_discord_session()
+    get_indicator_state()
+    # 其餘套件也在啟動時載入，第一次觸發排程時不必再付載入成本
+    import yfinance  # noqa: F401
+    import screener  # noqa: F401
+    print(f"   ✅ 客戶端初始化完成 ({time.perf_counter() - start_time:.2f} 秒)")
+
+    scheduler = Scheduler(daemon_jobs())
+    signal.signal(signal.SIGTERM, lambda *_: scheduler.stop())
+    now = scheduler.now()
+    for job in scheduler.jobs:
+        print(f"   🗓️  {job.name}: 下次執行 {job.next_run(now):%Y-%m-%d %H:%M}")
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    print("👋 常駐模式結束")
+
+# 子命令：每個子命令只載入自己用到的套件 (例如 send / resend-cached 不會載入 pandas 與 google-genai)
+def cmd_fetch(args):
+    from subscribers import load_subscribers, watchlist_tickers
+
+    fetch_prices(get_taiwan_stock_pool() + watchlist_tickers(load_subscribers()), refresh=args.refresh)
+
+def cmd_screen(args):
+    from screener import format_candidates
+
+    result = fetch_and_screen_taiwan(refresh=args.refresh)
+    print(format_candidates(result, limit=args.limit) or "沒有符合條件的標的")
+
+def cmd_report(args):
+    market_data, qualified_stocks = get_market_data()
+    print(generate_cached_report(get_genai_client(), market_data, qualified_stocks))
+
+def cmd_send(args):
+    message = args.file.read().strip()
+    if not message:
+        print("⚠️ 沒有要發送的內容")
+        return 1
+    notify_all(message)
+
+def cmd_resend_cached(args):
+    report = latest_cached_report()
+    if not report:
+        print("⚠️ 沒有未過期的快取報告")
+        return 1
+    print("💾 重送最近一次的快取報告")
+    notify_all(report)
+
+def cmd_dry_run(args):
+    global DRY_RUN
+    DRY_RUN = True
+    main(resume=args.resume)
+
+def cmd_backtest(args):
+    from backtest import BACKTEST_YEARS, HORIZONS, run_backtest
+    from screener import DEFAULT_RULES
+
+    rules = DEFAULT_RULES if SCREEN_RULES is None else SCREEN_RULES
+    run_backtest(get_taiwan_stock_pool(), years=args.years or BACKTEST_YEARS, sweep=args.sweep, rules=rules,
+                 workers=args.workers, offline=args.offline, horizons=tuple(args.horizons or HORIZONS))
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="台股早報機器人 (未指定子命令時執行完整流程)")
+    parser.add_argument('--daemon', action='store_true', help="同 daemon 子命令")
+    parser.add_argument('--resume', action='store_true',
+                        help="沿用今天的檢查點，跳過已完成的階段，只補送尚未送達的推播")
+    commands = parser.add_subparsers(dest='command', metavar='子命令')
+    run_cmd = commands.add_parser('run', help="完整流程：股票池 → 價格 → 篩選 → 報告 → 推播")
+    run_cmd.add_argument('--resume', action='store_true', default=argparse.SUPPRESS, help="同上層的 --resume")
+    run_cmd.set_defaults(func=lambda args: main(resume=args.resume))
+    commands.add_parser('daemon', help="常駐模式：依排程產生盤前報告、盤中檢查與收盤摘要") \
+        .set_defaults(func=lambda args: run_daemon())
+
+    fetch_cmd = commands.add_parser('fetch', help="只更新股票池與價格快取")
+    fetch_cmd.add_argument('--refresh', action='store_true', help="連今天已存在的 K 棒也重抓")
+    fetch_cmd.set_defaults(func=cmd_fetch)
+
+    screen_cmd = commands.add_parser('screen', help="篩選台股並列出候選標的 (不呼叫 Gemini)")
+    screen_cmd.add_argument('--refresh', action='store_true', help="連今天已存在的 K 棒也重抓")
+    screen_cmd.add_argument('--limit', type=int, default=15, help="列出的候選數")
+    screen_cmd.set_defaults(func=cmd_screen)
+
+    commands.add_parser('report', help="生成報告並印出，不推播 (有快取時直接使用)").set_defaults(func=cmd_report)
+
+    send_cmd = commands.add_parser('send', help="把文字檔 (或標準輸入) 推播到 LINE / Discord")
+    send_cmd.add_argument('file', nargs='?', type=argparse.FileType('r', encoding='utf-8'), default=sys.stdin,
+                      help="要發送的文字檔，省略時讀取標準輸入")
+    send_cmd.set_defaults(func=cmd_send)
+
+    commands.add_parser('resend-cached', help="重送最近一次的快取報告 (不抓資料也不呼叫 Gemini)") \
+        .set_defaults(func=cmd_resend_cached)
+    dry_run_cmd = commands.add_parser('dry-run', help="執行完整流程但不實際推播，只列出推播對象與請求數")
+    dry_run_cmd.add_argument('--resume', action='store_true', default=argparse.SUPPRESS, help="同上層的 --resume")
+    dry_run_cmd.set_defaults(func=cmd_dry_run)
+
+    backtest_cmd = commands.add_parser('backtest', help="以快取中的歷史日 K 線回測篩選條件 (不呼叫 Gemini 也不推播)")
+    backtest_cmd.add_argument('--years', type=float, help="回測年數 (預設 BACKTEST_YEARS 或 5 年)")
+    backtest_cmd.add_argument('--horizons', type=int, nargs='+', help="持有天數 (預設 1 5 20)")
+    backtest_cmd.add_argument('--sweep', action='store_true', help="掃描價格區間與均量門檻的組合")
+    backtest_cmd.add_argument('--workers', type=int, help="平行行程數 (預設為 CPU 核心數)")
+    backtest_cmd.add_argument('--offline', action='store_true', help="不補抓較早的歷史，只用快取中已有的資料")
+    backtest_cmd.set_defaults(func=cmd_backtest)
+    return parser
+
+def cli(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        if args.daemon:
+            return run_daemon()
+        if not args.command:
+            return main(resume=args.resume)
+        return args.func(args)
+    finally:
+        # notify_all 只負責排入外送匣，結束前等背景執行緒送完
+        close_outbox()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(cli())
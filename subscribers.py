@@ -0,0 +1,104 @@
+"""
+訂閱者名冊 - 每位訂閱者可自訂觀察清單與篩選門檻
+輸入相同 (觀察清單、條件、名額) 的訂閱者歸為同一個報告版本，每個版本只生成一次報告
+"""
+
+import json
+import os
+from dataclasses import dataclass
+
+from screener import (DEFAULT_RULES, above_ma20, apply_rules, change_pct_between, format_candidates,
+                      min_avg_volume, min_volume_surge, price_between, rsi_between)
+
+SUBSCRIBERS_PATH = os.getenv('SUBSCRIBERS_PATH', 'subscribers.json')
+# LINE multicast 一次最多 500 位收件者
+LINE_MULTICAST_MAX_RECIPIENTS = 500
+
+# 名冊中 rules 欄位的鍵 → 篩選條件
+RULE_BUILDERS = {
+    'price': lambda value: price_between(*value),
+    'min_volume': min_avg_volume,
+    'change_pct': lambda value: change_pct_between(*value),
+    'rsi': lambda value: rsi_between(*value),
+    'min_volume_surge': min_volume_surge,
+    'above_ma20': lambda value: above_ma20() if value else None,
+}
+
+
+def parse_rules(config):
+    """把名冊中的條件設定轉成篩選條件，未設定時使用預設條件
+
+    例如 {"price": [20, 50], "min_volume": 3000000, "rsi": [null, 80]}
+    """
+    if not config:
+        return DEFAULT_RULES
+    unknown = set(config) - set(RULE_BUILDERS)
+    if unknown:
+        raise ValueError(f"不支援的篩選條件: {', '.join(sorted(unknown))}")
+    rules = (RULE_BUILDERS[key](value) for key, value in config.items())
+    return tuple(rule for rule in rules if rule is not None)
+
+
+@dataclass(frozen=True)
+class Variant:
+    """一個報告版本：觀察清單 (空白代表整個股票池)、篩選條件與候選名額 (None 為由 Token 預算決定)"""
+    watchlist: tuple = ()
+    rules: tuple = DEFAULT_RULES
+    limit: int = None
+
+    def candidates(self, result):
+        """從共用的篩選結果中選出這個版本的候選字串 (只重新套用條件，不重算指標)"""
+        if self.watchlist:
+            subset = result.reindex(list(self.watchlist))
+        else:
+            subset = result[result['in_universe']] if 'in_universe' in result else result
+        return format_candidates(apply_rules(subset, self.rules), limit=self.limit)
+
+
+@dataclass(frozen=True)
+class Subscriber:
+    id: str
+    line_user_id: str = None
+    discord_webhook: str = None
+    variant: Variant = Variant()
+
+
+def load_subscribers(path=SUBSCRIBERS_PATH):
+    """讀取訂閱者名冊 (物件陣列)，檔案不存在時回傳空清單"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            items = json.load(f)
+    except FileNotFoundError:
+        return []
+    subscribers = []
+    for item in items:
+        variant = Variant(
+            watchlist=tuple(sorted(set(item.get('watchlist') or ()))),
+            rules=parse_rules(item.get('rules')),
+            limit=int(item['limit']) if item.get('limit') is not None else None,
+        )
+        subscribers.append(Subscriber(str(item['id']), item.get('line_user_id'),
+                                      item.get('discord_webhook'), variant))
+    return subscribers
+
+
+def group_by_variant(subscribers):
+    """依報告版本分組，回傳 {版本: [訂閱者]} (保留名冊順序)"""
+    groups = {}
+    for subscriber in subscribers:
+        groups.setdefault(subscriber.variant, []).append(subscriber)
+    return groups
+
+
+def watchlist_tickers(subscribers):
+    """所有訂閱者觀察清單的聯集 (需要與股票池一起下載)"""
+    return sorted({ticker for subscriber in subscribers for ticker in subscriber.variant.watchlist})
+
+
+def recipient_batches(subscribers):
+    """整理一組訂閱者的收件對象：LINE 每批最多 500 人，Discord Webhook 去重"""
+    line_ids = sorted({s.line_user_id for s in subscribers if s.line_user_id})
+    webhooks = sorted({s.discord_webhook for s in subscribers if s.discord_webhook})
+    line_batches = [line_ids[i:i + LINE_MULTICAST_MAX_RECIPIENTS]
+                    for i in range(0, len(line_ids), LINE_MULTICAST_MAX_RECIPIENTS)]
+    return line_batches, webhooks
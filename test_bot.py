@@ -6,6 +6,7 @@
 
 import os
 import sys
+import numpy as np
 import pandas as pd
 import yfinance as yf
 
@@ -109,6 +110,99 @@ def test_taiwan_stock_pool():
         print(f"   ❌ 股票池測試失敗: {e}")
         return False
 
+def test_universe():
+    """測試全市場股票池索引：上市 / 上櫃代號後綴、產業篩選與下市標記"""
+    print("\n📇 測試全市場股票池...")
+
+    try:
+        import tempfile
+        from universe import LISTING_URLS, lookup, refresh_index, select, tickers
+
+        header = "出表日期,公司代號,公司名稱,公司簡稱,產業別\n"
+        listings = {
+            'TWSE': header + "1131018,2330,台灣積體電路製造股份有限公司,台積電,24\n1131018,2882,國泰金融控股,國泰金,17\n",
+            'TPEx': header + "1131018,6488,環球晶圓股份有限公司,環球晶,24\n1131018,9999X,非普通股,測試,20\n",
+        }
+        with tempfile.TemporaryDirectory() as workdir:
+            def write(market, text):
+                with open(os.path.join(workdir, LISTING_URLS[market].rsplit('/', 1)[-1]), 'w', encoding='utf-8') as f:
+                    f.write(text)
+
+            for market, text in listings.items():
+                write(market, text)
+            path = os.path.join(workdir, 'index.npy')
+            index = refresh_index(ttl_hours=0, path=path, listing_dir=workdir)
+            semis = tickers(index, select(index, industries=['半導體業']))
+            # 2882 從名單消失後應標為下市，不再出現在股票池
+            write('TWSE', header + "1131018,2330,台灣積體電路製造股份有限公司,台積電,24\n")
+            index = refresh_index(ttl_hours=0, path=path, listing_dir=workdir)
+            pool = tickers(index, select(index))
+
+        if semis == ['2330.TW', '6488.TWO'] and pool == ['2330.TW', '6488.TWO'] \
+                and lookup(index, '2882.TW')['status'] == 'delisted' and lookup(index, '6488')['name'] == '環球晶':
+            print(f"   ✅ 索引 {len(index)} 支, 股票池 {pool}")
+            return True
+        else:
+            print(f"   ❌ 股票池索引異常: {semis}, {pool}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 全市場股票池測試失敗: {e}")
+        return False
+
+def test_downloader():
+    """測試分批下載器：限速照實扣除整批的 token，沒有資料的個股只再試一次且記錄後下次略過"""
+    print("\n📥 測試分批下載器...")
+
+    try:
+        import tempfile
+        import time
+        import downloader
+        import price_cache
+
+        # 容量 20、每秒 200 個 token，三批各 50 支共需 150 個：至少等待 (150 - 20) / 200 = 0.65 秒
+        bucket = downloader.TokenBucket(200, capacity=20)
+        start = time.perf_counter()
+        for _ in range(3):
+            bucket.acquire(50)
+        throttled = time.perf_counter() - start
+
+        calls = []
+
+        def fetch_chunk(tickers, bucket, **kwargs):
+            calls.extend(tickers)
+            return {ticker: pd.DataFrame({'Close': [1.0]}) for ticker in tickers if ticker != '9999.TW'}
+
+        original, downloader.fetch_chunk = downloader.fetch_chunk, fetch_chunk
+        try:
+            stats = {}
+            start = time.perf_counter()
+            list(downloader.download_in_chunks(['2330.TW', '9999.TW'], stats=stats))
+            elapsed = time.perf_counter() - start
+        finally:
+            downloader.fetch_chunk = original
+
+        with tempfile.TemporaryDirectory() as workdir:
+            conn = price_cache.connect(os.path.join(workdir, 'prices.sqlite'))
+            price_cache.record_empty(conn, stats['empty'], ['2330.TW'])
+            skipped, plan = price_cache.download_plan(conn, ['2330.TW', '9999.TW'])
+            conn.close()
+
+        if not 0.6 <= throttled < 2:
+            print(f"   ❌ 限速異常: 150 個 token 耗時 {throttled:.2f} 秒")
+            return False
+        if calls.count('9999.TW') == 2 and stats['empty'] == ['9999.TW'] and not stats['failed'] \
+                and elapsed < 0.4 and skipped == ['9999.TW'] and [group for _, group in plan] == [['2330.TW']]:
+            print(f"   ✅ 限速 150 個 token 耗時 {throttled:.2f} 秒，無資料的個股只重試一次並於下次略過")
+            return True
+        else:
+            print(f"   ❌ 下載結果異常: {calls}, {stats}, 略過 {skipped}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 分批下載器測試失敗: {e}")
+        return False
+
 def test_market_data():
     """測試市場數據獲取功能"""
     print("\n📈 測試市場數據功能...")
@@ -122,7 +216,7 @@ def test_market_data():
         if market_data and "美股" in market_data:
             print("   ✅ 市場數據獲取成功")
             print("   ✅ 股票篩選功能正常")
-            print(f"   符合條件股票數量: {len(qualified_stocks.split(',')) if qualified_stocks else 0}")
+            print(f"   符合條件股票數量: {max(len(qualified_stocks.splitlines()) - 1, 0)}")
             return True
         else:
             print("   ❌ 市場數據格式異常")
@@ -135,6 +229,592 @@ def test_market_data():
         print(f"   ❌ 市場數據測試失敗: {e}")
         return False
 
+def test_screener():
+    """測試向量化篩選引擎 (離線合成資料)"""
+    print("\n🧮 測試篩選引擎...")
+
+    try:
+        from screener import screen
+
+        dates = pd.bdate_range(end="2024-01-31", periods=5)
+        data = pd.concat({
+            "1111.TW": pd.DataFrame({'Open': 30.0, 'Close': 30.0, 'Volume': 5e6}, index=dates),
+            "2222.TW": pd.DataFrame({'Open': 80.0, 'Close': 80.0, 'Volume': 5e6}, index=dates),
+            "3333.TW": pd.DataFrame({'Open': 30.0, 'Close': 30.0, 'Volume': 1e5}, index=dates),
+        }, axis=1)
+        result = screen(data, ["1111.TW", "2222.TW", "3333.TW", "4444.TW"])
+
+        reasons = result['reason'].to_dict()
+        expected = {"1111.TW": "", "2222.TW": "價格區間", "3333.TW": "日均量", "4444.TW": "缺少資料"}
+        if reasons == expected:
+            print("   ✅ 篩選結果與剔除原因正確")
+            return True
+        else:
+            print(f"   ❌ 篩選結果異常: {reasons}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 篩選引擎測試失敗: {e}")
+        return False
+
+def test_indicators():
+    """測試技術指標增量更新與一次計算的結果一致 (離線合成資料)"""
+    print("\n📈 測試技術指標引擎...")
+
+    try:
+        from indicators import IndicatorState
+
+        rng = np.random.default_rng(0)
+        dates = np.arange(np.datetime64('2024-01-01'), np.datetime64('2024-04-01'))
+        close = 30 * np.cumprod(1 + rng.normal(0, 0.02, (len(dates), 2)), axis=0)
+        bars = {'Close': close, 'High': close * 1.01, 'Low': close * 0.99,
+                'Volume': rng.uniform(1e6, 5e6, close.shape)}
+        tickers = ["1111.TW", "2222.TW"]
+
+        full = IndicatorState(tickers)
+        full.update(tickers, dates, bars)
+        incremental = IndicatorState(tickers)
+        for start in range(0, len(dates), 7):
+            # 每次多餵一天重疊的 K 棒，重複的日期應被忽略
+            window = slice(max(start - 1, 0), start + 7)
+            incremental.update(tickers, dates[window], {k: v[window] for k, v in bars.items()})
+
+        expected, actual = full.values(tickers), incremental.values(tickers)
+        if np.allclose(expected.to_numpy(), actual.to_numpy(), equal_nan=True) and expected['rsi14'].notna().all():
+            print("   ✅ 增量更新結果與一次計算一致")
+            return True
+        else:
+            print(f"   ❌ 指標結果不一致:\n{expected}\n{actual}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 技術指標測試失敗: {e}")
+        return False
+
+def test_price_store():
+    """測試欄位式價格存放區：建立、附加新交易日與加入新標的後，讀出的矩陣都與 SQLite 一致"""
+    print("\n🧪 測試欄位式價格存放區...")
+
+    try:
+        import tempfile
+        import price_cache
+        import price_store
+
+        dates = pd.bdate_range("2024-01-01", periods=30)
+        rng = np.random.default_rng(1)
+
+        def bars(days):
+            close = rng.uniform(20, 50, len(days))
+            return pd.DataFrame({'Open': close, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+                                 'Volume': rng.uniform(1e5, 1e7, len(days)).round()}, index=days)
+
+        with tempfile.TemporaryDirectory() as workdir:
+            db_path, store_path = os.path.join(workdir, 'prices.sqlite'), os.path.join(workdir, 'price_store')
+            batches = [{'2330.TW': bars(dates[:25]), '2317.TW': bars(dates[5:25])},
+                       {'2330.TW': bars(dates[24:28]), '2317.TW': bars(dates[24:26])},
+                       {'2454.TW': bars(dates[:28])}]
+            tickers, mismatched = ['2330.TW', '2317.TW'], []
+            for step, frames in enumerate(batches):
+                conn = price_cache.connect(db_path)
+                price_cache.store_frames(conn, frames)
+                conn.close()
+                tickers = list(dict.fromkeys(tickers + list(frames)))
+                store = price_store.sync(tickers, dates[2].date(), path=store_path, db_path=db_path)
+                conn = price_cache.connect(db_path)
+                expected_dates, expected = price_cache.load_matrix(conn, tickers, since=dates[1].date())
+                conn.close()
+                got_dates, got = store.matrices(tickers, since=dates[2].date())
+                if not np.array_equal(expected_dates, got_dates) or not all(
+                        np.allclose(expected[field], got[field], rtol=1e-6, equal_nan=True) for field in expected):
+                    mismatched.append(step)
+
+        if not mismatched:
+            print(f"   ✅ {len(store.tickers)} 支 × {len(store.dates)} 日, 附加與重建後皆與 SQLite 一致")
+            return True
+        else:
+            print(f"   ❌ 第 {mismatched} 次同步後與 SQLite 不一致")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 欄位式價格存放區測試失敗: {e}")
+        return False
+
+def test_backtest():
+    """測試回測：向量化重播的入選名單與逐日呼叫 screen() 的結果一致"""
+    print("\n🧪 測試回測...")
+
+    try:
+        from backtest import evaluate, prepare, qualified_matrix
+        from screener import DEFAULT_RULES, screen
+
+        rng = np.random.default_rng(0)
+        n_days, tickers = 30, [f"{1000 + i}.TW" for i in range(40)]
+        close = rng.uniform(15, 60, len(tickers)) * np.cumprod(1 + rng.normal(0, 0.03, (n_days, len(tickers))), axis=0)
+        volume = rng.uniform(1e6, 6e6, (n_days, len(tickers)))
+        volume[3:8, 5] = np.nan
+        matrices = {'Open': close * 0.99, 'High': close, 'Low': close, 'Close': close, 'Volume': volume}
+        metrics, returns, benchmarks = prepare(matrices, horizons=(1, 5))
+        mask = qualified_matrix(metrics, DEFAULT_RULES)
+
+        dates = pd.bdate_range(end="2024-01-31", periods=n_days)
+        mismatched = []
+        for t in (4, 10, 20, 29):
+            window = slice(t - 4, t + 1)
+            data = pd.concat({ticker: pd.DataFrame({field: matrices[field][window, i] for field in matrices},
+                                                    index=dates[window]) for i, ticker in enumerate(tickers)}, axis=1)
+            expected = screen(data, tickers)['qualified'].to_numpy()
+            if not np.array_equal(expected, mask[t]):
+                mismatched.append(t)
+        stats, turnover = evaluate(mask, returns, benchmarks)
+
+        if not mismatched and mask.any() and stats[1]['signal_days'] > 0 and 0 <= turnover <= 100:
+            print(f"   ✅ 平均每日入選 {stats[1]['avg_picks']:.1f} 支, 週轉率 {turnover:.1f}%")
+            return True
+        else:
+            print(f"   ❌ 回測入選名單與 screen() 不一致: 第 {mismatched} 日")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 回測測試失敗: {e}")
+        return False
+
+def test_scheduler():
+    """測試常駐模式排程的觸發時間計算"""
+    print("\n⏰ 測試排程器...")
+
+    try:
+        from datetime import datetime
+        from scheduler import Job, TAIPEI
+
+        intraday = Job("intraday", lambda: None, every=30, between=("09:00", "13:30"))
+        # 週五收盤後，下一次盤中檢查應為下週一開盤
+        friday_close = datetime(2024, 1, 5, 13, 31, tzinfo=TAIPEI)
+        next_run = intraday.next_run(friday_close)
+        expected = datetime(2024, 1, 8, 9, 0, tzinfo=TAIPEI)
+        if len(intraday.times()) == 10 and next_run == expected:
+            print("   ✅ 觸發時間計算正確")
+            return True
+        else:
+            print(f"   ❌ 觸發時間異常: {next_run}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 排程器測試失敗: {e}")
+        return False
+
+def test_alerts():
+    """測試盤中警示：穿越門檻才觸發，冷卻時間內不重複"""
+    print("\n🔔 測試警示引擎...")
+
+    try:
+        from alerts import AlertEngine, AlertRule
+
+        rules = [
+            AlertRule("2330.TW", "price", "above", 600),
+            AlertRule("2330.TW", "price", "below", 580),
+            AlertRule("2317.TW", "change_pct", "below", -3),
+        ]
+        engine = AlertEngine(rules, cooldown=60)
+        tickers = ["2330.TW", "2317.TW"]
+
+        def tick(prices, changes, now):
+            fired = engine.evaluate(tickers, {"price": np.array(prices), "change_pct": np.array(changes)}, now=now)
+            return {(rule.ticker, rule.op) for rule in fired}
+
+        results = [
+            tick([590, 100], [0, 0], now=0),       # 建立基準
+            tick([601, 100], [0, -3.5], now=10),   # 2330 突破 600、2317 跌破 -3%
+            tick([599, 100], [0, 0], now=20),      # 回到門檻下
+            tick([602, 100], [0, 0], now=30),      # 冷卻中，不重複通知
+            tick([575, 100], [0, 0], now=100),     # 跌破 580
+        ]
+        expected = [set(), {("2330.TW", "above"), ("2317.TW", "below")}, set(), set(), {("2330.TW", "below")}]
+        if results == expected:
+            print("   ✅ 觸發、重新布防與冷卻行為正確")
+            return True
+        else:
+            print(f"   ❌ 警示結果異常: {results}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 警示引擎測試失敗: {e}")
+        return False
+
+def test_subscribers():
+    """測試訂閱者依設定分組，LINE 收件者每 500 人一批"""
+    print("\n👥 測試訂閱者分組...")
+
+    try:
+        import json
+        import tempfile
+        from subscribers import group_by_variant, load_subscribers, recipient_batches
+
+        items = [{"id": str(i), "line_user_id": f"U{i}"} for i in range(600)]
+        items.append({"id": "custom", "line_user_id": "Ucustom", "watchlist": ["2330.TW"],
+                      "rules": {"price": [500, 1000]}})
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(items, f)
+        subscribers = load_subscribers(f.name)
+        os.remove(f.name)
+
+        groups = group_by_variant(subscribers)
+        batches = [len(batch) for batch in recipient_batches(list(groups.values())[0])[0]]
+        if len(groups) == 2 and batches == [500, 100]:
+            print("   ✅ 分組與收件批次正確")
+            return True
+        else:
+            print(f"   ❌ 分組結果異常: {len(groups)} 組, 批次 {batches}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 訂閱者測試失敗: {e}")
+        return False
+
+def test_checkpoints():
+    """測試檢查點：--resume 跳過已完成的階段，只補送尚未送達的對象"""
+    print("\n⏭️  測試執行檢查點...")
+
+    try:
+        import tempfile
+        from checkpoints import RunCheckpoint
+
+        calls = []
+        with tempfile.TemporaryDirectory() as root:
+            first = RunCheckpoint('2024-01-31', root=root)
+            first.stage('universe', lambda: calls.append('universe') or ['2330.TW'])
+            first.stage('report', lambda: calls.append('report') or '❌', complete=lambda report: report != '❌')
+            first.confirm('discord')
+
+            resumed = RunCheckpoint('2024-01-31', resume=True, root=root)
+            universe = resumed.stage('universe', lambda: calls.append('universe') or [])
+            resumed.stage('report', lambda: calls.append('report') or '早報')
+            pending = [key for key in ('line', 'discord') if not resumed.delivered(key)]
+
+        if universe == ['2330.TW'] and calls == ['universe', 'report', 'report'] and pending == ['line']:
+            print("   ✅ 已完成的階段與推播都被略過")
+            return True
+        else:
+            print(f"   ❌ 檢查點結果異常: {calls}, 待送 {pending}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 檢查點測試失敗: {e}")
+        return False
+
+def test_prompt_builder():
+    """測試 Prompt 組裝：不超過 Token 預算，且保留分數最高的候選"""
+    print("\n🧮 測試 Prompt 預算...")
+
+    try:
+        from prompt_builder import pack_prompt
+
+        table = "代號|收盤|均量(張)|RSI|量比\n" + "\n".join(f"{1000 + i}|{50 - i * 0.1:.2f}|1200|55|1.3" for i in range(200))
+        calls = []
+
+        def counter(text):
+            calls.append(text)
+            return -(-len(text.encode('utf-8')) // 3)
+
+        prompt, tokens, used, total, exact = pack_prompt(lambda candidates: f"請分析以下候選:\n{candidates}",
+                                                         table, counter, budget=500)
+        rows = table.splitlines()[1:]
+        if exact and tokens <= 500 and 0 < used < total and prompt.endswith(rows[used - 1]) and len(calls) <= 4:
+            print(f"   ✅ {tokens} tokens, 放入 {used}/{total} 支, count_tokens {len(calls)} 次")
+            return True
+        else:
+            print(f"   ❌ Prompt 組裝異常: {tokens} tokens, {used}/{total} 支, {len(calls)} 次")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ Prompt 預算測試失敗: {e}")
+        return False
+
+def test_report_sections():
+    """測試分段報告：數字取自候選表格，模型虛構的代號被略過，失敗的段落附上提醒"""
+    print("\n🧩 測試分段報告...")
+
+    try:
+        from datetime import date
+        from report_sections import PARTIAL_NOTICE, render_report
+
+        market_data = "【美股收盤與 VOO】\n● 道瓊: 38150.30 (-0.82%)\n"
+        candidates = "代號|收盤|均量(張)|RSI|量比\n2303|48.5|52000|56|1.8\n2886|38.2|21000|61|1.2"
+        texts = {'us_news': "以下是新聞：\n● 聯準會維持利率不變", 'tw_news': "● 半導體設備訂單延伸至年底",
+                 'picks': "9999|虛構|不存在\n2303|聯電|成熟製程報價止穩"}
+        report = render_report(date(2024, 1, 31), market_data, candidates, texts)
+        partial = render_report(date(2024, 1, 31), market_data, candidates, dict(texts, tw_news=None))
+
+        expected = "● 2303 聯電\n收盤 48.5｜均量(張) 52000｜RSI 56｜量比 1.8\n理由：成熟製程報價止穩"
+        if expected in report and "9999" not in report and "以下是新聞" not in report \
+                and "● 道瓊: 38150.30 (-0.82%)" in report and PARTIAL_NOTICE not in report \
+                and PARTIAL_NOTICE in partial:
+            print("   ✅ 報告依原版面組合，數字來自本地資料")
+            return True
+        else:
+            print(f"   ❌ 分段報告內容異常:\n{report}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 分段報告測試失敗: {e}")
+        return False
+
+def test_stream_report():
+    """測試串流報告：以段落為單位送出 (不逐 token)，摘要在任何 Gemini 回覆前送出，串接後即完整報告"""
+    print("\n📡 測試串流報告...")
+
+    try:
+        import contextlib
+        import io
+        import threading
+        from types import SimpleNamespace
+
+        import stock_bot
+        from report_sections import SECTIONS
+
+        summary_sent = threading.Event()
+
+        class FakeModels:
+            def generate_content(self, model, contents, config):
+                # 摘要送出前不回覆：確認第一則訊息不必等任何一次 Gemini 呼叫
+                summary_sent.wait(5)
+                return SimpleNamespace(text="● 段落內容\n2303|聯電|成熟製程報價止穩", usage_metadata=None)
+
+            def count_tokens(self, model, contents):
+                return SimpleNamespace(total_tokens=len(contents))
+
+        parts = []
+
+        def on_section(part):
+            parts.append((part, summary_sent.is_set()))
+            summary_sent.set()
+
+        market_data = "【美股收盤與 VOO】\n● 道瓊: 38150.30 (-0.82%)\n"
+        candidates = "代號|收盤|均量(張)|RSI|量比\n2303|48.5|52000|56|1.8"
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = stock_bot.stream_report(SimpleNamespace(models=FakeModels()), market_data, candidates, on_section)
+
+        texts = [part for part, _ in parts]
+        if len(parts) == len(SECTIONS) + 1 and not parts[0][1] and "道瓊" in texts[0] \
+                and "\n\n".join(texts) == report:
+            print(f"   ✅ 摘要先送出，之後 {len(SECTIONS)} 個段落各送一次")
+            return True
+        else:
+            print(f"   ❌ 串流報告異常: {len(parts)} 次送出")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 串流報告測試失敗: {e}")
+        return False
+
+def test_report_cache():
+    """測試報告快取：主模型生成的完整報告寫入快取，改用備用模型生成的報告不寫入"""
+    print("\n🗃️  測試報告快取...")
+
+    try:
+        import contextlib
+        import io
+        from types import SimpleNamespace
+
+        import stock_bot
+
+        class FakeModels:
+            def __init__(self, primary_down):
+                self.primary_down = primary_down
+
+            def generate_content(self, model, contents, config):
+                if self.primary_down and model == stock_bot.REPORT_MODEL:
+                    raise ValueError("主模型無法使用")
+                # 新聞段落取 ● 開頭的行，精選個股取 代號|名稱|理由
+                return SimpleNamespace(text=f"● {model} 生成的段落\n2303|聯電|{model} 的理由", usage_metadata=None)
+
+            def count_tokens(self, model, contents):
+                return SimpleNamespace(total_tokens=len(contents))
+
+        market_data = "【美股收盤與 VOO】\n● 道瓊: 38150.30 (-0.82%)\n"
+        candidates = "代號|收盤|均量(張)|RSI|量比\n2303|48.5|52000|56|1.8"
+        stored = {}
+        original = stock_bot.get_cached_report, stock_bot.put_cached_report
+        stock_bot.get_cached_report, stock_bot.put_cached_report = stored.get, stored.__setitem__
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                fallback = stock_bot.generate_cached_report(
+                    SimpleNamespace(models=FakeModels(primary_down=True)), market_data, candidates)
+                after_fallback = len(stored)
+                primary = stock_bot.generate_cached_report(
+                    SimpleNamespace(models=FakeModels(primary_down=False)), market_data, candidates)
+        finally:
+            stock_bot.get_cached_report, stock_bot.put_cached_report = original
+
+        if "生成的段落" in fallback and after_fallback == 0 and list(stored.values()) == [primary]:
+            print("   ✅ 備用模型的報告未寫入快取，主模型恢復後重新生成並快取")
+            return True
+        else:
+            print(f"   ❌ 報告快取異常: 備用後 {after_fallback} 筆, 快取 {list(stored.values())}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 報告快取測試失敗: {e}")
+        return False
+
+def test_lazy_imports():
+    """測試 import stock_bot 不會載入大型套件 (各子命令用到時才載入)"""
+    print("\n🪶 測試延遲載入...")
+
+    try:
+        import subprocess
+        heavy = ('pandas', 'yfinance', 'google.genai', 'linebot', 'requests')
+        code = f"import sys, stock_bot; print(','.join(m for m in {heavy!r} if m in sys.modules))"
+        proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+        loaded = proc.stdout.strip()
+        if proc.returncode == 0 and not loaded:
+            print("   ✅ import stock_bot 未載入任何大型套件")
+            return True
+        else:
+            print(f"   ❌ 載入了: {loaded or proc.stderr.strip()}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 延遲載入測試失敗: {e}")
+        return False
+
+def test_chunker():
+    """測試訊息分段器 (只在段落或換行處切分) 與 LINE / Discord 的請求打包"""
+    print("\n✂️  測試訊息分段...")
+
+    try:
+        from chunker import (DISCORD_MAX_CONTENT, DISCORD_MAX_EMBED, DISCORD_MAX_EMBED_TOTAL, DISCORD_MAX_EMBEDS,
+                             LINE_MAX_MESSAGES_PER_PUSH, LINE_MAX_TEXT, pack_discord_payloads, pack_line_messages,
+                             split_message, utf16_length)
+
+        # 60 個段落，每段約 1180 字 (UTF-16)：LINE 每則 4 段共 15 則，Discord 一般訊息每則 1 段、embed 每個 3 段 (6000 字內每次請求只放得下 1 個)
+        report = "\n\n".join(
+            f"📰 段落 {i}\n" + "\n".join(f"● 第 {j} 則新聞重點" * 5 for j in range(20))
+            for i in range(60)
+        )
+        chunks = split_message(report, 2000)
+        lines = set(report.split("\n"))
+        if any(utf16_length(chunk) > 2000 for chunk in chunks):
+            print("   ❌ 分段超過長度上限")
+            return False
+        if any(line not in lines for chunk in chunks for line in chunk.split("\n") if line):
+            print("   ❌ 分段切斷了行")
+            return False
+
+        def joined(texts):
+            # 分段只在空行或換行處切開，去掉空行後依序接回應與原文相同
+            return [line for text in texts for line in text.split("\n") if line]
+
+        original = joined([report])
+        line_batches = pack_line_messages(report)
+        line_texts = [text for batch in line_batches for text in batch]
+        if [len(batch) for batch in line_batches] != [5, 5, 5] \
+                or any(len(batch) > LINE_MAX_MESSAGES_PER_PUSH for batch in line_batches) \
+                or any(utf16_length(text) > LINE_MAX_TEXT for text in line_texts) or joined(line_texts) != original:
+            print(f"   ❌ LINE 打包異常: {[len(batch) for batch in line_batches]} 則")
+            return False
+
+        embed_payloads = pack_discord_payloads(report)
+        embeds = [embed['description'] for payload in embed_payloads for embed in payload['embeds']]
+        if len(embed_payloads) != 20 or any(
+                len(payload['embeds']) > DISCORD_MAX_EMBEDS
+                or sum(utf16_length(embed['description']) for embed in payload['embeds']) > DISCORD_MAX_EMBED_TOTAL
+                for payload in embed_payloads) \
+                or any(utf16_length(text) > DISCORD_MAX_EMBED for text in embeds) or joined(embeds) != original:
+            print(f"   ❌ Discord embeds 打包異常: {len(embed_payloads)} 次請求")
+            return False
+
+        content_payloads = pack_discord_payloads(report, use_embeds=False)
+        contents = [payload['content'] for payload in content_payloads]
+        if len(content_payloads) != 60 or any(utf16_length(text) > DISCORD_MAX_CONTENT for text in contents) \
+                or joined(contents) != original or pack_discord_payloads("短訊息") != [{"content": "短訊息"}]:
+            print(f"   ❌ Discord 一般訊息打包異常: {len(content_payloads)} 次請求")
+            return False
+
+        print(f"   ✅ 共 {len(chunks)} 段, LINE {len(line_batches)} 次 push, "
+              f"Discord {len(embed_payloads)} 次請求 (embeds) / {len(content_payloads)} 次 (一般訊息)")
+        return True
+
+    except Exception as e:
+        print(f"   ❌ 訊息分段測試失敗: {e}")
+        return False
+
+def test_outbox():
+    """測試推播外送匣：限流後退避重試、同一對象依序送達；同一主題每天只送一個版本，
+    重跑時不重送已送達的分段，也不回報被取代的分段已送達"""
+    print("\n📮 測試推播外送匣...")
+
+    try:
+        import contextlib
+        import io
+        import tempfile
+        from types import SimpleNamespace
+
+        from outbox import Drainer, Outbox
+        from retry_policy import RetryPolicy
+
+        class RateLimited(Exception):
+            response = SimpleNamespace(status_code=429, headers={'Retry-After': '0'})
+
+        sent, limited = [], []
+
+        def send(channel, target, payload, key):
+            if not limited:
+                limited.append(key)
+                raise RateLimited("429 Too Many Requests")
+            sent.append((target, payload))
+
+        day = '2024-01-31'
+        messages = {'A': [f"A{i}" for i in range(4)], 'B': [f"B{i}" for i in range(3)]}
+        with tempfile.TemporaryDirectory() as root, contextlib.redirect_stdout(io.StringIO()):
+            outbox = Outbox(os.path.join(root, 'outbox.sqlite'))
+            drainer = Drainer(outbox, send, workers=2, policy=RetryPolicy(base_delay=0.01, max_delay=0.05)).start()
+            keys = [key for target, payloads in messages.items()
+                    for key in drainer.submit(day, 'Discord', target, 'report', payloads)]
+            statuses = drainer.wait(keys, timeout=10)
+            first = len(sent)
+            # 重跑時報告重新生成 (內容不同)，已完整送出舊版本的對象不應再送，回傳的仍是舊版本的分段
+            rerun = [key for target, payloads in messages.items()
+                     for key in drainer.submit(day, 'Discord', target, 'report',
+                                               [f"重新生成 {payload}" for payload in payloads])]
+            drainer.wait(rerun, timeout=10)
+            kept = len(sent) == first and rerun == keys
+
+            # 串流：段落接續編號，登記完整內容後以同一份報告重跑不再送
+            streamed = drainer.submit(day, 'Discord', 'C', 'report', ["C0", "C1"], stream='s1')
+            streamed += drainer.submit(day, 'Discord', 'C', 'report', ["C2"], stream='s1')
+            drainer.seal(day, 'Discord', 'C', 'report', 's1', ["C0", "C1", "C2"])
+            drainer.wait(streamed, timeout=10)
+            before = len(sent)
+            resumed = drainer.submit(day, 'Discord', 'C', 'report', ["C0", "C1", "C2"])
+            drainer.wait(resumed, timeout=10)
+            stream_ok = (resumed == streamed and len(sent) == before
+                         and [payload for target, payload in sent if target == 'C'] == ["C0", "C1", "C2"])
+            drainer.stop()
+
+            # 尚未送出的版本被較短的新版本取代：舊分段標為失敗，只回傳新版本的分段
+            old = outbox.enqueue(day, 'LINE', 'D', 'report', ["D0", "D1", "D2"])
+            new = outbox.enqueue(day, 'LINE', 'D', 'report', ["新 D0"])
+            replaced = outbox.statuses(old + new)
+            superseded = (set(old).isdisjoint(new) and [replaced[key] for key in old] == ['failed'] * 3
+                          and [replaced[key] for key in new] == ['pending'])
+            outbox.close()
+
+        in_order = all([payload for target, payload in sent if target == lane] == payloads
+                       for lane, payloads in messages.items())
+        if set(statuses.values()) == {'sent'} and in_order and first == 7 and kept and stream_ok and superseded:
+            print(f"   ✅ {first} 個分段依序送達 (限流重試 {len(limited)} 次)，重跑與串流後重跑都未重送，"
+                  f"被取代的分段不回報送達")
+            return True
+        else:
+            print(f"   ❌ 外送匣結果異常: {statuses}, 送出 {sent}, 沿用舊版本 {kept}, 串流 {stream_ok}, "
+                  f"取代 {superseded}")
+            return False
+
+    except Exception as e:
+        print(f"   ❌ 推播外送匣測試失敗: {e}")
+        return False
+
 def test_gemini_connection():
     """測試 Gemini AI 連線"""
     print("\n🤖 測試 Gemini AI 連線...")
@@ -207,7 +887,24 @@ def run_tests():
         ("環境變數", test_environment),
         ("資料連線", test_yfinance_connection),
         ("台股池", test_taiwan_stock_pool),
+        ("全市場股票池", test_universe),
+        ("分批下載", test_downloader),
         ("市場數據", test_market_data),
+        ("篩選引擎", test_screener),
+        ("技術指標", test_indicators),
+        ("價格存放區", test_price_store),
+        ("回測", test_backtest),
+        ("排程器", test_scheduler),
+        ("價格警示", test_alerts),
+        ("訂閱者分組", test_subscribers),
+        ("執行檢查點", test_checkpoints),
+        ("Prompt 預算", test_prompt_builder),
+        ("分段報告", test_report_sections),
+        ("串流報告", test_stream_report),
+        ("報告快取", test_report_cache),
+        ("延遲載入", test_lazy_imports),
+        ("訊息分段", test_chunker),
+        ("推播外送匣", test_outbox),
         ("Gemini AI", test_gemini_connection),
         ("Discord 連線", test_discord_connection)
     ]
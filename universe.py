@@ -0,0 +1,210 @@
+"""
+全市場股票池 - 以證交所 (上市) 與櫃買中心 (上櫃) 的公司基本資料 CSV 建立代號索引：
+代號 → 簡稱、市場 (.TW / .TWO)、產業別與上市狀態；索引以 numpy 結構化陣列存成 .npy，
+載入只需幾毫秒，下載價格前就能依市場與產業篩選出要處理的標的
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+from cache_paths import CACHE_DIR
+
+# 公開資訊觀測站的公司基本資料 (每日更新)；設定 UNIVERSE_LISTING_DIR 時改讀該目錄下的同名檔案 (離線測試用)
+LISTING_URLS = {
+    'TWSE': 'https://mopsfs.twse.com.tw/opendata/t187ap03_L.csv',
+    'TPEx': 'https://mopsfs.twse.com.tw/opendata/t187ap03_O.csv',
+}
+LISTING_DIR = os.environ.get('UNIVERSE_LISTING_DIR')
+MARKETS = ('TWSE', 'TPEx')
+MARKET_SUFFIXES = {'TWSE': '.TW', 'TPEx': '.TWO'}
+
+UNIVERSE_INDEX_PATH = os.path.join(CACHE_DIR, 'universe_index.npy')
+UNIVERSE_INDEX_VERSION = 1
+# 索引多久重建一次 (上市櫃名單每天只有少數異動)
+UNIVERSE_INDEX_TTL_HOURS = float(os.environ.get('UNIVERSE_INDEX_TTL_HOURS', 24))
+
+STATUS_LISTED, STATUS_DELISTED = 0, 1
+
+# 每支標的一列，依代號排序 (以二分搜尋查詢)；市場為 MARKETS 的位置，產業為官方產業別代碼
+INDEX_DTYPE = np.dtype([('code', 'U6'), ('name', 'U10'), ('market', 'u1'), ('industry', 'u1'), ('status', 'u1')])
+
+# 證交所 / 櫃買中心的產業別代碼
+INDUSTRY_NAMES = {
+    1: '水泥工業', 2: '食品工業', 3: '塑膠工業', 4: '紡織纖維', 5: '電機機械', 6: '電器電纜',
+    8: '玻璃陶瓷', 9: '造紙工業', 10: '鋼鐵工業', 11: '橡膠工業', 12: '汽車工業', 14: '建材營造業',
+    15: '航運業', 16: '觀光餐旅', 17: '金融保險業', 18: '貿易百貨業', 19: '綜合', 20: '其他業',
+    21: '化學工業', 22: '生技醫療業', 23: '油電燃氣業', 24: '半導體業', 25: '電腦及週邊設備業',
+    26: '光電業', 27: '通信網路業', 28: '電子零組件業', 29: '電子通路業', 30: '資訊服務業',
+    31: '其他電子業', 32: '文化創意業', 33: '農業科技業', 34: '電子商務', 35: '綠能環保',
+    36: '數位雲端', 37: '運動休閒', 38: '居家生活', 80: '管理股票', 91: '存託憑證',
+}
+
+
+def read_listing(market, listing_dir=LISTING_DIR):
+    """取得一個市場的公司基本資料 CSV 文字 (有 listing_dir 時讀本機檔案)"""
+    filename = LISTING_URLS[market].rsplit('/', 1)[-1]
+    if listing_dir:
+        with open(os.path.join(listing_dir, filename), encoding='utf-8-sig') as f:
+            return f.read()
+    import requests
+
+    response = requests.get(LISTING_URLS[market], timeout=30)
+    response.raise_for_status()
+    return response.content.decode('utf-8-sig')
+
+
+def parse_listing(text, market):
+    """CSV 文字 → [(代號, 簡稱, 市場, 產業別)]，只保留 4 位數字代號的普通股"""
+    rows = []
+    for record in csv.DictReader(io.StringIO(text)):
+        code = (record.get('公司代號') or '').strip()
+        if len(code) != 4 or not code.isdigit():
+            continue
+        name = (record.get('公司簡稱') or record.get('公司名稱') or '').strip()
+        industry = (record.get('產業別') or '').strip()
+        rows.append((code, name, MARKETS.index(market), int(industry) if industry.isdigit() else 0))
+    return rows
+
+
+def build_index(listings, previous=None):
+    """合併各市場的名單成索引；前一版索引中已不在名單上的代號保留並標為下市"""
+    entries = {code: (code, name, market, industry, STATUS_LISTED)
+               for rows in listings.values() for code, name, market, industry in rows}
+    if previous is not None:
+        for row in previous[~np.isin(previous['code'], list(entries))]:
+            entries[row['code']] = (row['code'], row['name'], row['market'], row['industry'], STATUS_DELISTED)
+    return np.array(sorted(entries.values()), dtype=INDEX_DTYPE)
+
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def save_index(index, path=UNIVERSE_INDEX_PATH):
+    """寫入 .npy 與記錄版本、建立時間的 .json (先寫暫存檔再替換)"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, index)
+    os.replace(tmp_path, path)
+    meta = {'version': UNIVERSE_INDEX_VERSION, 'built_at': time.time(), 'count': len(index)}
+    with open(f"{_meta_path(path)}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(f"{_meta_path(path)}.tmp", _meta_path(path))
+
+
+def load_index(path=UNIVERSE_INDEX_PATH):
+    """讀取索引，回傳 (索引, 建立時間)；不存在或格式不符時回傳 (None, None)"""
+    try:
+        with open(_meta_path(path), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != UNIVERSE_INDEX_VERSION:
+            return None, None
+        index = np.load(path, allow_pickle=False)
+    except (OSError, ValueError):
+        return None, None
+    if index.dtype != INDEX_DTYPE:
+        return None, None
+    return index, meta['built_at']
+
+
+def refresh_index(ttl_hours=UNIVERSE_INDEX_TTL_HOURS, path=UNIVERSE_INDEX_PATH, listing_dir=LISTING_DIR):
+    """回傳索引：未過期時直接載入，否則重新下載名單重建；下載失敗時沿用舊索引 (沒有舊索引則拋出錯誤)"""
+    index, built_at = load_index(path)
+    if index is not None and (time.time() - built_at) / 3600 < ttl_hours:
+        return index
+    try:
+        listings = {market: parse_listing(read_listing(market, listing_dir), market) for market in MARKETS}
+        if not all(listings.values()):
+            raise ValueError(f"名單為空: {', '.join(m for m, rows in listings.items() if not rows)}")
+    except Exception as e:
+        if index is None:
+            raise
+        print(f"   ⚠️ 上市櫃名單更新失敗，沿用舊索引: {e}")
+        return index
+    index = build_index(listings, previous=index)
+    save_index(index, path)
+    return index
+
+
+def industry_codes(industries):
+    """產業別名稱或代碼 → 代碼集合"""
+    by_name = {name: code for code, name in INDUSTRY_NAMES.items()}
+    codes = set()
+    for industry in industries:
+        industry = str(industry).strip()
+        if industry.isdigit():
+            codes.add(int(industry))
+        elif industry in by_name:
+            codes.add(by_name[industry])
+        else:
+            raise ValueError(f"未知的產業別: {industry}")
+    return codes
+
+
+def select(index, markets=None, industries=None, exclude_industries=(), include_delisted=False):
+    """依市場與產業篩選，回傳布林遮罩 (markets / industries 為 None 代表不限)"""
+    mask = np.ones(len(index), dtype=bool)
+    if not include_delisted:
+        mask &= index['status'] == STATUS_LISTED
+    if markets is not None:
+        mask &= np.isin(index['market'], [MARKETS.index(market) for market in markets])
+    if industries is not None:
+        mask &= np.isin(index['industry'], list(industry_codes(industries)))
+    if exclude_industries:
+        mask &= ~np.isin(index['industry'], list(industry_codes(exclude_industries)))
+    return mask
+
+
+def tickers(index, mask=None):
+    """索引 (或遮罩選出的部分) → yfinance 代號清單，例如 2330.TW、6488.TWO"""
+    rows = index if mask is None else index[mask]
+    suffixes = np.array([MARKET_SUFFIXES[market] for market in MARKETS])
+    return np.char.add(rows['code'], suffixes[rows['market']]).tolist()
+
+
+def lookup(index, code):
+    """以代號 (可含 .TW / .TWO) 查詢，回傳 {code, name, market, industry, status}，找不到時回傳 None"""
+    code = code.split('.')[0]
+    i = np.searchsorted(index['code'], code)
+    if i == len(index) or index['code'][i] != code:
+        return None
+    row = index[i]
+    return {'code': str(row['code']), 'name': str(row['name']), 'market': MARKETS[row['market']],
+            'industry': INDUSTRY_NAMES.get(int(row['industry']), str(row['industry'])),
+            'status': 'delisted' if row['status'] == STATUS_DELISTED else 'listed'}
+
+
+def full_market_pool(markets=MARKETS, industries=None, exclude_industries=(), ttl_hours=UNIVERSE_INDEX_TTL_HOURS):
+    """全市場股票池：依市場與產業篩選後的 yfinance 代號清單"""
+    index = refresh_index(ttl_hours)
+    return tickers(index, select(index, markets, industries, exclude_industries))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="全市場股票池索引")
+    parser.add_argument('--refresh', action='store_true', help="忽略有效期，重新下載上市櫃名單")
+    parser.add_argument('--markets', nargs='+', choices=MARKETS, default=list(MARKETS), help="市場")
+    parser.add_argument('--industries', nargs='+', help="產業別名稱或代碼 (預設不限)")
+    parser.add_argument('--lookup', nargs='+', help="查詢代號")
+    args = parser.parse_args()
+
+    index = refresh_index(ttl_hours=0 if args.refresh else UNIVERSE_INDEX_TTL_HOURS)
+    if args.lookup:
+        for code in args.lookup:
+            print(f"{code}: {lookup(index, code) or '查無此代號'}")
+    else:
+        mask = select(index, args.markets, args.industries)
+        print(f"📇 索引共 {len(index)} 支 (下市 {int((index['status'] == STATUS_DELISTED).sum())} 支)，"
+              f"篩選後 {int(mask.sum())} 支")
+        for market in args.markets:
+            count = int((mask & (index['market'] == MARKETS.index(market))).sum())
+            print(f"   {market}: {count} 支")
+        industries, counts = np.unique(index['industry'][mask], return_counts=True)
+        for industry, count in sorted(zip(industries, counts), key=lambda item: -item[1]):
+            print(f"   {INDUSTRY_NAMES.get(int(industry), str(industry))}: {count} 支")